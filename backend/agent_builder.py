@@ -1,15 +1,22 @@
-from langgraph.graph import END, StateGraph
+from langgraph.graph import START, END, StateGraph
+from langgraph.types import StreamWriter
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_community.vectorstores import FAISS
-from typing import TypedDict, Annotated, Sequence, List, Dict, Any
+from typing import TypedDict, Annotated, AsyncIterator, Sequence, List, Dict, Any
 import operator
 import os
+import time
+import asyncio
 import logging
 import dotenv
 import requests
 from urllib.parse import quote
-from .config import MODEL_CONFIG, VECTOR_STORE_PATH, TEMP_DIR, update_model_config, ensure_dir_exists
+from .config import ANSWER_IMAGES_ENABLED, MODEL_CONFIG, LENGTH_GUIDE, SEMANTIC_REUSE_CONFIG, VECTOR_STORE_PATH, TEMP_DIR, update_model_config, ensure_dir_exists
 from .model_factory import model_factory, get_model_strategy
+from .vector_store_manager import get_index_selection, get_vectorstore, get_vector_store_manager
+from .retrieval import ahybrid_search
+from .index_registry import get_embedding_model
+from .semantic_answers import semantic_answers
 
 # 加载.env文件
 dotenv.load_dotenv()
@@ -31,6 +38,8 @@ class AgentState(TypedDict):
     length: str
     context: Annotated[Sequence[str], operator.add]
     answer: str
+    provider: str  # 生成回答实际使用的模型提供商
+    error: str  # 生成回答失败时的错误信息，此时answer只是给用户看的提示
     thoughts: Annotated[Sequence[str], operator.add]
     images: Annotated[Sequence[Dict[str, str]], operator.add]  # 存储图片信息，包含URL和描述
 
@@ -82,100 +91,144 @@ def collect_images_for_question(question: str, max_images: int = 3) -> List[Dict
         logger.error(f"收集图片时出错: {str(e)}")
         return []  # 出错时返回空列表
 
+def open_index(preferred_provider: str):
+    """
+    选择并加载检索用的索引（读取磁盘，异步代码中应在线程池中调用）
+    
+    Returns:
+        提供商名称、索引清单、嵌入模型、向量存储和关键词索引
+    """
+    # 选择索引：查询必须使用构建该索引的嵌入提供商和模型，优先使用当前策略的提供商
+    index_provider, manifest = get_index_selection(preferred_provider)
+    embedding_model = get_embedding_model(index_provider)
+    logger.info(f"使用 {index_provider} 索引（{manifest['model']}，{manifest['dim']}维）")
+    
+    # 获取常驻内存的共享向量存储和关键词索引（索引更新后会自动重新加载）
+    vectorstore = get_vectorstore(index_provider)
+    lexical_index = get_vector_store_manager(index_provider).lexical_index
+    return index_provider, manifest, embedding_model, vectorstore, lexical_index
+
+def open_question_embedding(preferred_provider: str):
+    """
+    获取与检索相同的嵌入模型，用于查找相似问题（读取磁盘，异步代码中应在线程池中调用）
+    
+    问题的嵌入向量会进入嵌入缓存，随后检索时不再重复请求。
+    """
+    index_provider, _ = get_index_selection(preferred_provider)
+    return get_embedding_model(index_provider)
+
 # 创建智能体工作流
 def create_agent_workflow():
+    # 0. 复用相似问题的回答
+    async def reuse_answer(state: AgentState, writer: StreamWriter) -> Dict[str, Any]:
+        if not SEMANTIC_REUSE_CONFIG["enabled"]:
+            return {}
+        
+        try:
+            model_strategy = get_model_strategy(MODEL_CONFIG.get("provider", "auto"), operation="embed")
+            embedding_model = await asyncio.to_thread(open_question_embedding, model_strategy.provider)
+            match = await semantic_answers.afind(
+                state["question"],
+                state["tone"],
+                state["length"],
+                embedding_model.model,
+                embedding_model.aembed_query
+            )
+        except Exception as e:
+            logger.warning(f"查找相似问题时出错: {str(e)}，执行完整流程")
+            return {}
+        
+        if match is None:
+            return {}
+        
+        logger.info(f"问题与已回答的“{match.question[:30]}”相似度 {match.similarity:.3f}，复用已有回答")
+        thoughts = [f"与此前回答过的问题“{match.question}”高度相似（相似度 {match.similarity:.2f}），复用已有回答"]
+        answer, provider = match.answer, match.provider
+        
+        if SEMANTIC_REUSE_CONFIG["mode"] == "adapt":
+            # 以已有回答为唯一参考，按新问题的措辞改写，不再检索和分析
+            chunks = []
+            try:
+                model_strategy = get_model_strategy(MODEL_CONFIG.get("provider", "auto"), operation="generate")
+                async for chunk in model_strategy.astream_answer(
+                    question=state["question"],
+                    context=[f"相似问题“{match.question}”的已有回答：\n{match.answer}"],
+                    tone=state["tone"],
+                    word_count=LENGTH_GUIDE.get(state["length"], "800-1200字")
+                ):
+                    chunks.append(chunk)
+                    writer({"type": "token", "text": chunk})
+                return {"answer": "".join(chunks), "provider": model_strategy.served_by().provider, "thoughts": thoughts}
+            except Exception as e:
+                if chunks:
+                    # 已经推送了部分改写内容，再推送已有回答会让两者拼在一起，只返回已改写的部分并标记错误
+                    logger.error(f"改写已有回答时出错: {str(e)}，只返回已改写的部分")
+                    return {"answer": "".join(chunks), "error": str(e), "thoughts": thoughts}
+                logger.warning(f"改写已有回答时出错: {str(e)}，直接返回已有回答")
+        
+        writer({"type": "token", "text": answer})
+        return {"answer": answer, "provider": provider, "thoughts": thoughts}
+    
+    async def remember_answer(state: AgentState, answer: str, provider: str):
+        """把新生成的回答存入语义索引，供之后的相似问题复用"""
+        try:
+            model_strategy = get_model_strategy(MODEL_CONFIG.get("provider", "auto"), operation="embed")
+            embedding_model = await asyncio.to_thread(open_question_embedding, model_strategy.provider)
+            embedding = await embedding_model.aembed_query(state["question"])
+            await asyncio.to_thread(
+                semantic_answers.add,
+                state["question"],
+                state["tone"],
+                state["length"],
+                embedding_model.model,
+                embedding,
+                answer,
+                provider
+            )
+        except Exception as e:
+            logger.warning(f"保存回答到语义索引时出错: {str(e)}")
+    
     # 1. 检索知识
-    def retrieve(state: AgentState) -> Dict[str, Any]:
+    async def retrieve(state: AgentState) -> Dict[str, Any]:
         logger.debug(f"开始检索知识，问题: {state['question'][:50]}...")
         
-        # 确保知识库存在
-        from .knowledge_loader import get_default_knowledge_base
-        logger.debug("调用get_default_knowledge_base确保知识库存在")
-        get_default_knowledge_base()
-        
         try:
             # 获取当前配置的模型策略
-            model_strategy = get_model_strategy(MODEL_CONFIG.get("provider", "auto"))
+            model_strategy = get_model_strategy(MODEL_CONFIG.get("provider", "auto"), operation="embed")
             
-            logger.info(f"使用模型策略: {model_strategy.__class__.__name__}")
+            logger.info(f"使用模型策略: {model_strategy.provider}")
             
-            # 尝试使用模型策略获取嵌入向量
             try:
-                # 创建一个临时文本用于测试嵌入功能
-                test_text = "测试嵌入功能"
-                _ = model_strategy.get_embeddings([test_text])
-                logger.info(f"嵌入功能测试成功，使用 {model_strategy.__class__.__name__} 进行检索")
-                
-                # 加载向量存储
-                from langchain_community.embeddings import FakeEmbeddings
-                
-                # 使用FakeEmbeddings初始化向量存储，然后再替换为实际的嵌入模型
-                # 这是因为FAISS.load_local需要一个嵌入模型，但我们实际上会使用自己的嵌入逻辑
-                temp_embeddings = FakeEmbeddings(size=1536)
-                
-                logger.debug(f"开始加载向量存储，路径: {VECTOR_STORE_PATH}")
-                
-                vectorstore = FAISS.load_local(
-                    VECTOR_STORE_PATH, 
-                    temp_embeddings,
-                    allow_dangerous_deserialization=True
+                index_provider, manifest, embedding_model, vectorstore, lexical_index = await asyncio.to_thread(
+                    open_index, model_strategy.provider
                 )
-                logger.debug("向量存储加载成功")
-                
-                # 使用我们的模型策略获取问题的嵌入向量
-                question_embedding = model_strategy.get_embeddings([state["question"]])[0]
-                
-                # 执行相似度搜索
-                logger.debug(f"执行相似度搜索，问题: {state['question'][:50]}...")
-                
-                # 使用FAISS的原始搜索方法，传入我们自己生成的嵌入向量
-                docs_with_scores = vectorstore.similarity_search_with_score_by_vector(
-                    question_embedding, 
-                    k=5
+            except FileNotFoundError:
+                # 还没有任何知识库时创建默认知识库，之后的请求直接使用
+                from .knowledge_loader import get_default_knowledge_base
+                logger.debug("没有可用的索引，调用get_default_knowledge_base创建默认知识库")
+                await asyncio.to_thread(get_default_knowledge_base)
+                index_provider, manifest, embedding_model, vectorstore, lexical_index = await asyncio.to_thread(
+                    open_index, model_strategy.provider
                 )
-                
-                # 提取文档
-                docs = [doc for doc, _ in docs_with_scores]
-                
-                logger.debug(f"相似度搜索完成，返回 {len(docs)} 条结果")
-                
-                # 提取相关内容
-                contexts = [d.page_content for d in docs]
-                logger.info(f"检索到 {len(contexts)} 条相关知识")
-                logger.debug(f"第一条知识: {contexts[0][:100]}..." if contexts else "无检索结果")
-            except Exception as e:
-                logger.error(f"使用模型策略进行检索时出错: {str(e)}")
-                logger.warning("尝试使用标准FAISS检索方法")
-                
-                # 如果使用模型策略失败，回退到标准FAISS检索方法
-                from langchain_community.embeddings import FakeEmbeddings
-                
-                # 使用FakeEmbeddings作为后备方案
-                embedding_model = FakeEmbeddings(size=1536)  # 使用1536维向量，与OpenAI兼容
-                
-                # 加载向量存储
-                logger.debug(f"开始加载向量存储，路径: {VECTOR_STORE_PATH}")
-                logger.debug(f"使用的嵌入模型类型: {type(embedding_model).__name__}")
-                
-                vectorstore = FAISS.load_local(
-                    VECTOR_STORE_PATH, 
-                    embedding_model,
-                    allow_dangerous_deserialization=True
-                )
-                logger.debug("向量存储加载成功")
-                
-                # 执行相似度搜索
-                logger.debug(f"执行相似度搜索，问题: {state['question'][:50]}...")
-                docs = vectorstore.similarity_search(state["question"], k=5)
-                logger.debug(f"相似度搜索完成，返回 {len(docs)} 条结果")
-                
-                # 提取相关内容
-                contexts = [d.page_content for d in docs]
-                logger.info(f"检索到 {len(contexts)} 条相关知识")
-                logger.debug(f"第一条知识: {contexts[0][:100]}..." if contexts else "无检索结果")
+            
+            # 向量检索与BM25关键词检索融合；嵌入不可用或过慢时只使用关键词检索
+            logger.debug(f"执行混合检索，问题: {state['question'][:50]}...")
+            result = await ahybrid_search(
+                vectorstore,
+                lexical_index,
+                state["question"],
+                index_provider,
+                embedding_model.aembed_query,
+                manifest["dim"]
+            )
+            
+            # 提取相关内容
+            contexts = [d.page_content for d in result.documents]
+            logger.info(f"检索到 {len(contexts)} 条相关知识（{result.mode}）")
+            logger.debug(f"第一条知识: {contexts[0][:100]}..." if contexts else "无检索结果")
             
             # 添加思考过程
-            thoughts = [f"已从知识库中检索到 {len(contexts)} 条相关信息"]
+            thoughts = [f"已从知识库中检索到 {len(contexts)} 条相关信息（检索方式: {result.mode}，耗时 {result.latency * 1000:.1f}ms，其中重排序 {result.rerank_latency * 1000:.1f}ms）"]
             
             return {
                 "context": contexts,
@@ -189,12 +242,12 @@ def create_agent_workflow():
             }
     
     # 2. 收集图片
-    def collect_images(state: AgentState) -> Dict[str, Any]:
+    async def collect_images(state: AgentState) -> Dict[str, Any]:
         try:
             logger.info(f"开始为问题收集图片: {state['question'][:50]}...")
             
             # 调用图片收集函数
-            images = collect_images_for_question(state["question"])
+            images = await asyncio.to_thread(collect_images_for_question, state["question"])
             
             if images:
                 logger.info(f"成功收集到 {len(images)} 张相关图片")
@@ -217,15 +270,15 @@ def create_agent_workflow():
             }
     
     # 3. 分析问题
-    def analyze_question(state: AgentState) -> Dict[str, Any]:
+    async def analyze_question(state: AgentState) -> Dict[str, Any]:
         try:
             # 获取当前配置的模型策略
-            model_strategy = get_model_strategy(MODEL_CONFIG.get("provider", "auto"))
+            model_strategy = get_model_strategy(MODEL_CONFIG.get("provider", "auto"), operation="analyze")
             
-            logger.info(f"使用模型策略: {model_strategy.__class__.__name__} 分析问题")
+            logger.info(f"使用模型策略: {model_strategy.provider} 分析问题")
             
             # 使用模型策略分析问题
-            analysis = model_strategy.analyze_question(
+            analysis = await model_strategy.aanalyze_question(
                 question=state["question"],
                 tone=state["tone"],
                 length=state["length"]
@@ -241,67 +294,80 @@ def create_agent_workflow():
             return {"thoughts": [f"分析问题时出错: {str(e)}，将使用简单分析继续"]}
     
     # 4. 生成回答
-    def generate_response(state: AgentState) -> Dict[str, Any]:
+    async def generate_response(state: AgentState, writer: StreamWriter) -> Dict[str, Any]:
         # 根据长度设置字数范围
-        length_guide = {
-            "简短": "300-500字",
-            "中等": "800-1200字",
-            "详细": "1500-2500字"
-        }
-        word_count = length_guide.get(state["length"], "800-1200字")
+        word_count = LENGTH_GUIDE.get(state["length"], "800-1200字")
         
         try:
             # 获取当前配置的模型策略
-            model_strategy = get_model_strategy(MODEL_CONFIG.get("provider", "auto"))
+            model_strategy = get_model_strategy(MODEL_CONFIG.get("provider", "auto"), operation="generate")
             
-            logger.info(f"使用模型策略: {model_strategy.__class__.__name__} 生成回答")
+            logger.info(f"使用模型策略: {model_strategy.provider} 生成回答")
             
-            # 准备图片信息
+            # 准备图片信息（图片由并行的collect_images节点写入，未启用时不加入回答）
+            images = (state.get('images') or []) if ANSWER_IMAGES_ENABLED else []
             image_info = ""
-            if hasattr(state, 'images') and state.get('images'):
+            if images:
                 image_info = "\n\n图片资源:\n"
-                for i, img in enumerate(state['images']):
+                for i, img in enumerate(images):
                     image_info += f"- 图片{i+1}: {img['url']} - {img['description']}\n"
-                logger.info(f"将 {len(state['images'])} 张图片信息添加到回答中")
+                logger.info(f"将 {len(images)} 张图片信息添加到回答中")
             
-            # 使用模型策略生成回答
-            answer = model_strategy.generate_answer(
+            # 使用模型策略流式生成回答，每个片段作为custom事件推送给调用方
+            chunks = []
+            async for chunk in model_strategy.astream_answer(
                 question=state["question"],
                 context=state["context"] + ([image_info] if image_info else []),
                 tone=state["tone"],
                 word_count=word_count
-            )
+            ):
+                chunks.append(chunk)
+                writer({"type": "token", "text": chunk})
+            answer = "".join(chunks)
             
             # 如果有图片，在回答中添加图片引用
-            if hasattr(state, 'images') and state.get('images'):
+            if images:
                 # 在回答末尾添加图片引用
-                answer += "\n\n## 相关图片\n"
-                for i, img in enumerate(state['images']):
-                    answer += f"\n![{img['description']}]({img['url']})\n"
+                image_section = "\n\n## 相关图片\n"
+                for i, img in enumerate(images):
+                    image_section += f"\n![{img['description']}]({img['url']})\n"
+                answer += image_section
+                writer({"type": "token", "text": image_section})
             
             logger.info("回答生成完成")
             logger.debug(f"回答结果: {answer[:100]}...")
             
-            return {"answer": answer}
+            # 熔断切换或对冲胜出时，实际生成回答的是备用提供商
+            provider = model_strategy.served_by().provider
+            if SEMANTIC_REUSE_CONFIG["enabled"]:
+                await remember_answer(state, answer, provider)
+            
+            return {"answer": answer, "provider": provider}
             
         except Exception as e:
             logger.error(f"生成回答时出错: {str(e)}")
-            return {"answer": f"生成回答时出错: {str(e)}，请检查API密钥设置或网络连接。"}
+            return {"answer": f"生成回答时出错: {str(e)}，请检查API密钥设置或网络连接。", "error": str(e)}
     
-    # 构建工作流
+    # 构建工作流（节点都是协程，用ainvoke执行，多个问题可以在同一个事件循环中并发处理）
     workflow = StateGraph(AgentState)
     
     # 添加节点
+    workflow.add_node("reuse", reuse_answer)
     workflow.add_node("retrieve", retrieve)
     workflow.add_node("collect_images", collect_images)
     workflow.add_node("analyze", analyze_question)
     workflow.add_node("generate", generate_response)
     
-    # 设置边
-    workflow.set_entry_point("retrieve")
-    workflow.add_edge("retrieve", "collect_images")
-    workflow.add_edge("collect_images", "analyze")
-    workflow.add_edge("analyze", "generate")
+    # 设置边：先查找可以复用的相似问题回答，找到时直接结束；
+    # 否则检索、收集图片和分析问题互不依赖，并行执行（扇出）；
+    # 生成回答等三者都完成后再执行（扇入），各节点写入的context、thoughts、images由归并函数合并
+    workflow.add_edge(START, "reuse")
+    workflow.add_conditional_edges(
+        "reuse",
+        lambda state: END if state.get("answer") else ["retrieve", "collect_images", "analyze"],
+        [END, "retrieve", "collect_images", "analyze"]
+    )
+    workflow.add_edge(["retrieve", "collect_images", "analyze"], "generate")
     workflow.add_edge("generate", END)
     
     return workflow.compile()
@@ -314,4 +380,38 @@ def get_agent_executor():
     if _agent_executor is None:
         logger.info("创建新的智能体执行器")
         _agent_executor = create_agent_workflow()
-    return _agent_executor
\ No newline at end of file
+    return _agent_executor
+
+async def astream_agent(inputs: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    以流式方式运行智能体，边执行边产出进度事件
+    
+    事件类型：
+    - node: 某个节点执行完成，包含节点名 node 和该节点新增的 thoughts
+    - token: 回答的增量片段，包含 text
+    - done: 全部完成，包含完整回答 answer、首个片段到达的耗时 ttft（秒，没有片段时为None）和总耗时 latency
+    
+    Args:
+        inputs: 智能体的输入，包含 question、tone 和 length
+    """
+    agent = get_agent_executor()
+    start_time = time.perf_counter()
+    ttft = None
+    answer = ""
+    
+    async for mode, payload in agent.astream(inputs, stream_mode=["updates", "custom"]):
+        if mode == "custom":
+            if ttft is None and payload.get("type") == "token":
+                ttft = time.perf_counter() - start_time
+                logger.info(f"首个回答片段耗时 {ttft:.2f}s")
+            yield payload
+            continue
+        for node, update in payload.items():
+            update = update or {}
+            if "answer" in update:
+                answer = update["answer"]
+            yield {"type": "node", "node": node, "thoughts": list(update.get("thoughts", []))}
+    
+    latency = time.perf_counter() - start_time
+    logger.info(f"回答生成完成，首个片段 {f'{ttft:.2f}s' if ttft is not None else '无'}，总耗时 {latency:.2f}s")
+    yield {"type": "done", "answer": answer, "ttft": ttft, "latency": latency}
@@ -1,6 +1,8 @@
 import os
 import logging
 from typing import List, Optional, Any, Dict
+from .embedding_cache import embedding_cache
+from .embedding_batching import embed_in_batches
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -31,41 +33,42 @@ class AliTextEmbeddings:
         Returns:
             List[float]: 嵌入向量
         """
+        return self.embed_documents([text])[0]
+    
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """调用阿里云嵌入API，一次请求获取一个批次文本的嵌入向量"""
         try:
             import dashscope
             from dashscope import TextEmbedding
             
             dashscope.api_key = self.api_key
             
+            # input传入列表即为批量嵌入
             response = TextEmbedding.call(
                 model=self.model_name,
-                input=text
+                input=texts
             )
             
             if response.status_code == 200:
                 # 根据阿里云API的实际响应格式进行解析
                 if hasattr(response.output, 'embeddings') and len(response.output.embeddings) > 0:
-                    embedding = response.output.embeddings[0].embedding
-                    return embedding
+                    items = [{"text_index": item.text_index, "embedding": item.embedding} for item in response.output.embeddings]
                 elif isinstance(response.output, dict) and 'embeddings' in response.output:
-                    embedding = response.output['embeddings'][0]['embedding']
-                    return embedding
+                    items = response.output['embeddings']
+                elif isinstance(response.output, dict) and 'data' in response.output:
+                    items = response.output['data']
                 else:
-                    # 尝试直接从响应中获取嵌入向量
                     logger.debug(f"阿里云嵌入API响应格式: {type(response.output)}")
                     logger.debug(f"阿里云嵌入API响应内容: {response.output}")
-                    
-                    # 如果是字典类型，尝试从不同的字段获取嵌入向量
-                    if isinstance(response.output, dict):
-                        if 'embedding' in response.output:
-                            return response.output['embedding']
-                        elif 'data' in response.output and len(response.output['data']) > 0:
-                            if 'embedding' in response.output['data'][0]:
-                                return response.output['data'][0]['embedding']
-                    
-                    # 如果无法解析，返回一个空向量
+                    items = []
+                
+                if len(items) != len(texts) or not all('embedding' in item for item in items):
                     logger.error(f"无法从阿里云嵌入API响应中解析嵌入向量: {response.output}")
-                    return [0.0] * 1536  # 返回1536维的零向量作为后备方案
+                    raise ValueError("无法从阿里云嵌入API响应中解析嵌入向量")
+                
+                # 按text_index还原输入顺序
+                items = sorted(items, key=lambda item: item.get('text_index', item.get('index', 0)))
+                return [item['embedding'] for item in items]
             else:
                 logger.error(f"阿里云嵌入API响应异常: {response.message}")
                 raise ValueError(f"阿里云嵌入API响应异常: {response.message}")
@@ -84,10 +87,8 @@ class AliTextEmbeddings:
         Returns:
             List[List[float]]: 嵌入向量列表
         """
-        embeddings = []
-        
-        for text in texts:
-            embedding = self.embed_query(text)
-            embeddings.append(embedding)
-        
-        return embeddings
\ No newline at end of file
+        return embedding_cache.get_or_compute("qwen", self.model_name, texts, self._embed_documents_uncached)
+    
+    def _embed_documents_uncached(self, texts: List[str]) -> List[List[float]]:
+        """按阿里云接口的批量上限分批获取多个文本的嵌入向量"""
+        return embed_in_batches("qwen", texts, self._embed_batch)
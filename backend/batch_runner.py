@@ -0,0 +1,162 @@
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+from .config import BATCH_CONFIG, HEDGING_CONFIG, MODEL_CONFIG, RESPONSE_CACHE_CONFIG, ensure_dir_exists
+from .provider_stats import prompt_cache_stats, provider_performance
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 文件名中不能出现的字符
+_UNSAFE_FILE_CHARS = re.compile(r'[\\/:*?"<>|\s]+')
+
+
+def answer_file_path(question: str, output_dir: str = BATCH_CONFIG["output_dir"]) -> str:
+    """回答的保存路径，与发布失败时的备份文件一致取问题的前20个字符"""
+    name = _UNSAFE_FILE_CHARS.sub("_", question[:20]).strip("_") or "answer"
+    return os.path.join(output_dir, f"{name}.md")
+
+
+def load_questions(path: str) -> List[str]:
+    """从文件读取问题，每行一个，忽略空行和以#开头的行"""
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [line.strip() for line in f]
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+def _prepare() -> str:
+    """
+    整批只做一次的准备工作：确认知识库存在、加载向量存储和关键词索引、创建模型策略（建立连接池）并编译工作流
+
+    Returns:
+        str: 生成回答使用的模型提供商
+    """
+    from .knowledge_loader import get_default_knowledge_base
+    from .model_factory import get_model_strategy
+    from .agent_builder import get_agent_executor, open_index
+
+    get_default_knowledge_base()
+    model_strategy = get_model_strategy(MODEL_CONFIG.get("provider", "auto"))
+    try:
+        open_index(model_strategy.provider)
+    except FileNotFoundError as e:
+        logger.warning(f"没有可用的索引，将只使用通用知识回答: {str(e)}")
+    get_agent_executor()
+    return model_strategy.provider
+
+
+async def _answer_one(
+    agent,
+    question: str,
+    tone: str,
+    length: str,
+    output_dir: str,
+    semaphore: asyncio.Semaphore
+) -> Dict[str, Any]:
+    """生成一个问题的回答并保存，返回该问题的汇总记录"""
+    async with semaphore:
+        start_time = time.perf_counter()
+        record: Dict[str, Any] = {
+            "question": question,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        }
+        try:
+            result = await agent.ainvoke({"question": question, "tone": tone, "length": length})
+            if result.get("error"):
+                raise RuntimeError(result["error"])
+            answer = result.get("answer", "")
+            path = answer_file_path(question, output_dir)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(f"# {question}\n\n{answer}")
+            record.update(status="ok", provider=result.get("provider"), file=path, answer_chars=len(answer))
+        except Exception as e:
+            logger.error(f"问题 {question[:30]} 生成回答时出错: {str(e)}")
+            record.update(status="error", provider=None, error=str(e))
+        record["latency"] = round(time.perf_counter() - start_time, 3)
+        logger.info(f"[{record['status']}] {question[:30]} 耗时 {record['latency']:.1f}s（{record.get('provider')}）")
+        return record
+
+
+async def arun_batch(
+    questions: List[str],
+    tone: str,
+    length: str,
+    concurrency: int = BATCH_CONFIG["concurrency"],
+    output_dir: str = BATCH_CONFIG["output_dir"],
+    summary_path: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    在同一个事件循环中并发地为一批问题生成回答
+
+    每个回答保存为 output_dir 下的Markdown文件；每完成一个问题就向汇总文件追加一行JSON，
+    包含问题、状态、使用的模型提供商、耗时和回答文件路径，中途退出时已完成的记录不会丢失。
+
+    Args:
+        questions: 问题列表
+        tone: 回答风格
+        length: 回答长度
+        concurrency: 同时处理的问题数
+        output_dir: 回答的保存目录
+        summary_path: JSONL汇总文件路径，默认为 output_dir/batch_时间戳.jsonl
+
+    Returns:
+        List[Dict[str, Any]]: 每个问题的汇总记录，顺序与questions一致
+    """
+    from .agent_builder import get_agent_executor
+
+    ensure_dir_exists(output_dir)
+    summary_path = summary_path or os.path.join(output_dir, f"batch_{time.strftime('%Y%m%d_%H%M%S')}.jsonl")
+    questions = list(dict.fromkeys(questions))
+
+    batch_start = time.perf_counter()
+    provider = await asyncio.to_thread(_prepare)
+    logger.info(f"批量生成 {len(questions)} 个问题的回答，并发数 {concurrency}，模型提供商 {provider}")
+
+    agent = get_agent_executor()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    tasks = [
+        asyncio.ensure_future(_answer_one(agent, question, tone, length, output_dir, semaphore))
+        for question in questions
+    ]
+    with open(summary_path, "a", encoding="utf-8") as summary:
+        for task in asyncio.as_completed(tasks):
+            record = await task
+            summary.write(json.dumps(record, ensure_ascii=False) + "\n")
+            summary.flush()
+
+    records = [task.result() for task in tasks]
+    succeeded = sum(1 for record in records if record["status"] == "ok")
+    logger.info(
+        f"批量生成完成：成功 {succeeded}/{len(records)}，总耗时 {time.perf_counter() - batch_start:.1f}s，"
+        f"汇总已写入 {summary_path}"
+    )
+    if MODEL_CONFIG.get("provider", "auto") == "auto":
+        for name, operations in provider_performance.snapshot().items():
+            summary = "，".join(
+                f"{operation} 平均 {stats['latency']:.2f}s 错误率 {stats['error_rate']:.0%}（{stats['samples']} 次）"
+                for operation, stats in operations.items()
+            )
+            logger.info(f"提供商 {name}：{summary}")
+    for model, stats in prompt_cache_stats.snapshot().items():
+        logger.info(
+            f"{model} 提示词 {stats['prompt_tokens']} tokens，命中前缀缓存 {stats['cached_tokens']} tokens（{stats['hit_rate']:.1%}）"
+        )
+    if RESPONSE_CACHE_CONFIG["enabled"]:
+        from .response_cache import response_cache
+        stats = response_cache.stats()
+        logger.info(
+            f"回复缓存：内存命中 {stats['memory_hits']} 次，磁盘命中 {stats['disk_hits']} 次，"
+            f"未命中 {stats['misses']} 次，命中率 {stats['hit_rate']:.1%}"
+        )
+    if HEDGING_CONFIG["enabled"]:
+        from .hedging import get_hedging_stats
+        for operation, stats in get_hedging_stats().items():
+            logger.info(
+                f"对冲请求 {operation}：{stats['requests']} 次请求，对冲 {stats['hedged']} 次，"
+                f"备用提供商胜出 {stats['hedge_wins']} 次"
+            )
+    return records
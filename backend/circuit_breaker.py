@@ -0,0 +1,288 @@
+import time
+import threading
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+from .config import CIRCUIT_BREAKER_CONFIG
+from .model_strategies import ModelStrategy
+from .provider_stats import provider_performance
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 熔断器状态
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    单个提供商某类接口的熔断器
+
+    正常时为closed；连续失败达到阈值后变为open，期间不再发出请求；
+    经过recovery_timeout后变为half_open，只放行一个试探请求，成功则恢复为closed，失败则重新open。
+    """
+
+    def __init__(self, name: str, failure_threshold: int, recovery_timeout: float):
+        """
+        Args:
+            name: 熔断器名称，用于日志
+            failure_threshold: 连续失败多少次后熔断
+            recovery_timeout: 熔断多久后放行试探请求（秒）
+        """
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_timeout = recovery_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """当前状态，熔断时间达到recovery_timeout后为half_open"""
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.recovery_timeout:
+            self._state = HALF_OPEN
+            self._trial_started_at = None
+        return self._state
+
+    def allow_request(self) -> bool:
+        """
+        是否可以发出请求；半开状态下只放行一个试探请求
+
+        试探请求没有记录结果（例如被取消）时，经过recovery_timeout后再放行下一个。
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._current_state(now)
+            if state == CLOSED:
+                return True
+            if state == OPEN:
+                return False
+            if self._trial_started_at is None or now - self._trial_started_at >= self.recovery_timeout:
+                self._trial_started_at = now
+                return True
+            return False
+
+    def is_open(self) -> bool:
+        """是否处于熔断状态（不占用半开状态的试探名额）"""
+        return self.state == OPEN
+
+    def record_success(self):
+        """记录一次成功的请求"""
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info(f"{self.name} 已恢复，熔断器关闭")
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_started_at = None
+
+    def record_failure(self):
+        """记录一次失败的请求"""
+        now = time.monotonic()
+        with self._lock:
+            state = self._current_state(now)
+            self._failures += 1
+            if state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if state != OPEN:
+                    logger.warning(
+                        f"{self.name} 连续失败 {self._failures} 次，熔断 {self.recovery_timeout:.0f} 秒"
+                    )
+                self._state = OPEN
+                self._opened_at = now
+                self._trial_started_at = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前状态和连续失败次数"""
+        with self._lock:
+            return {"state": self._current_state(time.monotonic()), "failures": self._failures}
+
+
+class CircuitBreakerRegistry:
+    """按 (提供商, 接口类型) 管理熔断器，接口类型为 chat 或 embedding"""
+
+    def __init__(self, config: Dict[str, Dict[str, float]] = CIRCUIT_BREAKER_CONFIG):
+        self.config = config
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str, kind: str = "chat") -> CircuitBreaker:
+        """获取提供商某类接口的熔断器，首次使用时创建"""
+        with self._lock:
+            breaker = self._breakers.get((provider, kind))
+            if breaker is None:
+                config = self.config[kind]
+                breaker = CircuitBreaker(
+                    f"{provider} {kind}",
+                    failure_threshold=config["failure_threshold"],
+                    recovery_timeout=config["recovery_timeout"]
+                )
+                self._breakers[(provider, kind)] = breaker
+            return breaker
+
+    def is_open(self, provider: str, kind: str = "chat") -> bool:
+        """提供商某类接口是否处于熔断状态"""
+        return self.get(provider, kind).is_open()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        所有熔断器的状态
+
+        Returns:
+            Dict[str, Dict[str, Any]]: 熔断器名称到状态和连续失败次数的映射
+        """
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.name: breaker.snapshot() for breaker in breakers}
+
+
+# 创建全局熔断器注册表
+circuit_breakers = CircuitBreakerRegistry()
+
+
+class FailoverStrategy(ModelStrategy):
+    """
+    按顺序包装多个模型策略，问题分析和回答生成跳过熔断中的提供商，
+    请求失败时自动切换到下一个可用的提供商，并把结果记录到熔断器
+
+    嵌入向量必须与索引一致，始终由第一个策略计算。
+    """
+
+    def __init__(self, candidates: List[ModelStrategy]):
+        """
+        Args:
+            candidates: 按优先顺序排列的可用策略，至少一个
+        """
+        self.candidates = candidates
+        primary = candidates[0]
+        self.provider = primary.provider
+        self.embedding_model = primary.embedding_model
+        self.chat_model = primary.chat_model
+        self.analysis_model = primary.analysis_model
+        self.base_url = primary.base_url
+        self.api_key = primary.api_key
+        self._served: Optional[ModelStrategy] = None
+
+    def served_by(self) -> ModelStrategy:
+        """最近一次成功给出结果的策略，尚未请求时为第一个策略"""
+        return (self._served or self.candidates[0]).served_by()
+
+    def is_available(self) -> bool:
+        """检查模型是否可用"""
+        return any(strategy.is_available() for strategy in self.candidates)
+
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """获取文本嵌入向量（第一个策略）"""
+        return self.candidates[0].get_embeddings(texts)
+
+    async def aget_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """异步获取文本嵌入向量（第一个策略）"""
+        return await self.candidates[0].aget_embeddings(texts)
+
+    def _healthy(self) -> Iterator[Tuple[ModelStrategy, CircuitBreaker]]:
+        """依次产出熔断器放行的策略，只在真正要发出请求时占用半开状态的试探名额"""
+        for strategy in self.candidates:
+            breaker = circuit_breakers.get(strategy.provider)
+            if breaker.allow_request():
+                yield strategy, breaker
+            else:
+                logger.debug(f"{strategy.provider} 处于熔断状态，跳过")
+
+    @staticmethod
+    def _on_success(strategy: ModelStrategy, breaker: CircuitBreaker, operation: str, start: float):
+        breaker.record_success()
+        provider_performance.record(strategy.provider, operation, time.perf_counter() - start)
+
+    def _on_failure(self, strategy: ModelStrategy, breaker: CircuitBreaker, operation: str, error: Exception, start: float):
+        breaker.record_failure()
+        provider_performance.record(strategy.provider, operation, time.perf_counter() - start, success=False)
+        logger.warning(f"{strategy.provider} {operation} 失败: {str(error)}，尝试下一个可用的提供商")
+
+    @staticmethod
+    def _raise(last_error: Optional[Exception]):
+        if last_error is not None:
+            raise last_error
+        raise ValueError("所有模型提供商都处于熔断状态，请稍后重试")
+
+    def _call(self, operation: str, call: Callable[[ModelStrategy], T]) -> T:
+        last_error = None
+        for strategy, breaker in self._healthy():
+            start = time.perf_counter()
+            try:
+                result = call(strategy)
+            except Exception as e:
+                self._on_failure(strategy, breaker, operation, e, start)
+                last_error = e
+                continue
+            self._on_success(strategy, breaker, operation, start)
+            self._served = strategy
+            return result
+        self._raise(last_error)
+
+    async def _acall(self, operation: str, call: Callable[[ModelStrategy], Awaitable[T]]) -> T:
+        last_error = None
+        for strategy, breaker in self._healthy():
+            start = time.perf_counter()
+            try:
+                result = await call(strategy)
+            except Exception as e:
+                self._on_failure(strategy, breaker, operation, e, start)
+                last_error = e
+                continue
+            self._on_success(strategy, breaker, operation, start)
+            self._served = strategy
+            return result
+        self._raise(last_error)
+
+    def analyze_question(self, question: str, tone: str, length: str) -> str:
+        """分析问题"""
+        return self._call("analyze", lambda strategy: strategy.analyze_question(question, tone, length))
+
+    def generate_answer(self, question: str, context: List[str], tone: str, word_count: str) -> str:
+        """生成回答"""
+        return self._call("generate", lambda strategy: strategy.generate_answer(question, context, tone, word_count))
+
+    async def aanalyze_question(self, question: str, tone: str, length: str) -> str:
+        """异步分析问题"""
+        return await self._acall("analyze", lambda strategy: strategy.aanalyze_question(question, tone, length))
+
+    async def agenerate_answer(self, question: str, context: List[str], tone: str, word_count: str) -> str:
+        """异步生成回答"""
+        return await self._acall(
+            "generate", lambda strategy: strategy.agenerate_answer(question, context, tone, word_count)
+        )
+
+    async def astream_answer(self, question: str, context: List[str], tone: str, word_count: str) -> AsyncIterator[str]:
+        """
+        流式生成回答
+
+        产出第一个片段之前失败时切换到下一个提供商；已经产出内容后失败则直接抛出，避免回答重复。
+        """
+        last_error = None
+        for strategy, breaker in self._healthy():
+            started = False
+            start = time.perf_counter()
+            try:
+                async for chunk in strategy.astream_answer(question, context, tone, word_count):
+                    if not started:
+                        started = True
+                        self._served = strategy
+                    yield chunk
+            except Exception as e:
+                if started:
+                    breaker.record_failure()
+                    provider_performance.record(strategy.provider, "generate", time.perf_counter() - start, success=False)
+                    raise
+                self._on_failure(strategy, breaker, "generate", e, start)
+                last_error = e
+                continue
+            self._on_success(strategy, breaker, "generate", start)
+            return
+        self._raise(last_error)
@@ -47,6 +47,29 @@ SUPPORTED_PROVIDERS = {
     }
 }
 
+# 各提供商在不同环节使用的对话模型：问题分析只需要简短的思路，使用更快更便宜的模型；回答生成使用能力最强的模型
+# OpenAI的两个模型来自MODEL_CONFIG，可以在界面中修改
+MODEL_ROLES = {
+    "zhipu": {"analysis": "glm-4-flash", "generation": "glm-4"},
+    "deepseek": {"analysis": "deepseek-chat", "generation": "deepseek-chat"},
+    "qwen": {"analysis": "qwen-turbo", "generation": "qwen-max"},
+    "kimi": {"analysis": "moonshot-v1-8k", "generation": "moonshot-v1-8k"},
+    "openai": {"analysis": MODEL_CONFIG["analysis_model"], "generation": MODEL_CONFIG["generation_model"]}
+}
+
+# 回答长度对应的字数范围
+LENGTH_GUIDE = {
+    "简短": "300-500字",
+    "中等": "800-1200字",
+    "详细": "1500-2500字"
+}
+
+# 各环节按回答长度设置的最大输出token数，回答留出标题、列表等markdown格式的余量
+MAX_TOKENS_CONFIG = {
+    "analysis": {"简短": 384, "中等": 512, "详细": 768},
+    "generation": {"简短": 1024, "中等": 2048, "详细": 4096}
+}
+
 def update_model_config(api_key=None, analysis_model=None, generation_model=None, provider=None):
     """更新模型配置"""
     global MODEL_CONFIG
@@ -54,8 +77,10 @@ def update_model_config(api_key=None, analysis_model=None, generation_model=None
         MODEL_CONFIG["api_key"] = api_key
     if analysis_model:
         MODEL_CONFIG["analysis_model"] = analysis_model
+        MODEL_ROLES["openai"]["analysis"] = analysis_model
     if generation_model:
         MODEL_CONFIG["generation_model"] = generation_model
+        MODEL_ROLES["openai"]["generation"] = generation_model
     if provider:
         MODEL_CONFIG["provider"] = provider
     
@@ -72,6 +97,213 @@ def update_model_config(api_key=None, analysis_model=None, generation_model=None
 VECTOR_STORE_PATH = "backend/vector_store/"
 TEMP_DIR = "backend/temp/"
 
+# 是否把收集到的图片加入提示词和回答末尾（环境变量 ANSWER_IMAGES=true 启用）
+# 图片收集目前是返回占位链接的模拟实现，接入真实的图片来源之前保持关闭
+ANSWER_IMAGES_ENABLED = os.environ.get("ANSWER_IMAGES", "false").lower() == "true"
+
+# 知识库导入流水线配置
+INGEST_BATCH_SIZE = 256  # 每次嵌入并写入索引的片段数
+INGEST_QUEUE_SIZE = 4  # 解析线程和嵌入线程之间最多积压的批次数
+PARSE_WORKERS = min(4, os.cpu_count() or 1)  # 文档解析进程池大小
+PARSE_TIMEOUT = 120  # 单个解析任务的超时时间（秒）
+PDF_PAGES_PER_TASK = 20  # 大PDF按页拆分时每个解析任务的页数
+
+# 向量索引配置，构建索引时使用，实际使用的参数与索引一起保存在 index_config.json 中
+# type: flat（精确检索）、hnsw、ivf_flat、ivf_pq、sq（标量量化）
+# hnsw_m / ef_construction / ef_search: HNSW的连接数、构建和检索时的候选列表长度
+# nlist / nprobe: IVF的聚类数（0表示按 4*sqrt(N) 自动选择）和检索时访问的聚类数
+# pq_m / pq_nbits: PQ的子量化器个数（0表示自动选择能整除维度的值）和每个子量化器的位数
+# sq_type: 标量量化类型，fp16、8bit 或 4bit
+# retrain_growth: IVF索引的向量数增长到训练时的多少倍后重新训练
+VECTOR_INDEX_CONFIG = {
+    "type": os.environ.get("VECTOR_INDEX_TYPE", "flat"),
+    "hnsw_m": 32,
+    "ef_construction": 200,
+    "ef_search": 64,
+    "nlist": 0,
+    "nprobe": 16,
+    "pq_m": 0,
+    "pq_nbits": 8,
+    "sq_type": "fp16",
+    "retrain_growth": 4
+}
+
+# 检索配置
+# k: 交给生成环节的片段数
+# fetch_k: 向量检索和关键词检索各自取回的候选数
+# rrf_k: 倒数排名融合的平滑常数
+# bm25_k1 / bm25_b: BM25的词频饱和参数和文档长度归一化参数
+# embedding_timeout: 查询嵌入的超时时间（秒），超时后只使用关键词检索
+# mmr_candidates: 进入MMR重排序的候选片段数
+# mmr_lambda: MMR中相关度的权重，1表示只看相关度，越小越偏向多样性
+RETRIEVAL_CONFIG = {
+    "k": 5,
+    "fetch_k": 20,
+    "rrf_k": 60,
+    "mmr_candidates": 20,
+    "mmr_lambda": 0.5,
+    "bm25_k1": 1.5,
+    "bm25_b": 0.75,
+    "embedding_timeout": 3.0
+}
+
+# 嵌入向量缓存配置
+EMBEDDING_CACHE_PATH = "backend/cache/embeddings.sqlite3"
+EMBEDDING_CACHE_MAX_ENTRIES = 200000  # 超过后按最近最少使用淘汰
+
+# 模型回复缓存配置：提供商、模型和提示词完全相同的请求直接返回缓存的回复
+# enabled: 是否启用（环境变量 RESPONSE_CACHE=false 可以关闭）
+# path: 持久化缓存的数据库文件，多个进程共享
+# ttl: 缓存的有效期（秒），热榜问题每天变化，过期后重新请求
+# max_entries: 数据库中最多保存的条目数，超过后按最近访问时间淘汰
+# memory_entries: 进程内LRU缓存的条目数
+# max_entry_chars: 超过该长度的回复不缓存
+RESPONSE_CACHE_CONFIG = {
+    "enabled": os.environ.get("RESPONSE_CACHE", "true").lower() == "true",
+    "path": "backend/cache/responses.sqlite3",
+    "ttl": 6 * 3600,
+    "max_entries": 20000,
+    "memory_entries": 512,
+    "max_entry_chars": 20000
+}
+
+# 各提供商嵌入接口的批量上限
+# max_items: 单次请求最多的文本条数
+# max_item_tokens: 单条文本最多的token数
+# max_request_tokens: 单次请求所有文本的token总数上限
+EMBEDDING_BATCH_LIMITS = {
+    "zhipu": {"max_items": 64, "max_item_tokens": 512, "max_request_tokens": 8192},
+    "qwen": {"max_items": 25, "max_item_tokens": 2048, "max_request_tokens": 25 * 2048},
+    "openai": {"max_items": 2048, "max_item_tokens": 8191, "max_request_tokens": 300000},
+    # DeepSeek和Kimi的嵌入接口没有公开批量上限，取保守值
+    "deepseek": {"max_items": 32, "max_item_tokens": 4096, "max_request_tokens": 32768},
+    "kimi": {"max_items": 16, "max_item_tokens": 4096, "max_request_tokens": 16384}
+}
+
+# 各提供商嵌入请求的并发上限和速率限制（令牌桶）
+# max_concurrency: 同时进行的请求数
+# requests_per_second: 令牌桶的补充速率
+# burst: 令牌桶容量，允许的瞬时突发请求数
+EMBEDDING_CONCURRENCY = {
+    "zhipu": {"max_concurrency": 4, "requests_per_second": 5, "burst": 4},
+    "qwen": {"max_concurrency": 4, "requests_per_second": 5, "burst": 4},
+    "openai": {"max_concurrency": 8, "requests_per_second": 20, "burst": 8},
+    "deepseek": {"max_concurrency": 4, "requests_per_second": 5, "burst": 4},
+    "kimi": {"max_concurrency": 2, "requests_per_second": 2, "burst": 2}
+}
+
+# 模型接口的HTTP客户端配置，每个模型策略持有一个长期复用的连接池
+# timeout: 单次请求的超时时间（秒），生成长回答可能需要较长时间
+# connect_timeout: 建立连接的超时时间（秒）
+# max_connections: 连接池的最大连接数
+# max_keepalive_connections: 空闲时保持的最大连接数
+# keepalive_expiry: 空闲连接的保持时间（秒）
+# http2: 是否使用HTTP/2（需要安装h2，服务端不支持时自动协商为HTTP/1.1）
+# warmup: 创建策略时是否在后台预先建立连接，省去第一次请求的TCP和TLS握手
+HTTP_CLIENT_CONFIG = {
+    "timeout": 120.0,
+    "connect_timeout": 10.0,
+    "max_connections": 20,
+    "max_keepalive_connections": 10,
+    "keepalive_expiry": 60.0,
+    "http2": os.environ.get("MODEL_HTTP2", "true").lower() == "true",
+    "warmup": True
+}
+
+# 各提供商覆盖的HTTP客户端配置，键与HTTP_CLIENT_CONFIG相同
+PROVIDER_HTTP_CONFIG = {
+    "kimi": {"max_connections": 8, "max_keepalive_connections": 4}
+}
+
+# 参考知识打包配置：按token预算压缩生成回答时提示词中的参考知识
+# max_context_tokens: 参考知识最多占用的token数，超出时从各片段中抽取与问题最相关的句子
+# cjk_tokens_per_char: 各提供商每个汉字大约对应的token数，用于估算token数（OpenAI模型安装了tiktoken时精确计算），
+#                      其他字符按4个字符一个token估算
+CONTEXT_PACKING_CONFIG = {
+    "max_context_tokens": 3000,
+    "cjk_tokens_per_char": {"zhipu": 0.7, "deepseek": 0.6, "qwen": 0.7, "kimi": 0.7, "openai": 1.2, "default": 1.0}
+}
+
+# 模型的上下文窗口（token数）
+MODEL_CONTEXT_WINDOWS = {
+    "glm-4": 128000,
+    "glm-4-flash": 128000,
+    "deepseek-chat": 64000,
+    "qwen-max": 32768,
+    "qwen-turbo": 131072,
+    "moonshot-v1-8k": 8192,
+    "moonshot-v1-32k": 32768,
+    "moonshot-v1-128k": 131072,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-3.5-turbo": 16385
+}
+
+# 各提供商按上下文窗口从小到大排列的模型档位，提示词加上最大输出超出当前模型的窗口时切换到更大的档位
+MODEL_CONTEXT_TIERS = {
+    "kimi": ["moonshot-v1-8k", "moonshot-v1-32k", "moonshot-v1-128k"]
+}
+
+# 相似问题回答复用配置：新问题与此前回答过的问题语义足够接近时，直接复用或改写已有回答，不再执行完整的检索、分析和生成
+# enabled: 是否启用（环境变量 SEMANTIC_REUSE=true 启用，默认关闭）；知识库变化后已保存的回答会被清空
+# path: 已生成回答的语义索引数据库文件
+# threshold: 复用回答所需的问题嵌入向量最低余弦相似度
+# simhash_max_distance: SimHash预筛选允许的最大汉明距离（64位），没有候选时不计算嵌入向量
+# ttl: 回答的复用有效期（秒）
+# max_entries: 最多保存的回答数
+# mode: return 直接返回已有回答；adapt 让模型按新问题的措辞改写已有回答
+SEMANTIC_REUSE_CONFIG = {
+    "enabled": os.environ.get("SEMANTIC_REUSE", "false").lower() == "true",
+    "path": "backend/cache/semantic_answers.sqlite3",
+    "threshold": 0.92,
+    "simhash_max_distance": 24,
+    "ttl": 24 * 3600,
+    "max_entries": 5000,
+    "mode": "return"
+}
+
+# 熔断器配置：按提供商分别记录对话接口（chat）和查询嵌入（embedding）的健康状态
+# failure_threshold: 连续失败多少次后熔断，熔断期间对话请求直接切换到下一个可用的提供商，检索只使用关键词检索
+# recovery_timeout: 熔断多久后放行一个试探请求（秒），成功则恢复，失败则继续熔断
+CIRCUIT_BREAKER_CONFIG = {
+    "chat": {"failure_threshold": 3, "recovery_timeout": 60.0},
+    "embedding": {"failure_threshold": 1, "recovery_timeout": 30.0}
+}
+
+# 自动选择提供商（provider为auto）时的路由配置：按各提供商各操作（analyze、generate、embed）实测的
+# 耗时和错误率的指数移动平均排序，大部分请求交给当前最快的健康提供商，少量请求随机探索其他提供商以保持统计更新
+# ewma_alpha: 移动平均中最新一次请求的权重
+# error_penalty: 错误率的惩罚系数，得分 = 平均耗时 * (1 + error_penalty * 错误率)，越低越优先
+# exploration: 随机探索其他提供商的请求比例
+ROUTING_CONFIG = {
+    "ewma_alpha": 0.2,
+    "error_penalty": 4.0,
+    "exploration": 0.1
+}
+
+# 对冲请求配置：主提供商在其历史耗时的某个分位数内没有返回时，同时向备用提供商发出相同请求，
+# 先完成的结果胜出，另一个请求被取消
+# enabled: 是否启用（也可以通过环境变量 MODEL_HEDGING=true 启用）
+# percentile: 触发对冲的耗时分位数
+# min_samples: 样本数不足时使用 default_delay 作为触发时间
+# window: 每个提供商每种操作保留的最近耗时样本数
+# default_delay: 各操作在样本不足时的触发时间（秒）；stream 为流式生成等待第一个片段的时间
+HEDGING_CONFIG = {
+    "enabled": os.environ.get("MODEL_HEDGING", "false").lower() == "true",
+    "percentile": 95,
+    "min_samples": 20,
+    "window": 200,
+    "default_delay": {"analyze": 15.0, "generate": 45.0, "stream": 5.0}
+}
+
+# 批量生成回答的配置
+# concurrency: 同时处理的问题数
+# output_dir: 回答和汇总文件的保存目录
+BATCH_CONFIG = {
+    "concurrency": 4,
+    "output_dir": "zhihu_answers"
+}
+
 def ensure_dir_exists(dir_path):
     """确保目录存在，如果不存在则创建"""
     if not os.path.exists(dir_path):
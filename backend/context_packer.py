@@ -0,0 +1,171 @@
+import re
+import math
+import logging
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from .config import CONTEXT_PACKING_CONFIG, MODEL_CONTEXT_TIERS, MODEL_CONTEXT_WINDOWS
+from .lexical_index import tokenize
+from .prompt_templates import CONTEXT_SEPARATOR
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# 汉字和全角标点，按提供商的系数估算token数
+_CJK_PATTERN = re.compile("[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+# 在中英文句末标点和换行处断句，标点保留在句子末尾
+_SENTENCE_PATTERN = re.compile(r"[^。！？；!?;\n]+(?:[。！？；!?;]+|\n|$)|[。！？；!?;]+")
+
+# 片段之间的分隔符，与生成回答的提示词一致
+_SEPARATOR = CONTEXT_SEPARATOR
+
+_encodings: Dict[str, "tiktoken.Encoding"] = {}
+
+
+def _tiktoken_encoding(model: str):
+    """OpenAI模型的tiktoken编码，未安装tiktoken或模型未知时返回None"""
+    if tiktoken is None or not model.startswith("gpt"):
+        return None
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            _encodings[model] = tiktoken.get_encoding("cl100k_base")
+    return _encodings[model]
+
+
+def count_tokens(text: str, provider: str = "", model: str = "") -> int:
+    """
+    计算或估算文本的token数
+
+    OpenAI模型在安装了tiktoken时精确计算；其他模型的分词器不公开，
+    按提供商配置的每个汉字token数估算，其他字符按4个字符一个token估算。
+
+    Args:
+        text: 文本
+        provider: 提供商名称，用于选择估算系数
+        model: 模型名称
+    """
+    if not text:
+        return 0
+    encoding = _tiktoken_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    ratios = CONTEXT_PACKING_CONFIG["cjk_tokens_per_char"]
+    ratio = ratios.get(provider, ratios["default"])
+    cjk = len(_CJK_PATTERN.findall(text))
+    return math.ceil(cjk * ratio + (len(text) - cjk) / 4)
+
+
+def split_sentences(text: str) -> List[str]:
+    """按中英文句末标点和换行把文本切成句子，去掉空白句子"""
+    return [sentence.strip() for sentence in _SENTENCE_PATTERN.findall(text) if sentence.strip()]
+
+
+def pack_context(
+    question: str,
+    context: List[str],
+    budget: int,
+    provider: str = "",
+    model: str = ""
+) -> List[str]:
+    """
+    把参考知识压缩到token预算以内
+
+    总长度不超过预算时原样返回；否则对所有片段断句，按句子中问题关键词的IDF之和打分，
+    分数相同时优先排名靠前的片段和片段中靠前的句子，依次选入直到用完预算，
+    再按原始顺序拼回各自的片段，没有句子入选的片段被丢弃。
+
+    Args:
+        question: 问题
+        context: 按相关度排列的参考片段
+        budget: 参考知识最多占用的token数
+        provider: 提供商名称，用于估算token数
+        model: 模型名称
+
+    Returns:
+        List[str]: 压缩后的参考片段
+    """
+    total = count_tokens(_SEPARATOR.join(context), provider, model)
+    if total <= budget:
+        return list(context)
+
+    sentences: List[Tuple[int, int, str]] = []
+    for rank, chunk in enumerate(context):
+        for position, sentence in enumerate(split_sentences(chunk)):
+            sentences.append((rank, position, sentence))
+
+    # 句子中问题关键词的逆文档频率，越少见的关键词权重越高
+    query_terms = set(tokenize(question))
+    sentence_terms = [set(tokenize(sentence)) & query_terms for _, _, sentence in sentences]
+    document_frequency = Counter(term for terms in sentence_terms for term in terms)
+    n = len(sentences)
+    scores = [
+        sum(math.log(1 + (n - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5)) for term in terms)
+        for terms in sentence_terms
+    ]
+
+    order = sorted(range(n), key=lambda i: (-scores[i], sentences[i][0], sentences[i][1]))
+    selected = set()
+    used = 0
+    for i in order:
+        cost = count_tokens(sentences[i][2], provider, model) + 1
+        if used + cost > budget:
+            continue
+        selected.add(i)
+        used += cost
+
+    packed: List[List[str]] = [[] for _ in context]
+    for i in sorted(selected):
+        rank, _, sentence = sentences[i]
+        packed[rank].append(sentence)
+    result = ["".join(chunk) if _is_cjk_text(chunk) else " ".join(chunk) for chunk in packed if chunk]
+    logger.info(
+        f"参考知识约 {total} tokens，超过预算 {budget}，抽取 {len(selected)}/{n} 个句子，"
+        f"保留 {len(result)}/{len(context)} 个片段"
+    )
+    return result
+
+
+def _is_cjk_text(sentences: List[str]) -> bool:
+    """中文句子直接拼接，英文句子之间加空格"""
+    text = "".join(sentences)
+    return len(_CJK_PATTERN.findall(text)) * 2 >= len(text)
+
+
+def context_window(model: str) -> Optional[int]:
+    """模型的上下文窗口（token数），未配置时返回None"""
+    return MODEL_CONTEXT_WINDOWS.get(model)
+
+
+def select_context_tier(provider: str, model: str, required_tokens: int) -> Tuple[str, bool]:
+    """
+    选择上下文窗口足够容纳提示词和最大输出的模型档位
+
+    从当前模型开始按窗口从小到大查找；提供商没有更大档位或所有档位都放不下时返回最大的档位。
+
+    Args:
+        provider: 提供商名称
+        model: 默认模型
+        required_tokens: 提示词token数加上最大输出token数
+
+    Returns:
+        Tuple[str, bool]: 模型名称，以及该模型的窗口是否足够
+    """
+    tiers = MODEL_CONTEXT_TIERS.get(provider) or [model]
+    if model in tiers:
+        tiers = tiers[tiers.index(model):]
+    else:
+        tiers = [model]
+    for tier in tiers:
+        window = context_window(tier)
+        if window is None or required_tokens <= window:
+            if tier != model:
+                logger.info(f"提示词约需 {required_tokens} tokens，超出 {model} 的上下文窗口，切换到 {tier}")
+            return tier, True
+    return tiers[-1], False
@@ -0,0 +1,146 @@
+import re
+import logging
+from typing import Awaitable, Callable, Dict, Iterator, List
+from .config import EMBEDDING_BATCH_LIMITS
+from .embedding_executor import embedding_executor
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 中日韩字符，按每个字符一个token保守估计
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+# 未配置的提供商使用的默认上限
+DEFAULT_BATCH_LIMITS = {"max_items": 16, "max_item_tokens": 2048, "max_request_tokens": 16384}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估计文本的token数
+
+    中文字符按每字一个token、其他字符按每4个字符一个token计算，
+    对各家分词器来说都偏保守，用于控制批量请求不超过接口上限。
+    """
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    截取文本开头估计不超过max_tokens的部分，估计方式与estimate_tokens一致
+
+    Args:
+        text: 原文本
+        max_tokens: token上限
+
+    Returns:
+        str: 截取后的文本，未超过上限时原样返回
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    cjk_count = 0
+    other_count = 0
+    for index, char in enumerate(text):
+        if _CJK_PATTERN.match(char):
+            cjk_count += 1
+        else:
+            other_count += 1
+        if cjk_count + (other_count + 3) // 4 > max_tokens:
+            return text[:index]
+    return text
+
+
+def get_batch_limits(provider: str) -> Dict[str, int]:
+    """获取提供商的嵌入批量上限"""
+    return EMBEDDING_BATCH_LIMITS.get(provider, DEFAULT_BATCH_LIMITS)
+
+
+def iter_batches(provider: str, texts: List[str]) -> Iterator[List[str]]:
+    """
+    按提供商的条数和token上限把文本切分成批次
+
+    Args:
+        provider: 嵌入提供商名称
+        texts: 要嵌入的文本列表
+
+    Yields:
+        List[str]: 每个批次的文本，保持原有顺序；超过单条上限的文本被截断
+    """
+    limits = get_batch_limits(provider)
+    batch: List[str] = []
+    batch_tokens = 0
+
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if tokens > limits["max_item_tokens"]:
+            # 超过单条上限的文本会让整个批次被接口拒绝，只嵌入其开头部分
+            logger.warning(f"{provider} 嵌入文本约 {tokens} tokens，超过单条上限 {limits['max_item_tokens']}，截断后嵌入")
+            text = truncate_to_tokens(text, limits["max_item_tokens"])
+            tokens = estimate_tokens(text)
+
+        if batch and (len(batch) >= limits["max_items"] or batch_tokens + tokens > limits["max_request_tokens"]):
+            yield batch
+            batch = []
+            batch_tokens = 0
+
+        batch.append(text)
+        batch_tokens += tokens
+
+    if batch:
+        yield batch
+
+
+def embed_in_batches(
+    provider: str,
+    texts: List[str],
+    embed_batch: Callable[[List[str]], List[List[float]]]
+) -> List[List[float]]:
+    """
+    分批调用嵌入接口并按原顺序拼接结果
+
+    多个批次通过嵌入执行器并发发出，受提供商的并发上限和速率限制约束。
+
+    Args:
+        provider: 嵌入提供商名称
+        texts: 要嵌入的文本列表
+        embed_batch: 对一个批次发起一次请求的函数
+
+    Returns:
+        List[List[float]]: 与texts一一对应的嵌入向量
+    """
+    batches = list(iter_batches(provider, texts))
+    embeddings: List[List[float]] = []
+    for batch, batch_embeddings in zip(batches, embedding_executor.map_batches(provider, batches, embed_batch)):
+        if len(batch_embeddings) != len(batch):
+            raise ValueError(f"{provider} 嵌入接口返回 {len(batch_embeddings)} 个向量，期望 {len(batch)} 个")
+        embeddings.extend(batch_embeddings)
+
+    logger.debug(f"{provider} 嵌入 {len(texts)} 条文本，共 {len(batches)} 次请求")
+    return embeddings
+
+
+async def aembed_in_batches(
+    provider: str,
+    texts: List[str],
+    embed_batch: Callable[[List[str]], Awaitable[List[List[float]]]]
+) -> List[List[float]]:
+    """
+    embed_in_batches的异步版本，批次在事件循环中并发发出
+
+    Args:
+        provider: 嵌入提供商名称
+        texts: 要嵌入的文本列表
+        embed_batch: 对一个批次发起一次请求的协程函数
+
+    Returns:
+        List[List[float]]: 与texts一一对应的嵌入向量
+    """
+    batches = list(iter_batches(provider, texts))
+    embeddings: List[List[float]] = []
+    for batch, batch_embeddings in zip(batches, await embedding_executor.amap_batches(provider, batches, embed_batch)):
+        if len(batch_embeddings) != len(batch):
+            raise ValueError(f"{provider} 嵌入接口返回 {len(batch_embeddings)} 个向量，期望 {len(batch)} 个")
+        embeddings.extend(batch_embeddings)
+
+    logger.debug(f"{provider} 异步嵌入 {len(texts)} 条文本，共 {len(batches)} 次请求")
+    return embeddings
@@ -0,0 +1,291 @@
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+import logging
+from array import array
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+from .config import EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES, ensure_dir_exists
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """
+    持久化的内容寻址嵌入向量缓存
+
+    以 (提供商, 模型, 文本哈希) 为键，把向量以float32二进制存入SQLite，
+    超过容量上限时按最近访问时间淘汰，并统计命中和未命中次数。
+    SQLite自带文件锁，多个进程可以共享同一个缓存文件。
+    """
+
+    def __init__(self, db_path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        """
+        Args:
+            db_path: 缓存数据库文件路径
+            max_entries: 最多缓存的向量条数
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        # 估算的条目数，首次写入时统计
+        self._entries: Optional[int] = None
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    @staticmethod
+    def make_key(provider: str, model: str, text: str) -> str:
+        """根据提供商、模型和文本内容生成缓存键"""
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{provider}:{model}:{digest}"
+
+    def _connect(self) -> sqlite3.Connection:
+        """获取当前线程的数据库连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            ensure_dir_exists(directory)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+
+        with self._init_lock:
+            if not self._initialized:
+                conn.execute(
+                    """CREATE TABLE IF NOT EXISTS embeddings (
+                        key TEXT PRIMARY KEY,
+                        dim INTEGER NOT NULL,
+                        vector BLOB NOT NULL,
+                        last_access REAL NOT NULL
+                    )"""
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+                conn.commit()
+                self._initialized = True
+
+        self._local.conn = conn
+        return conn
+
+    def get_many(self, provider: str, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """
+        批量查询缓存
+
+        Returns:
+            List[Optional[List[float]]]: 与texts一一对应的向量，未命中的位置为None
+        """
+        if not texts:
+            return []
+
+        keys = [self.make_key(provider, model, text) for text in texts]
+        unique_keys = list(dict.fromkeys(keys))
+        found: Dict[str, List[float]] = {}
+
+        try:
+            conn = self._connect()
+            # SQLite对单条语句的参数数量有限制，分批查询
+            for i in range(0, len(unique_keys), 500):
+                chunk = unique_keys[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    chunk
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+
+            if found:
+                now = time.time()
+                conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"读取嵌入缓存时出错: {str(e)}")
+
+        results = [found.get(key) for key in keys]
+        hit_count = sum(1 for vector in results if vector is not None)
+        with self._stats_lock:
+            self.hits += hit_count
+            self.misses += len(results) - hit_count
+        return results
+
+    def put_many(self, provider: str, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        """批量写入缓存，空向量和全零向量不是有效的嵌入结果，不会被缓存"""
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            if not vector or not any(vector):
+                continue
+            rows.append((
+                self.make_key(provider, model, text),
+                len(vector),
+                array("f", vector).tobytes(),
+                now
+            ))
+        if not rows:
+            return
+
+        try:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, dim, vector, last_access) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            conn.commit()
+            self._evict(conn, len(rows))
+        except sqlite3.Error as e:
+            logger.warning(f"写入嵌入缓存时出错: {str(e)}")
+
+    def _evict(self, conn: sqlite3.Connection, added: int):
+        """
+        超过容量上限时淘汰最久未访问的条目
+
+        条目数在内存中估算（替换已有的键也按新增计算），估算值超过上限时才统计实际条数，
+        其他进程写入的条目在统计时计入。淘汰时额外腾出一成容量，之后的写入不会每次都触发统计。
+        """
+        with self._stats_lock:
+            if self._entries is not None:
+                self._entries += added
+                if self._entries <= self.max_entries:
+                    return
+
+        count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            overflow = min(count, overflow + self.max_entries // 10)
+            conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            )
+            conn.commit()
+            count -= overflow
+            logger.info(f"嵌入缓存超过上限，已淘汰 {overflow} 条最久未使用的向量")
+        with self._stats_lock:
+            self._entries = count
+
+    def get_or_compute(
+        self,
+        provider: str,
+        model: str,
+        texts: Sequence[str],
+        compute_fn: Callable[[List[str]], List[List[float]]]
+    ) -> List[List[float]]:
+        """
+        从缓存获取嵌入向量，只为未命中的文本调用compute_fn
+
+        Args:
+            provider: 嵌入提供商名称
+            model: 嵌入模型名称
+            texts: 要嵌入的文本列表
+            compute_fn: 实际调用远程API的函数，接收未命中的文本列表
+
+        Returns:
+            List[List[float]]: 与texts一一对应的嵌入向量
+        """
+        texts = list(texts)
+        cached = self.get_many(provider, model, texts)
+        missing = self._missing(texts, cached)
+        if missing:
+            computed = compute_fn(missing)
+            self.put_many(provider, model, missing, computed)
+            cached = self._merge(texts, cached, missing, computed)
+        self._log_lookup(provider, model, texts, missing)
+        return cached
+
+    async def aget_or_compute(
+        self,
+        provider: str,
+        model: str,
+        texts: Sequence[str],
+        compute_fn: Callable[[List[str]], Awaitable[List[List[float]]]]
+    ) -> List[List[float]]:
+        """
+        get_or_compute的异步版本，compute_fn为协程函数，读写SQLite在线程池中进行，不阻塞事件循环
+        """
+        texts = list(texts)
+        cached = await asyncio.to_thread(self.get_many, provider, model, texts)
+        missing = self._missing(texts, cached)
+        if missing:
+            computed = await compute_fn(missing)
+            await asyncio.to_thread(self.put_many, provider, model, missing, computed)
+            cached = self._merge(texts, cached, missing, computed)
+        self._log_lookup(provider, model, texts, missing)
+        return cached
+
+    @staticmethod
+    def _missing(texts: List[str], cached: List[Optional[List[float]]]) -> List[str]:
+        """未命中的文本，同一批中重复的文本只计算一次"""
+        return list(dict.fromkeys(text for text, vector in zip(texts, cached) if vector is None))
+
+    @staticmethod
+    def _merge(
+        texts: List[str],
+        cached: List[Optional[List[float]]],
+        missing: List[str],
+        computed: List[List[float]]
+    ) -> List[List[float]]:
+        """用新计算的向量填补未命中的位置"""
+        computed_by_text = dict(zip(missing, computed))
+        return [
+            vector if vector is not None else computed_by_text[text]
+            for text, vector in zip(texts, cached)
+        ]
+
+    def _log_lookup(self, provider: str, model: str, texts: List[str], missing: List[str]):
+        logger.debug(
+            f"嵌入缓存 {provider}/{model}: 本次 {len(texts) - len(missing)}/{len(texts)} 命中，"
+            f"累计命中率 {self.hit_rate():.1%}"
+        )
+
+    def hit_rate(self) -> float:
+        """累计命中率"""
+        with self._stats_lock:
+            total = self.hits + self.misses
+            return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        """
+        获取缓存统计信息
+
+        Returns:
+            Dict[str, float]: 命中次数、未命中次数、命中率和当前条目数
+        """
+        try:
+            entries = self._connect().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        except sqlite3.Error:
+            entries = -1
+        with self._stats_lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+            "entries": entries
+        }
+
+    def clear(self):
+        """清空缓存和统计信息"""
+        conn = self._connect()
+        conn.execute("DELETE FROM embeddings")
+        conn.commit()
+        with self._stats_lock:
+            self.hits = 0
+            self.misses = 0
+            self._entries = 0
+
+
+# 创建全局嵌入缓存实例
+embedding_cache = EmbeddingCache()
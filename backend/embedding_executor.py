@@ -0,0 +1,199 @@
+import time
+import asyncio
+import weakref
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Sequence
+from .config import EMBEDDING_CONCURRENCY
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 未配置的提供商使用的默认限制
+DEFAULT_CONCURRENCY = {"max_concurrency": 2, "requests_per_second": 2, "burst": 2}
+
+
+class TokenBucket:
+    """线程安全的令牌桶限速器"""
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Args:
+            rate: 每秒补充的令牌数
+            capacity: 桶的容量
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """
+        尝试取出令牌，不等待
+
+        Returns:
+            float: 取到令牌时为0，否则为还需等待的秒数
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1.0):
+        """取出令牌，令牌不足时阻塞等待"""
+        while True:
+            wait_time = self.try_acquire(tokens)
+            if wait_time <= 0:
+                return
+            time.sleep(wait_time)
+
+    async def aacquire(self, tokens: float = 1.0):
+        """取出令牌，令牌不足时让出事件循环等待"""
+        while True:
+            wait_time = self.try_acquire(tokens)
+            if wait_time <= 0:
+                return
+            await asyncio.sleep(wait_time)
+
+
+class EmbeddingExecutor:
+    """
+    并发、限速的嵌入请求执行器
+
+    每个提供商有独立的线程池（大小即并发上限）和令牌桶，
+    多个批次同时发出，结果按提交顺序返回。
+    异步请求用每个事件循环各自的信号量限制并发，与同步请求共用令牌桶。
+    """
+
+    def __init__(self, limits: Dict[str, Dict[str, float]] = EMBEDDING_CONCURRENCY):
+        """
+        Args:
+            limits: 提供商名称到并发和速率限制的映射
+        """
+        self.limits = limits
+        self._pools: Dict[str, ThreadPoolExecutor] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _get_pool_and_bucket(self, provider: str):
+        """获取提供商的线程池和令牌桶，首次使用时创建"""
+        with self._lock:
+            if provider not in self._pools:
+                limit = self.limits.get(provider, DEFAULT_CONCURRENCY)
+                self._pools[provider] = ThreadPoolExecutor(
+                    max_workers=int(limit["max_concurrency"]),
+                    thread_name_prefix=f"embed-{provider}"
+                )
+                self._buckets[provider] = TokenBucket(
+                    rate=limit["requests_per_second"],
+                    capacity=limit.get("burst", limit["max_concurrency"])
+                )
+            return self._pools[provider], self._buckets[provider]
+
+    def _get_semaphore(self, provider: str) -> asyncio.Semaphore:
+        """获取当前事件循环中提供商的并发信号量"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphores = self._semaphores.setdefault(loop, {})
+            if provider not in semaphores:
+                limit = self.limits.get(provider, DEFAULT_CONCURRENCY)
+                semaphores[provider] = asyncio.Semaphore(int(limit["max_concurrency"]))
+            return semaphores[provider]
+
+    def map_batches(
+        self,
+        provider: str,
+        batches: Sequence[List[str]],
+        embed_batch: Callable[[List[str]], List[List[float]]]
+    ) -> List[List[List[float]]]:
+        """
+        并发地嵌入多个批次
+
+        Args:
+            provider: 嵌入提供商名称
+            batches: 文本批次列表
+            embed_batch: 对一个批次发起一次请求的函数
+
+        Returns:
+            List[List[List[float]]]: 每个批次的嵌入向量，顺序与batches一致
+
+        Raises:
+            Exception: 任一批次失败时抛出该批次的异常，并取消尚未开始的批次
+        """
+        if not batches:
+            return []
+        # 只有一个批次时直接在当前线程执行，省去线程切换
+        if len(batches) == 1:
+            _, bucket = self._get_pool_and_bucket(provider)
+            bucket.acquire()
+            return [embed_batch(batches[0])]
+
+        pool, bucket = self._get_pool_and_bucket(provider)
+
+        def run(batch: List[str]) -> List[List[float]]:
+            bucket.acquire()
+            return embed_batch(batch)
+
+        start_time = time.perf_counter()
+        futures = [pool.submit(run, batch) for batch in batches]
+        try:
+            results = [future.result() for future in futures]
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+        logger.info(
+            f"{provider} 并发嵌入 {len(batches)} 个批次完成，"
+            f"耗时 {time.perf_counter() - start_time:.2f}s"
+        )
+        return results
+
+    async def amap_batches(
+        self,
+        provider: str,
+        batches: Sequence[List[str]],
+        embed_batch: Callable[[List[str]], Awaitable[List[List[float]]]]
+    ) -> List[List[List[float]]]:
+        """
+        在事件循环中并发地嵌入多个批次
+
+        Args:
+            provider: 嵌入提供商名称
+            batches: 文本批次列表
+            embed_batch: 对一个批次发起一次请求的协程函数
+
+        Returns:
+            List[List[List[float]]]: 每个批次的嵌入向量，顺序与batches一致
+
+        Raises:
+            Exception: 任一批次失败时抛出该批次的异常，并取消其余批次
+        """
+        if not batches:
+            return []
+        _, bucket = self._get_pool_and_bucket(provider)
+        semaphore = self._get_semaphore(provider)
+
+        async def run(batch: List[str]) -> List[List[float]]:
+            async with semaphore:
+                await bucket.aacquire()
+                return await embed_batch(batch)
+
+        tasks = [asyncio.ensure_future(run(batch)) for batch in batches]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+
+# 创建全局嵌入执行器实例
+embedding_executor = EmbeddingExecutor()
@@ -0,0 +1,277 @@
+import time
+import asyncio
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+from .config import HEDGING_CONFIG
+from .model_strategies import ModelStrategy
+from .provider_stats import latency_tracker
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 同步接口对冲时使用的线程池，落败的请求无法中断，在线程中自然结束后丢弃结果
+_sync_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+
+
+class HedgeStats:
+    """记录各操作的请求数、对冲次数以及备用提供商胜出的次数"""
+
+    def __init__(self):
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _incr(self, operation: str, key: str) -> Dict[str, int]:
+        with self._lock:
+            counts = self._counts.setdefault(operation, {"requests": 0, "hedged": 0, "hedge_wins": 0})
+            counts[key] += 1
+            return dict(counts)
+
+    def record_request(self, operation: str):
+        self._incr(operation, "requests")
+
+    def record_hedge(self, operation: str) -> Dict[str, int]:
+        return self._incr(operation, "hedged")
+
+    def record_win(self, operation: str) -> Dict[str, int]:
+        return self._incr(operation, "hedge_wins")
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        各操作的统计
+
+        Returns:
+            Dict[str, Dict[str, Any]]: 操作名称到 requests、hedged、hedge_wins、hedge_rate、win_rate 的映射
+        """
+        with self._lock:
+            result = {}
+            for operation, counts in self._counts.items():
+                result[operation] = {
+                    **counts,
+                    "hedge_rate": counts["hedged"] / counts["requests"] if counts["requests"] else 0.0,
+                    "win_rate": counts["hedge_wins"] / counts["hedged"] if counts["hedged"] else 0.0
+                }
+            return result
+
+
+# 创建全局对冲统计实例
+hedge_stats = HedgeStats()
+
+
+def get_hedging_stats() -> Dict[str, Dict[str, Any]]:
+    """获取对冲请求的统计：各操作的对冲次数和备用提供商胜出次数"""
+    return hedge_stats.snapshot()
+
+
+def hedge_delay(provider: str, operation: str) -> float:
+    """
+    主提供商请求发出后，等待多久再向备用提供商发出相同请求
+
+    取主提供商该操作最近耗时的分位数，样本不足时使用配置的默认值。
+    """
+    delay = latency_tracker.percentile(
+        provider, operation, HEDGING_CONFIG["percentile"], min_samples=HEDGING_CONFIG["min_samples"]
+    )
+    if delay is None:
+        return HEDGING_CONFIG["default_delay"][operation]
+    return delay
+
+
+class HedgedStrategy(ModelStrategy):
+    """
+    对冲请求策略：包装主策略和备用策略
+
+    问题分析和回答生成先只请求主提供商，超过其历史耗时的分位数仍未返回时，
+    再向备用提供商发出相同请求，先成功返回的结果胜出，另一个请求被取消。
+    主提供商在对冲之前就失败时，直接改用备用策略。
+    嵌入向量必须与索引一致，始终由主提供商计算。
+    """
+
+    def __init__(self, primary: ModelStrategy, backup: ModelStrategy):
+        self.primary = primary
+        self.backup = backup
+        self.provider = primary.provider
+        self.embedding_model = primary.embedding_model
+        self.chat_model = primary.chat_model
+        self.analysis_model = primary.analysis_model
+        self.base_url = primary.base_url
+        self.api_key = primary.api_key
+        self._served: Optional[ModelStrategy] = None
+
+    def served_by(self) -> ModelStrategy:
+        """最近一次胜出的策略，尚未请求时为主策略"""
+        return (self._served or self.primary).served_by()
+
+    def is_available(self) -> bool:
+        """检查模型是否可用"""
+        return self.primary.is_available()
+
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """获取文本嵌入向量（主提供商）"""
+        return self.primary.get_embeddings(texts)
+
+    async def aget_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """异步获取文本嵌入向量（主提供商）"""
+        return await self.primary.aget_embeddings(texts)
+
+    def _on_hedge(self, operation: str, delay: float):
+        counts = hedge_stats.record_hedge(operation)
+        logger.info(
+            f"{self.primary.provider} {operation} 超过 {delay:.1f}s 未返回，向 {self.backup.provider} 发出对冲请求"
+            f"（累计对冲 {counts['hedged']}/{counts['requests']} 次）"
+        )
+
+    def _on_win(self, operation: str):
+        counts = hedge_stats.record_win(operation)
+        logger.info(
+            f"{operation} 对冲请求由 {self.backup.provider} 胜出（累计胜出 {counts['hedge_wins']}/{counts['hedged']} 次）"
+        )
+
+    def _on_primary_failure(self, operation: str, error: BaseException):
+        logger.warning(f"{self.primary.provider} {operation} 失败: {str(error)}，改用 {self.backup.provider}")
+
+    # 同步接口
+
+    def _timed(self, strategy: ModelStrategy, operation: str, call: Callable[[ModelStrategy], T]) -> T:
+        start = time.perf_counter()
+        result = call(strategy)
+        latency_tracker.record(strategy.provider, operation, time.perf_counter() - start)
+        return result
+
+    def _hedge(self, operation: str, call: Callable[[ModelStrategy], T]) -> T:
+        """在线程池中运行对冲请求，返回先成功的结果"""
+        hedge_stats.record_request(operation)
+        delay = hedge_delay(self.primary.provider, operation)
+        primary = _sync_pool.submit(self._timed, self.primary, operation, call)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            if primary.exception() is not None:
+                self._on_primary_failure(operation, primary.exception())
+                result = self._timed(self.backup, operation, call)
+                self._served = self.backup
+                return result
+            self._served = self.primary
+            return primary.result()
+
+        self._on_hedge(operation, delay)
+        backup = _sync_pool.submit(self._timed, self.backup, operation, call)
+        pending = {primary, backup}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    if future is backup:
+                        self._on_win(operation)
+                    self._served = self.primary if future is primary else self.backup
+                    return future.result()
+        # 两个请求都失败时抛出主提供商的异常
+        return primary.result()
+
+    def analyze_question(self, question: str, tone: str, length: str) -> str:
+        """分析问题"""
+        return self._hedge("analyze", lambda strategy: strategy.analyze_question(question, tone, length))
+
+    def generate_answer(self, question: str, context: List[str], tone: str, word_count: str) -> str:
+        """生成回答"""
+        return self._hedge("generate", lambda strategy: strategy.generate_answer(question, context, tone, word_count))
+
+    # 异步接口
+
+    async def _atimed(self, strategy: ModelStrategy, operation: str, call: Callable[[ModelStrategy], Awaitable[T]]) -> T:
+        start = time.perf_counter()
+        result = await call(strategy)
+        latency_tracker.record(strategy.provider, operation, time.perf_counter() - start)
+        return result
+
+    async def _ahedge(
+        self,
+        operation: str,
+        call: Callable[[ModelStrategy], Awaitable[T]],
+        discard: Optional[Callable[[T], Awaitable[None]]] = None
+    ) -> T:
+        """
+        发出对冲请求，返回先成功的结果并取消另一个请求
+
+        Args:
+            operation: 操作名称，用于选择耗时样本和统计
+            call: 用给定策略发出请求的函数
+            discard: 两个请求同时成功时，用于释放落败结果的函数
+        """
+        hedge_stats.record_request(operation)
+        delay = hedge_delay(self.primary.provider, operation)
+        primary = asyncio.ensure_future(self._atimed(self.primary, operation, call))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                if primary.exception() is not None:
+                    self._on_primary_failure(operation, primary.exception())
+                    result = await self._atimed(self.backup, operation, call)
+                    self._served = self.backup
+                    return result
+                self._served = self.primary
+                return primary.result()
+
+            self._on_hedge(operation, delay)
+            backup = asyncio.ensure_future(self._atimed(self.backup, operation, call))
+            tasks.append(backup)
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winners = [task for task in done if task.exception() is None]
+                if winners:
+                    winner = primary if primary in winners else winners[0]
+                    for task in winners:
+                        if task is not winner and discard:
+                            await discard(task.result())
+                    if winner is backup:
+                        self._on_win(operation)
+                    self._served = self.primary if winner is primary else self.backup
+                    return winner.result()
+            # 两个请求都失败时抛出主提供商的异常
+            return primary.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def aanalyze_question(self, question: str, tone: str, length: str) -> str:
+        """异步分析问题"""
+        return await self._ahedge("analyze", lambda strategy: strategy.aanalyze_question(question, tone, length))
+
+    async def agenerate_answer(self, question: str, context: List[str], tone: str, word_count: str) -> str:
+        """异步生成回答"""
+        return await self._ahedge(
+            "generate", lambda strategy: strategy.agenerate_answer(question, context, tone, word_count)
+        )
+
+    async def astream_answer(self, question: str, context: List[str], tone: str, word_count: str) -> AsyncIterator[str]:
+        """
+        流式生成回答
+
+        以第一个片段的到达时间进行对冲：先产出第一个片段的提供商继续输出完整回答，另一个流被关闭。
+        """
+        async def first_chunk(strategy: ModelStrategy) -> Tuple[AsyncIterator[str], Optional[str]]:
+            stream = strategy.astream_answer(question, context, tone, word_count)
+            try:
+                return stream, await stream.__anext__()
+            except StopAsyncIteration:
+                return stream, None
+
+        async def close(result: Tuple[AsyncIterator[str], Optional[str]]):
+            await result[0].aclose()
+
+        stream, chunk = await self._ahedge("stream", first_chunk, discard=close)
+        try:
+            if chunk is None:
+                return
+            yield chunk
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
@@ -0,0 +1,315 @@
+import json
+import asyncio
+import threading
+import concurrent.futures
+import weakref
+import logging
+from typing import Any, AsyncIterator, Awaitable, Dict, Iterator, List, Optional, Tuple, TypeVar
+import httpx
+from .config import HTTP_CLIENT_CONFIG, PROVIDER_HTTP_CONFIG
+from .provider_stats import prompt_cache_stats
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 每个事件循环中每个 (提供商, 接口根地址, API密钥) 一个异步HTTP客户端（httpx的连接池不能跨事件循环使用）
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, str, str], httpx.AsyncClient]]" = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+
+# 供同步代码使用的常驻事件循环，在后台线程中运行
+_background_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+try:
+    import h2  # noqa: F401
+    _h2_available = True
+except ImportError:
+    _h2_available = False
+
+
+def get_http_config(provider: str) -> Dict[str, Any]:
+    """获取提供商的HTTP客户端配置（全局配置加上提供商的覆盖项）"""
+    return {**HTTP_CLIENT_CONFIG, **PROVIDER_HTTP_CONFIG.get(provider, {})}
+
+
+def _client_options(provider: str, base_url: str, api_key: str) -> Dict[str, Any]:
+    """同步和异步客户端共用的构造参数"""
+    config = get_http_config(provider)
+    http2 = config["http2"]
+    if http2 and not _h2_available:
+        logger.warning("未安装h2，模型接口使用HTTP/1.1，可通过 pip install httpx[http2] 启用HTTP/2")
+        http2 = False
+    return {
+        "base_url": base_url,
+        "headers": _headers(api_key),
+        "timeout": httpx.Timeout(config["timeout"], connect=config["connect_timeout"]),
+        "limits": httpx.Limits(
+            max_connections=config["max_connections"],
+            max_keepalive_connections=config["max_keepalive_connections"],
+            keepalive_expiry=config["keepalive_expiry"]
+        ),
+        "http2": http2
+    }
+
+
+def create_client(provider: str, base_url: str, api_key: str) -> httpx.Client:
+    """
+    为提供商创建长期复用的同步HTTP客户端，连接池中的连接保持活动，后续请求不再握手
+
+    Args:
+        provider: 提供商名称，用于读取连接池配置
+        base_url: 接口根地址，请求时使用相对路径
+        api_key: API密钥，作为默认的Authorization请求头
+    """
+    return httpx.Client(**_client_options(provider, base_url, api_key))
+
+
+def get_async_client(provider: str, base_url: str, api_key: str) -> httpx.AsyncClient:
+    """
+    获取当前事件循环中提供商的异步HTTP客户端，首次使用时创建
+
+    按提供商、接口根地址和API密钥区分，同一提供商的不同接口地址或密钥不会共用客户端。
+    """
+    loop = asyncio.get_running_loop()
+    key = (provider, base_url, api_key)
+    with _clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(**_client_options(provider, base_url, api_key))
+            clients[key] = client
+        return client
+
+
+def _get_background_loop() -> asyncio.AbstractEventLoop:
+    """获取常驻的后台事件循环，首次使用时启动"""
+    global _background_loop
+    with _loop_lock:
+        if _background_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="async-runtime", daemon=True).start()
+            _background_loop = loop
+        return _background_loop
+
+
+def run_async(coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+    """
+    在常驻的后台事件循环中运行协程，并阻塞等待结果
+
+    供Streamlit页面等同步代码调用。所有调用共用同一个事件循环，HTTP连接在多次调用之间保持，
+    多个线程同时提交的协程在同一个循环中并发执行。
+
+    Args:
+        coro: 要运行的协程
+        timeout: 等待结果的超时时间（秒），为None时一直等待
+
+    Returns:
+        协程的返回值
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_background_loop()).result(timeout)
+
+
+def iterate_async(agen: AsyncIterator[T]) -> Iterator[T]:
+    """
+    在常驻的后台事件循环中逐项取出异步生成器的结果，供同步代码边接收边处理
+
+    Args:
+        agen: 异步生成器
+
+    Yields:
+        异步生成器产出的每一项
+    """
+    loop = _get_background_loop()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(agen.__anext__(), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        # 调用方提前停止迭代时关闭生成器，释放其中的连接
+        asyncio.run_coroutine_threadsafe(agen.aclose(), loop).result()
+
+
+def warm_up(
+    provider: str,
+    base_url: str,
+    api_key: str,
+    client: httpx.Client
+) -> Optional[Tuple[threading.Thread, "concurrent.futures.Future[None]"]]:
+    """
+    在后台预先建立同步客户端和后台事件循环中异步客户端的连接，不阻塞调用方
+
+    只发送一个HEAD请求完成TCP和TLS握手，响应状态无关紧要，失败时忽略。
+
+    Returns:
+        同步预热的线程和异步预热的Future，需要等待预热完成时使用；未启用预热时为None
+    """
+    if not get_http_config(provider)["warmup"]:
+        return None
+
+    def warm_sync():
+        try:
+            client.head("/")
+            logger.debug(f"{provider} 同步连接已预热")
+        except Exception as e:
+            logger.debug(f"{provider} 同步连接预热失败: {str(e)}")
+
+    async def warm_async():
+        try:
+            await get_async_client(provider, base_url, api_key).head("/")
+            logger.debug(f"{provider} 异步连接已预热")
+        except Exception as e:
+            logger.debug(f"{provider} 异步连接预热失败: {str(e)}")
+
+    thread = threading.Thread(target=warm_sync, name=f"warmup-{provider}", daemon=True)
+    thread.start()
+    return thread, asyncio.run_coroutine_threadsafe(warm_async(), _get_background_loop())
+
+
+def _headers(api_key: str) -> Dict[str, str]:
+    """OpenAI兼容接口的请求头"""
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+
+def _chat_payload(model: str, messages: List[Dict[str, Any]], temperature: float, max_tokens: int, stream: bool = False) -> Dict[str, Any]:
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens
+    }
+    if stream:
+        # OpenAI、DeepSeek和通义千问只在请求时才在流式响应的最后一个片段中返回usage
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+    return payload
+
+
+def _parse_chat(label: str, model: str, response: httpx.Response) -> str:
+    """取出对话补全的回复内容，并记录命中前缀缓存的token数"""
+    if response.status_code == 200:
+        body = response.json()
+        prompt_cache_stats.record(model, body.get("usage"))
+        choices = body.get("choices") or []
+        if choices and choices[0].get("message", {}).get("content") is not None:
+            return choices[0]["message"]["content"]
+    logger.error(f"{label} API响应异常: {response.text}")
+    raise ValueError(f"{label} API响应异常: {response.status_code}")
+
+
+def _parse_embeddings(label: str, response: httpx.Response, count: int) -> List[List[float]]:
+    """取出嵌入向量并按返回的index还原输入顺序"""
+    if response.status_code == 200:
+        data = response.json().get("data") or []
+        if len(data) == count:
+            return [item["embedding"] for item in sorted(data, key=lambda item: item.get("index", 0))]
+    logger.error(f"{label} 嵌入接口响应异常: {response.text}")
+    raise ValueError(f"{label} 嵌入接口响应异常: {response.status_code}")
+
+
+def chat_completion(
+    client: httpx.Client,
+    label: str,
+    model: str,
+    messages: List[Dict[str, Any]],
+    temperature: float = 0.7,
+    max_tokens: int = 1024
+) -> str:
+    """
+    调用OpenAI兼容的对话补全接口
+
+    Args:
+        client: 提供商的HTTP客户端
+        label: 提供商显示名称，用于错误信息
+        model: 模型名称
+        messages: 对话消息
+        temperature: 采样温度
+        max_tokens: 最多生成的token数
+
+    Returns:
+        str: 模型回复的内容
+
+    Raises:
+        ValueError: 接口返回错误或响应格式异常
+    """
+    response = client.post("/chat/completions", json=_chat_payload(model, messages, temperature, max_tokens))
+    return _parse_chat(label, model, response)
+
+
+async def achat_completion(
+    client: httpx.AsyncClient,
+    label: str,
+    model: str,
+    messages: List[Dict[str, Any]],
+    temperature: float = 0.7,
+    max_tokens: int = 1024
+) -> str:
+    """chat_completion的异步版本"""
+    response = await client.post("/chat/completions", json=_chat_payload(model, messages, temperature, max_tokens))
+    return _parse_chat(label, model, response)
+
+
+async def astream_chat_completion(
+    client: httpx.AsyncClient,
+    label: str,
+    model: str,
+    messages: List[Dict[str, Any]],
+    temperature: float = 0.7,
+    max_tokens: int = 1024
+) -> AsyncIterator[str]:
+    """
+    以流式方式调用OpenAI兼容的对话补全接口，逐段产出模型输出
+
+    接口以SSE格式返回，每行 data: 后是一个增量片段，以 data: [DONE] 结束。
+
+    Raises:
+        ValueError: 接口返回错误
+    """
+    payload = _chat_payload(model, messages, temperature, max_tokens, stream=True)
+    async with client.stream("POST", "/chat/completions", json=payload) as response:
+        if response.status_code != 200:
+            body = await response.aread()
+            logger.error(f"{label} API响应异常: {body.decode('utf-8', errors='replace')}")
+            raise ValueError(f"{label} API响应异常: {response.status_code}")
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            try:
+                chunk = json.loads(data)
+            except json.JSONDecodeError:
+                logger.debug(f"{label} 流式响应中无法解析的行: {data[:100]}")
+                continue
+            choices = chunk.get("choices") or []
+            # usage在最后一个片段中返回，Kimi放在choices[0]中
+            usage = chunk.get("usage") or (choices[0].get("usage") if choices else None)
+            if usage:
+                prompt_cache_stats.record(model, usage)
+            content = (choices[0].get("delta") or {}).get("content") if choices else None
+            if content:
+                yield content
+
+
+def embed_batch(client: httpx.Client, label: str, model: str, texts: List[str]) -> List[List[float]]:
+    """
+    调用OpenAI兼容的嵌入接口，一次请求获取一个批次文本的嵌入向量
+
+    Raises:
+        ValueError: 接口返回错误或向量数量不符
+    """
+    response = client.post("/embeddings", json={"model": model, "input": texts})
+    return _parse_embeddings(label, response, len(texts))
+
+
+async def aembed_batch(client: httpx.AsyncClient, label: str, model: str, texts: List[str]) -> List[List[float]]:
+    """embed_batch的异步版本"""
+    response = await client.post("/embeddings", json={"model": model, "input": texts})
+    return _parse_embeddings(label, response, len(texts))
@@ -0,0 +1,322 @@
+import os
+import json
+import math
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+import numpy as np
+import faiss
+from langchain_community.vectorstores import FAISS
+from .config import VECTOR_INDEX_CONFIG
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 索引构建配置文件名，与index.faiss保存在同一目录
+INDEX_CONFIG_FILE_NAME = "index_config.json"
+
+# 支持的索引类型
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq", "sq")
+
+# FAISS建议每个聚类中心至少有39个训练样本
+MIN_POINTS_PER_CENTROID = 39
+# 每个聚类中心最多使用的训练样本数，超过的部分FAISS也会自行采样
+MAX_POINTS_PER_CENTROID = 256
+# 重建索引时每次从旧索引中取出的向量数，避免一次性解压全部向量
+REBUILD_CHUNK_SIZE = 65536
+
+_METRIC_NAMES = {faiss.METRIC_L2: "l2", faiss.METRIC_INNER_PRODUCT: "ip"}
+
+
+def load_index_config(store_path: str) -> Optional[Dict[str, Any]]:
+    """读取与索引一起保存的构建配置，旧版本索引没有该文件时返回None"""
+    config_path = os.path.join(store_path, INDEX_CONFIG_FILE_NAME)
+    try:
+        with open(config_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"读取索引配置时出错: {str(e)}，按精确索引处理")
+        return None
+
+
+def write_index_config(index_config: Dict[str, Any], store_path: str):
+    """把索引构建配置写入目录"""
+    with open(os.path.join(store_path, INDEX_CONFIG_FILE_NAME), "w", encoding="utf-8") as f:
+        json.dump(index_config, f, ensure_ascii=False, indent=2)
+
+
+def _pq_subquantizers(dim: int, requested: int) -> int:
+    """选择PQ子量化器个数，必须能整除向量维度"""
+    if requested and dim % requested == 0:
+        return requested
+    if requested:
+        logger.warning(f"pq_m={requested} 不能整除向量维度 {dim}，自动选择")
+    for m in range(min(64, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def plan_index(num_vectors: int, dim: int, config: Dict[str, Any] = VECTOR_INDEX_CONFIG) -> Dict[str, Any]:
+    """
+    根据向量数和维度确定实际使用的索引结构
+
+    IVF类索引的聚类数未指定时取 4*sqrt(N)，并保证每个聚类中心有足够的训练样本；
+    向量太少、无法训练时先退回精确索引，等知识库变大后再自动重建。
+
+    Args:
+        num_vectors: 索引中的向量数
+        dim: 向量维度
+        config: 请求的索引配置
+
+    Returns:
+        Dict[str, Any]: 实际索引类型、FAISS工厂字符串、构建参数和检索参数
+    """
+    index_type = config.get("type", "flat")
+    if index_type not in INDEX_TYPES:
+        logger.warning(f"不支持的索引类型: {index_type}，使用精确索引")
+        index_type = "flat"
+
+    if index_type == "hnsw":
+        m = int(config.get("hnsw_m", 32))
+        return {
+            "type": "hnsw",
+            "factory": f"HNSW{m}",
+            "build_params": {"hnsw_m": m, "ef_construction": int(config.get("ef_construction", 200))},
+            "search_params": {"ef_search": int(config.get("ef_search", 64))}
+        }
+
+    if index_type == "sq":
+        sq_type = config.get("sq_type", "fp16")
+        factory = {"fp16": "SQfp16", "8bit": "SQ8", "4bit": "SQ4"}.get(sq_type)
+        if factory is None:
+            logger.warning(f"不支持的标量量化类型: {sq_type}，使用fp16")
+            sq_type, factory = "fp16", "SQfp16"
+        return {"type": "sq", "factory": factory, "build_params": {"sq_type": sq_type}, "search_params": {}}
+
+    if index_type in ("ivf_flat", "ivf_pq"):
+        nlist = int(config.get("nlist") or 0) or int(4 * math.sqrt(max(num_vectors, 1)))
+        # 训练样本不足时减少聚类数
+        nlist = min(nlist, num_vectors // MIN_POINTS_PER_CENTROID)
+        min_points = 0
+        build_params: Dict[str, Any] = {"nlist": nlist}
+        if index_type == "ivf_pq":
+            pq_m = _pq_subquantizers(dim, int(config.get("pq_m") or 0))
+            pq_nbits = int(config.get("pq_nbits", 8))
+            # PQ码本同样需要训练，每个子空间有 2^nbits 个中心
+            min_points = MIN_POINTS_PER_CENTROID * (1 << pq_nbits)
+            build_params.update({"pq_m": pq_m, "pq_nbits": pq_nbits})
+            factory = f"IVF{nlist},PQ{pq_m}x{pq_nbits}"
+        else:
+            factory = f"IVF{nlist},Flat"
+
+        if nlist >= 1 and num_vectors >= min_points:
+            # 训练样本数上限，超过的部分只会拖慢训练
+            centroids = max(nlist, 1 << build_params["pq_nbits"]) if index_type == "ivf_pq" else nlist
+            build_params["max_train_points"] = centroids * MAX_POINTS_PER_CENTROID
+            return {
+                "type": index_type,
+                "factory": factory,
+                "build_params": build_params,
+                "search_params": {"nprobe": min(int(config.get("nprobe", 16)), nlist)}
+            }
+        logger.info(f"{num_vectors} 个向量不足以训练 {index_type} 索引，暂时使用精确索引")
+
+    return {"type": "flat", "factory": "Flat", "build_params": {}, "search_params": {}}
+
+
+def apply_search_params(index: faiss.Index, index_config: Optional[Dict[str, Any]]):
+    """把配置中的检索参数（nprobe、efSearch）设置到索引上"""
+    if not index_config:
+        return
+    search_params = index_config.get("search_params", {})
+    if "nprobe" in search_params:
+        faiss.extract_index_ivf(index).nprobe = int(search_params["nprobe"])
+    if "ef_search" in search_params:
+        faiss.downcast_index(index).hnsw.efSearch = int(search_params["ef_search"])
+
+
+def enable_reconstruct(index: faiss.Index):
+    """让索引可以按位置取回向量：IVF索引需要建立直接映射，其他索引本身就支持"""
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return
+    if ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+
+
+def _iter_vectors(index: faiss.Index, positions: Sequence[int]) -> Iterator[np.ndarray]:
+    """按块从索引中取出指定位置的向量"""
+    enable_reconstruct(index)
+
+    for start in range(0, len(positions), REBUILD_CHUNK_SIZE):
+        chunk = np.asarray(positions[start:start + REBUILD_CHUNK_SIZE], dtype=np.int64)
+        # 按连续区间批量取出，删除少量片段后的大部分位置仍然是连续的
+        breaks = np.flatnonzero(np.diff(chunk) != 1) + 1
+        yield np.vstack([
+            index.reconstruct_n(int(run[0]), len(run))
+            for run in np.split(chunk, breaks)
+        ])
+
+
+def _train_sample(index: faiss.Index, positions: Sequence[int], max_points: int) -> np.ndarray:
+    """从索引中均匀抽取训练样本"""
+    if len(positions) > max_points:
+        rng = np.random.default_rng(0)
+        positions = np.sort(rng.choice(np.asarray(positions), size=max_points, replace=False))
+    return np.vstack(list(_iter_vectors(index, list(positions))))
+
+
+def metric_name(index: faiss.Index) -> str:
+    """索引的距离度量名称"""
+    return _METRIC_NAMES.get(index.metric_type, str(index.metric_type))
+
+
+def _describe(index: faiss.Index, plan: Dict[str, Any], requested: Dict[str, Any]) -> Dict[str, Any]:
+    """生成要保存的索引配置"""
+    return {
+        "type": plan["type"],
+        "factory": plan["factory"],
+        "dim": index.d,
+        "metric": metric_name(index),
+        "build_params": plan["build_params"],
+        "search_params": plan["search_params"],
+        "trained_size": index.ntotal,
+        "requested": dict(requested)
+    }
+
+
+def _refill(vectorstore: FAISS, new_index: faiss.Index, positions: List[int]):
+    """把旧索引中指定位置的向量按块加入新索引，并替换向量存储的索引和位置映射"""
+    for vectors in _iter_vectors(vectorstore.index, positions):
+        new_index.add(vectors)
+    vectorstore.index_to_docstore_id = {
+        new_position: vectorstore.index_to_docstore_id[old_position]
+        for new_position, old_position in enumerate(positions)
+    }
+    vectorstore.index = new_index
+
+
+def rebuild_index(vectorstore: FAISS, plan: Dict[str, Any], requested: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    按计划重建向量存储的索引（原地替换），需要训练的索引自动训练
+
+    向量从旧索引中按块取出，PQ、标量量化等有损索引重建时使用的是解码后的近似向量。
+
+    Args:
+        vectorstore: 要重建的向量存储
+        plan: plan_index返回的索引结构
+        requested: 请求的索引配置，与结果一起保存
+
+    Returns:
+        Dict[str, Any]: 新索引的配置
+    """
+    old_index = vectorstore.index
+    positions = list(range(old_index.ntotal))
+
+    new_index = faiss.index_factory(old_index.d, plan["factory"], old_index.metric_type)
+    if "ef_construction" in plan["build_params"]:
+        faiss.downcast_index(new_index).hnsw.efConstruction = plan["build_params"]["ef_construction"]
+
+    if not new_index.is_trained:
+        max_points = plan["build_params"].get("max_train_points", len(positions))
+        sample = _train_sample(old_index, positions, max_points)
+        logger.info(f"使用 {len(sample)} 个样本训练 {plan['factory']} 索引")
+        new_index.train(sample)
+
+    _refill(vectorstore, new_index, positions)
+    index_config = _describe(new_index, plan, requested)
+    apply_search_params(new_index, index_config)
+    logger.info(f"索引已重建为 {plan['factory']}，共 {new_index.ntotal} 个向量")
+    return index_config
+
+
+def _needs_rebuild(index: faiss.Index, index_config: Dict[str, Any], plan: Dict[str, Any], requested: Dict[str, Any]) -> bool:
+    """判断现有索引是否需要按新的计划重建"""
+    if plan["type"] != index_config.get("type"):
+        return True
+
+    built = index_config.get("build_params", {})
+    if plan["type"] in ("ivf_flat", "ivf_pq"):
+        # 自动选择的聚类数随向量数变化，只在向量数大幅增长时重新训练
+        if requested.get("nlist") and built.get("nlist") != plan["build_params"]["nlist"]:
+            return True
+        if any(built.get(key) != plan["build_params"].get(key) for key in ("pq_m", "pq_nbits")):
+            return True
+        growth = float(requested.get("retrain_growth", 4))
+        if index.ntotal >= growth * max(index_config.get("trained_size", 0), 1):
+            logger.info(f"索引向量数已从 {index_config.get('trained_size', 0)} 增长到 {index.ntotal}，重新训练")
+            return True
+        return False
+
+    return built != plan["build_params"]
+
+
+def configure_index(
+    vectorstore: FAISS,
+    index_config: Optional[Dict[str, Any]],
+    requested: Dict[str, Any] = VECTOR_INDEX_CONFIG
+) -> Dict[str, Any]:
+    """
+    保存前让索引符合请求的配置
+
+    以下情况会重建（并训练）索引：索引类型或构建参数变了；之前因为样本不足退回了精确索引，
+    现在已经可以训练；IVF索引的向量数增长到训练时的 retrain_growth 倍以上。
+    只有检索参数变化时不重建，直接更新配置。
+
+    Args:
+        vectorstore: 要保存的向量存储（会被原地修改）
+        index_config: 磁盘上已有的索引配置，旧版本索引为None
+        requested: 请求的索引配置
+
+    Returns:
+        Dict[str, Any]: 与索引一起保存的配置
+    """
+    index = vectorstore.index
+    plan = plan_index(index.ntotal, index.d, requested)
+
+    if index_config is None:
+        # 旧版本索引或本次新建的索引，都是LangChain创建的精确索引
+        index_config = _describe(index, {"type": "flat", "factory": "Flat", "build_params": {}, "search_params": {}}, {})
+
+    if index.ntotal and _needs_rebuild(index, index_config, plan, requested):
+        return rebuild_index(vectorstore, plan, requested)
+
+    index_config = dict(index_config, requested=dict(requested))
+    if plan["type"] == index_config["type"]:
+        index_config["search_params"] = plan["search_params"]
+    apply_search_params(index, index_config)
+    return index_config
+
+
+def remove_vectors(vectorstore: FAISS, ids: List[str], index_config: Optional[Dict[str, Any]]):
+    """
+    从向量存储中删除片段
+
+    精确索引和标量量化索引删除后位置会紧凑排列，可以直接使用LangChain的delete；
+    IVF删除后位置不再连续，HNSW不支持删除，这两类索引复用已训练的结构重新添加剩余向量。
+
+    Args:
+        vectorstore: 向量存储（会被原地修改）
+        ids: 要删除的片段ID
+        index_config: 当前索引配置
+    """
+    index = faiss.downcast_index(vectorstore.index)
+    if isinstance(index, faiss.IndexFlatCodes):
+        vectorstore.delete(ids)
+        return
+
+    id_set = set(ids)
+    keep_positions = sorted(
+        position for position, docstore_id in vectorstore.index_to_docstore_id.items()
+        if docstore_id not in id_set
+    )
+    vectorstore.docstore.delete(list(id_set))
+
+    # 克隆并清空旧索引，保留已训练的聚类中心和码本
+    new_index = faiss.clone_index(index)
+    new_index.reset()
+    _refill(vectorstore, new_index, keep_positions)
+    apply_search_params(new_index, index_config)
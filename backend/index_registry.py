@@ -0,0 +1,284 @@
+import os
+import json
+import time
+import logging
+import faiss
+from typing import Any, Dict, List, Optional, Tuple
+from .config import MODEL_CONFIG, VECTOR_STORE_PATH
+from .model_strategies import ModelStrategy, FakeStrategy
+from .model_factory import model_factory
+from .circuit_breaker import circuit_breakers
+from .index_factory import metric_name
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 索引清单文件名，记录构建索引所用的嵌入提供商、模型、维度和距离度量
+MANIFEST_FILE_NAME = "manifest.json"
+
+# 没有任何可用提供商时使用的假嵌入
+FAKE_PROVIDER = "fake"
+
+# 选择嵌入提供商的优先顺序
+EMBEDDING_PROVIDER_ORDER = ("zhipu", "openai", "qwen", "deepseek", "kimi")
+
+
+class StrategyEmbeddings:
+    """把模型策略的get_embeddings封装成嵌入模型，索引和查询使用同一个提供商的同一个模型"""
+
+    def __init__(self, strategy: ModelStrategy):
+        """
+        Args:
+            strategy: 提供嵌入接口的模型策略
+        """
+        self.strategy = strategy
+        self.provider = strategy.provider
+        self.model = strategy.embedding_model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """获取多个文本的嵌入向量"""
+        return self.strategy.get_embeddings(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        """获取单个文本的嵌入向量"""
+        return self.strategy.get_embeddings([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """异步获取多个文本的嵌入向量"""
+        return await self.strategy.aget_embeddings(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """异步获取单个文本的嵌入向量"""
+        return (await self.strategy.aget_embeddings([text]))[0]
+
+
+def get_index_path(provider: str) -> str:
+    """获取某个嵌入提供商的索引目录，每个提供商的索引并列存放"""
+    return os.path.join(VECTOR_STORE_PATH, provider)
+
+
+def load_manifest(store_path: str) -> Optional[Dict[str, Any]]:
+    """读取索引清单，没有清单时返回None"""
+    try:
+        with open(os.path.join(store_path, MANIFEST_FILE_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"读取索引清单 {store_path} 时出错: {str(e)}")
+        return None
+
+
+def write_manifest(manifest: Dict[str, Any], store_path: str):
+    """把索引清单写入目录"""
+    with open(os.path.join(store_path, MANIFEST_FILE_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def build_manifest(embedding_model: StrategyEmbeddings, index, previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    根据嵌入模型和FAISS索引生成清单
+
+    Args:
+        embedding_model: 构建索引所用的嵌入模型
+        index: FAISS索引
+        previous: 已有的清单，保留其中的首次构建时间
+
+    Returns:
+        Dict[str, Any]: 索引清单
+    """
+    now = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    return {
+        "provider": embedding_model.provider,
+        "model": embedding_model.model,
+        "dim": index.d,
+        "metric": metric_name(index),
+        "built_at": (previous or {}).get("built_at", now),
+        "updated_at": now
+    }
+
+
+def incompatible_index_error(store_path: str, embedding_model) -> Optional[str]:
+    """索引由同一提供商的其他嵌入模型构建时返回错误说明，两者的向量不能混用"""
+    manifest = load_manifest(store_path)
+    if manifest and manifest.get("model") != embedding_model.model:
+        return (
+            f"索引 {store_path} 由 {manifest.get('model')} 构建，与当前嵌入模型 {embedding_model.model} 不一致，"
+            f"向量不能混用。请切换回原来的嵌入模型；如果确定不再需要已有的知识库，请手动删除该目录后重新上传"
+        )
+    return None
+
+
+def check_index_compatible(store_path: str, embedding_model):
+    """
+    确认可以向已有索引中写入当前嵌入模型的向量，不会自动删除已有的知识库
+
+    Raises:
+        ValueError: 索引由其他嵌入模型构建
+    """
+    error = incompatible_index_error(store_path, embedding_model)
+    if error:
+        raise ValueError(error)
+
+
+def list_indexes() -> Dict[str, Dict[str, Any]]:
+    """
+    列出磁盘上所有带清单的索引
+
+    Returns:
+        Dict[str, Dict[str, Any]]: 提供商名称到索引清单的映射
+    """
+    indexes = {}
+    if not os.path.isdir(VECTOR_STORE_PATH):
+        return indexes
+    for name in sorted(os.listdir(VECTOR_STORE_PATH)):
+        store_path = os.path.join(VECTOR_STORE_PATH, name)
+        if not os.path.exists(os.path.join(store_path, "index.faiss")):
+            continue
+        manifest = load_manifest(store_path)
+        if manifest and manifest.get("provider") == name:
+            indexes[name] = manifest
+    return indexes
+
+
+class OfflineEmbeddings:
+    """提供商当前不可用时代表其已有索引的嵌入模型，只能用于删除片段等不需要嵌入的修改"""
+
+    def __init__(self, provider: str, model: str):
+        self.provider = provider
+        self.model = model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        raise ValueError(f"嵌入提供商 {self.provider} 不可用")
+
+    def embed_query(self, text: str) -> List[float]:
+        raise ValueError(f"嵌入提供商 {self.provider} 不可用")
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        raise ValueError(f"嵌入提供商 {self.provider} 不可用")
+
+    async def aembed_query(self, text: str) -> List[float]:
+        raise ValueError(f"嵌入提供商 {self.provider} 不可用")
+
+
+def get_embedding_model(provider: str, manifest: Optional[Dict[str, Any]] = None):
+    """
+    获取指定提供商的嵌入模型
+
+    Args:
+        provider: 提供商名称
+        manifest: 已有索引的清单；提供时即使提供商不可用也返回一个只能修改该索引的占位模型
+
+    Raises:
+        ValueError: 提供商不可用且没有提供清单
+    """
+    if provider == FAKE_PROVIDER:
+        return StrategyEmbeddings(FakeStrategy())
+    try:
+        return StrategyEmbeddings(model_factory.get_strategy(provider))
+    except ValueError:
+        if manifest is None:
+            raise
+        return OfflineEmbeddings(provider, manifest.get("model", ""))
+
+
+def _is_available(provider: str) -> bool:
+    """检查提供商当前是否可用"""
+    if provider == FAKE_PROVIDER:
+        return True
+    try:
+        model_factory.get_strategy(provider)
+        return True
+    except ValueError:
+        return False
+
+
+def resolve_embedding_provider(preferred: Optional[str] = None) -> str:
+    """
+    确定用哪个提供商构建索引：优先使用当前配置的提供商，否则按优先顺序选择第一个可用的
+
+    Args:
+        preferred: 首选提供商，默认为配置中的提供商
+
+    Returns:
+        str: 提供商名称，都不可用时为 fake
+    """
+    preferred = preferred or MODEL_CONFIG.get("provider", "auto")
+    if preferred in EMBEDDING_PROVIDER_ORDER and _is_available(preferred):
+        return preferred
+    for provider in EMBEDDING_PROVIDER_ORDER:
+        if _is_available(provider):
+            return provider
+    logger.warning("未找到可用的嵌入提供商，使用全零向量作为后备方案")
+    return FAKE_PROVIDER
+
+
+def migrate_legacy_index(root: str = VECTOR_STORE_PATH) -> Optional[str]:
+    """
+    把旧版本直接存放在根目录、没有清单的索引迁移到当前嵌入提供商的子目录，并按当前配置写入清单
+
+    旧版索引由当时配置的提供商构建，按当前配置的提供商和嵌入模型登记；
+    该提供商的子目录中已有索引时不做迁移，旧文件原样保留。
+
+    Args:
+        root: 向量存储根目录
+
+    Returns:
+        Optional[str]: 迁移到的提供商，没有需要迁移的旧版索引时为None
+    """
+    legacy_index_path = os.path.join(root, "index.faiss")
+    if not os.path.exists(legacy_index_path) or load_manifest(root) is not None:
+        return None
+
+    embedding_model = get_embedding_model(resolve_embedding_provider())
+    store_path = os.path.join(root, embedding_model.provider)
+    if os.path.exists(os.path.join(store_path, "index.faiss")):
+        logger.warning(f"{store_path} 中已有索引，{root} 中的旧版索引保持原样，不做迁移")
+        return None
+
+    os.makedirs(store_path, exist_ok=True)
+    index = faiss.read_index(legacy_index_path)
+    write_manifest(build_manifest(embedding_model, index), store_path)
+    # 索引文件最后移动，子目录在其他文件都就位后才会被识别为可用的索引
+    names = sorted(
+        (name for name in os.listdir(root) if os.path.isfile(os.path.join(root, name))),
+        key=lambda name: name == "index.faiss"
+    )
+    for name in names:
+        os.replace(os.path.join(root, name), os.path.join(store_path, name))
+    logger.info(
+        f"已把旧版索引迁移到 {store_path}，按当前配置登记为 {embedding_model.provider}/{embedding_model.model}（{index.d}维）"
+    )
+    return embedding_model.provider
+
+
+def select_index(preferred: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    为检索选择索引：优先使用首选提供商的索引，否则按优先顺序选择嵌入模型与清单一致的可用索引，
+    查询嵌入处于熔断状态的提供商放在最后
+
+    Args:
+        preferred: 首选提供商，通常是当前模型策略的提供商
+
+    Returns:
+        Tuple[str, Dict[str, Any]]: 提供商名称和索引清单
+
+    Raises:
+        FileNotFoundError: 没有可以用当前可用提供商查询的索引
+    """
+    indexes = list_indexes()
+    candidates = ([preferred] if preferred else []) + list(EMBEDDING_PROVIDER_ORDER) + [FAKE_PROVIDER]
+    # 查询嵌入处于熔断状态的提供商排在最后，优先使用能做向量检索的索引
+    candidates = sorted(dict.fromkeys(candidates), key=lambda provider: circuit_breakers.is_open(provider, "embedding"))
+    for provider in candidates:
+        manifest = indexes.get(provider)
+        if manifest is None or not _is_available(provider):
+            continue
+        model = get_embedding_model(provider).model
+        if manifest.get("model") != model:
+            logger.warning(
+                f"{provider} 索引由 {manifest.get('model')} 构建，与当前嵌入模型 {model} 不一致，跳过"
+            )
+            continue
+        return provider, manifest
+    raise FileNotFoundError(f"没有可以用当前可用的嵌入提供商查询的索引: {', '.join(indexes) or '无'}")
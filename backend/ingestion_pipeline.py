@@ -0,0 +1,200 @@
+import time
+import queue
+import hashlib
+import threading
+import logging
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from .config import INGEST_BATCH_SIZE, INGEST_QUEUE_SIZE
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class DocumentSource(NamedTuple):
+    """待导入的文档"""
+    name: str
+    """文档名，用作登记表的键"""
+    content_hash: str
+    """文件内容哈希"""
+    load_pages: Callable[[], Iterator[Document]]
+    """按页（或按段）惰性产出文档内容的函数"""
+
+
+def get_text_splitter() -> RecursiveCharacterTextSplitter:
+    """创建文本分割器"""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=200,
+        separators=["\n\n", "\n", "。", "！", "？", ".", " ", ""]
+    )
+
+
+def chunk_id(doc_name: str, text: str) -> str:
+    """根据文档名和片段内容生成稳定的片段ID"""
+    return hashlib.sha256(f"{doc_name}\x00{text}".encode("utf-8")).hexdigest()[:32]
+
+
+def iter_new_chunks(
+    source: DocumentSource,
+    old_ids: Set[str],
+    seen_ids: List[str]
+) -> Iterator[Tuple[str, Document]]:
+    """
+    逐页分割文档，只产出索引中还没有的片段
+
+    Args:
+        source: 待导入的文档
+        old_ids: 该文档上一次导入时的片段ID
+        seen_ids: 输出参数，按顺序收集本次出现的全部片段ID
+
+    Yields:
+        Tuple[str, Document]: 片段ID和片段
+    """
+    splitter = get_text_splitter()
+    seen: Set[str] = set()
+    for page in source.load_pages():
+        for split in splitter.split_documents([page]):
+            split.metadata["doc_name"] = source.name
+            split_id = chunk_id(source.name, split.page_content)
+            # 同一文档中内容相同的片段只保留一份
+            if split_id in seen:
+                continue
+            seen.add(split_id)
+            seen_ids.append(split_id)
+            if split_id not in old_ids:
+                yield split_id, split
+
+
+class _Producer(threading.Thread):
+    """解析线程：加载、分割文档，把新片段按固定大小打包放入有界队列"""
+
+    def __init__(self, sources: Iterable[DocumentSource], registry: Dict[str, Dict], batch_size: int, out_queue: queue.Queue):
+        super().__init__(name="ingest-producer", daemon=True)
+        self.sources = sources
+        self.registry = registry
+        self.batch_size = batch_size
+        self.out_queue = out_queue
+        self.stop_event = threading.Event()
+
+    def _put(self, item) -> bool:
+        """放入队列，队列满时等待；消费者出错停止后放弃"""
+        while not self.stop_event.is_set():
+            try:
+                self.out_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(self):
+        try:
+            batch: List[Tuple[str, Document]] = []
+            for source in self.sources:
+                old_ids = set(self.registry.get(source.name, {}).get("chunk_ids", []))
+                seen_ids: List[str] = []
+                failed = False
+                try:
+                    for item in iter_new_chunks(source, old_ids, seen_ids):
+                        batch.append(item)
+                        if len(batch) >= self.batch_size:
+                            if not self._put(("batch", batch)):
+                                return
+                            batch = []
+                except Exception as e:
+                    # 单个文档解析失败不影响其他文档的导入
+                    logger.error(f"解析文档 {source.name} 时出错: {str(e)}，跳过该文档的剩余部分")
+                    failed = True
+                if not self._put(("document", source, old_ids, seen_ids, failed)):
+                    return
+            if batch and not self._put(("batch", batch)):
+                return
+            self._put(("done",))
+        except Exception as e:
+            self._put(("error", e))
+
+
+def run_ingestion(
+    sources: Iterable[DocumentSource],
+    registry: Dict[str, Dict],
+    embedding_model,
+    vectorstore: Optional[FAISS],
+    batch_size: int = INGEST_BATCH_SIZE,
+    queue_size: int = INGEST_QUEUE_SIZE
+) -> Tuple[Optional[FAISS], int, Set[str]]:
+    """
+    流式导入文档：加载 -> 分割 -> 嵌入 -> 写入索引
+
+    解析在后台线程中逐页进行，新片段按固定批次经有界队列交给当前线程嵌入并写入索引，
+    因此任意时刻内存中只有有限个批次，峰值内存不随语料规模增长。
+
+    Args:
+        sources: 待导入的文档
+        registry: 文档登记表，成功后原地更新
+        embedding_model: 嵌入模型
+        vectorstore: 已有的向量存储，为None时在写入第一批时创建
+        batch_size: 每批嵌入并写入索引的片段数
+        queue_size: 队列中最多积压的批次数
+
+    Returns:
+        Tuple[Optional[FAISS], int, Set[str]]: 向量存储、新增片段数、需要删除的过时片段ID
+    """
+    batch_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    producer = _Producer(sources, registry, batch_size, batch_queue)
+    producer.start()
+
+    added = 0
+    stale_ids: Set[str] = set()
+    registry_updates: Dict[str, Dict] = {}
+    start_time = time.perf_counter()
+
+    try:
+        while True:
+            item = batch_queue.get()
+            kind = item[0]
+
+            if kind == "batch":
+                batch = item[1]
+                ids = [split_id for split_id, _ in batch]
+                texts = [doc.page_content for _, doc in batch]
+                metadatas = [doc.metadata for _, doc in batch]
+                # 嵌入模型内部按提供商上限分批并发请求，结果保持顺序
+                embeddings = embedding_model.embed_documents(texts)
+                text_embeddings = list(zip(texts, embeddings))
+                if vectorstore is None:
+                    vectorstore = FAISS.from_embeddings(text_embeddings, embedding_model, metadatas=metadatas, ids=ids)
+                else:
+                    vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+                added += len(batch)
+                logger.info(f"已写入 {added} 个新片段，耗时 {time.perf_counter() - start_time:.2f}s")
+
+            elif kind == "document":
+                source, old_ids, seen_ids, failed = item[1], item[2], item[3], item[4]
+                seen_set = set(seen_ids)
+                if failed:
+                    # 只导入了一部分：保留旧片段，不记录内容哈希，下次上传时重新处理
+                    registry_updates[source.name] = {
+                        "hash": "",
+                        "chunk_ids": seen_ids + [old_id for old_id in old_ids if old_id not in seen_set]
+                    }
+                    continue
+                stale = old_ids - seen_set
+                stale_ids.update(stale)
+                registry_updates[source.name] = {"hash": source.content_hash, "chunk_ids": seen_ids}
+                logger.info(
+                    f"文档 {source.name}: 共 {len(seen_ids)} 个片段，"
+                    f"新增 {len(seen_set - old_ids)} 个，删除 {len(stale)} 个"
+                )
+
+            elif kind == "error":
+                raise item[1]
+
+            else:
+                break
+    finally:
+        producer.stop_event.set()
+
+    registry.update(registry_updates)
+    return vectorstore, added, stale_ids
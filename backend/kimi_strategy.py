@@ -1,7 +1,11 @@
 import os
 import logging
-from typing import List
+from typing import AsyncIterator, List
+from .config import MODEL_ROLES
 from .model_strategies import ModelStrategy
+from .http_clients import embed_batch, aembed_batch
+from .embedding_cache import embedding_cache
+from .embedding_batching import embed_in_batches, aembed_in_batches
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -9,9 +13,18 @@ logger = logging.getLogger(__name__)
 class KimiStrategy(ModelStrategy):
     """Kimi模型策略"""
     
+    provider = "kimi"
+    embedding_model = "embedding-2"
+    chat_model = MODEL_ROLES["kimi"]["generation"]
+    analysis_model = MODEL_ROLES["kimi"]["analysis"]
+    base_url = "https://api.moonshot.cn/v1"
+    label = "Kimi"
+    
     def __init__(self):
         self.api_key = os.environ.get("KIMI_API_KEY")
         self.available = self._check_availability()
+        # 长期复用的连接池，创建时在后台预先建立连接
+        self.http_client = self._open_http_client() if self.available else None
     
     def _check_availability(self) -> bool:
         """检查Kimi API是否可用"""
@@ -22,166 +35,64 @@ class KimiStrategy(ModelStrategy):
     
     def analyze_question(self, question: str, tone: str, length: str) -> str:
         """使用Kimi模型分析问题"""
-        if not self.is_available():
-            raise ValueError("Kimi API不可用")
-        
-        try:
-            import requests
-            import json
-            
-            logger.info("使用Kimi模型分析问题")
-            
-            # 构建提示词
-            prompt_text = f"""请分析以下问题，并思考如何回答：
-            
-            问题：{question}
-            
-            要求：
-            - 语气：{tone}
-            - 回答长度：{length}
-            
-            请提供你的分析思路（不是回答本身）："""
-            
-            # 调用Kimi API
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "model": "moonshot-v1-8k",
-                "messages": [
-                    {"role": "user", "content": prompt_text}
-                ],
-                "temperature": 0.7,
-                "max_tokens": 1024
-            }
-            
-            response = requests.post(
-                "https://api.moonshot.cn/v1/chat/completions",
-                headers=headers,
-                data=json.dumps(data)
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                analysis = result["choices"][0]["message"]["content"]
-                logger.info("Kimi问题分析完成")
-                return analysis
-            else:
-                logger.error(f"Kimi API响应异常: {response.text}")
-                raise ValueError(f"Kimi API响应异常: {response.status_code}")
-            
-        except Exception as e:
-            logger.error(f"使用Kimi模型分析问题时出错: {str(e)}")
-            raise
+        return self._chat("分析问题", *self._analysis_request(question, tone, length))
     
     def generate_answer(self, question: str, context: List[str], tone: str, word_count: str) -> str:
         """使用Kimi模型生成回答"""
+        return self._chat("生成回答", *self._answer_request(question, context, tone, word_count))
+    
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """获取文本嵌入向量"""
         if not self.is_available():
             raise ValueError("Kimi API不可用")
         
         try:
-            import requests
-            import json
-            
-            logger.info("使用Kimi模型生成回答")
-            
-            # 构建提示词
-            prompt_text = f"""你是一位专业的知乎回答者，请根据以下信息生成一篇高质量的知乎回答：
-            
-            问题：{question}
-            
-            参考知识：
-            {"\n\n".join(context)}
-            
-            要求：
-            1. 语气风格：{tone}
-            2. 回答长度：{word_count}
-            3. 结构清晰，有逻辑性，包含适当的小标题
-            4. 内容真实可靠，避免虚构信息
-            5. 如果知识库中没有相关信息，可以使用你的通用知识
-            6. 适当引用数据或案例增加可信度
-            7. 回答应当有个人见解，不要过于平淡
-            8. 使用markdown格式美化回答
-            
-            你的回答："""
-            
-            # 调用Kimi API
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "model": "moonshot-v1-8k",
-                "messages": [
-                    {"role": "user", "content": prompt_text}
-                ],
-                "temperature": 0.7,
-                "max_tokens": 2048
-            }
-            
-            response = requests.post(
-                "https://api.moonshot.cn/v1/chat/completions",
-                headers=headers,
-                data=json.dumps(data)
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                answer = result["choices"][0]["message"]["content"]
-                logger.info("Kimi回答生成完成")
-                return answer
-            else:
-                logger.error(f"Kimi API响应异常: {response.text}")
-                raise ValueError(f"Kimi API响应异常: {response.status_code}")
-            
+            return embedding_cache.get_or_compute(self.provider, self.embedding_model, texts, self._request_embeddings)
         except Exception as e:
-            logger.error(f"使用Kimi模型生成回答时出错: {str(e)}")
+            logger.error(f"使用Kimi获取嵌入向量时出错: {str(e)}")
             raise
     
-    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """获取文本嵌入向量"""
+    def _request_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """按Kimi接口的批量上限分批获取文本嵌入向量，所有批次共用连接池"""
+        return embed_in_batches(
+            self.provider,
+            texts,
+            lambda batch: embed_batch(self.http_client, "Kimi", self.embedding_model, batch)
+        )
+    
+    async def aanalyze_question(self, question: str, tone: str, length: str) -> str:
+        """异步调用Kimi模型分析问题"""
+        return await self._achat("分析问题", *self._analysis_request(question, tone, length))
+    
+    async def agenerate_answer(self, question: str, context: List[str], tone: str, word_count: str) -> str:
+        """异步调用Kimi模型生成回答"""
+        return await self._achat("生成回答", *self._answer_request(question, context, tone, word_count))
+    
+    async def astream_answer(self, question: str, context: List[str], tone: str, word_count: str) -> AsyncIterator[str]:
+        """流式调用Kimi模型生成回答，逐段产出模型输出"""
+        async for chunk in self._astream("生成回答", *self._answer_request(question, context, tone, word_count)):
+            yield chunk
+    
+    async def aget_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """异步获取文本嵌入向量，与同步接口共用嵌入缓存"""
         if not self.is_available():
             raise ValueError("Kimi API不可用")
         
         try:
-            import requests
-            import json
-            
-            embeddings = []
-            
-            for text in texts:
-                headers = {
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                }
-                
-                data = {
-                    "model": "embedding-2",
-                    "input": text
-                }
-                
-                response = requests.post(
-                    "https://api.moonshot.cn/v1/embeddings",
-                    headers=headers,
-                    data=json.dumps(data)
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    embedding = result["data"][0]["embedding"]
-                    embeddings.append(embedding)
-                else:
-                    logger.error(f"Kimi Embedding API响应异常: {response.text}")
-                    raise ValueError(f"Kimi Embedding API响应异常: {response.status_code}")
-            
-            return embeddings
+            return await embedding_cache.aget_or_compute(self.provider, self.embedding_model, texts, self._arequest_embeddings)
         except Exception as e:
             logger.error(f"使用Kimi获取嵌入向量时出错: {str(e)}")
             raise
     
+    async def _arequest_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """按接口的批量上限分批，在事件循环中并发获取文本嵌入向量"""
+        client = self._async_client()
+        return await aembed_in_batches(
+            self.provider,
+            texts,
+            lambda batch: aembed_batch(client, "Kimi", self.embedding_model, batch)
+        )
+    
     def is_available(self) -> bool:
         """检查模型是否可用"""
         return self.available
\ No newline at end of file
@@ -1,181 +1,261 @@
-from langchain_community.document_loaders import TextLoader, PyPDFLoader, UnstructuredMarkdownLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.embeddings import FakeEmbeddings
+from langchain_core.documents import Document
+from typing import Dict, Iterator, List, Optional
 import os
-import tempfile
+import json
+import hashlib
+import threading
 import logging
-from .config import MODEL_CONFIG, VECTOR_STORE_PATH, TEMP_DIR, ensure_dir_exists
-from .ali_embeddings import AliTextEmbeddings
-from .zhipu_embeddings import ZhipuEmbeddings
+from .config import MODEL_CONFIG, ensure_dir_exists
+from .vector_store_manager import get_index_selection, save_vectorstore, get_vector_store_manager
+from .index_factory import configure_index, load_index_config, remove_vectors
+from .index_registry import (
+    build_manifest, check_index_compatible, get_embedding_model, get_index_path, incompatible_index_error,
+    list_indexes, load_manifest, migrate_legacy_index, resolve_embedding_provider
+)
+from .ingestion_pipeline import DocumentSource, run_ingestion
+from .lexical_index import BM25Index, load_lexical_index
+from .parallel_parser import ParallelParser, get_parallel_parser
+from .semantic_answers import semantic_answers
 
 # 获取日志记录器
 logger = logging.getLogger(__name__)
 
-def load_knowledge_base(files):
-    """加载知识库文件并创建向量存储"""
-    ensure_dir_exists(TEMP_DIR)
-    ensure_dir_exists(VECTOR_STORE_PATH)
+# 文档登记表，记录每个文档的内容哈希和它在索引中的片段ID
+REGISTRY_FILE_NAME = "documents.json"
+
+# 同一时间只允许一个线程修改索引，避免并发上传互相覆盖
+_ingest_lock = threading.Lock()
+
+def _load_registry(store_path: str) -> Dict[str, Dict]:
+    """读取索引目录中的文档登记表"""
+    registry_path = os.path.join(store_path, REGISTRY_FILE_NAME)
+    # 索引文件不存在时登记表已经失效
+    if not os.path.exists(registry_path) or not os.path.exists(os.path.join(store_path, "index.faiss")):
+        return {}
+    try:
+        with open(registry_path, "r", encoding="utf-8") as f:
+            return json.load(f).get("documents", {})
+    except Exception as e:
+        logger.warning(f"读取文档登记表时出错: {str(e)}，将按空登记表处理")
+        return {}
+
+def _save_registry(registry: Dict[str, Dict], store_path: str):
+    """原子地写入文档登记表"""
+    registry_path = os.path.join(store_path, REGISTRY_FILE_NAME)
+    tmp_path = registry_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"documents": registry}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, registry_path)
+
+def _content_hash(data) -> str:
+    """计算文件内容哈希"""
+    return hashlib.sha256(data).hexdigest()
+
+def _file_source(file, content_hash: str, parser: ParallelParser, only_file: bool) -> DocumentSource:
+    """为上传的文件创建流式文档来源，直接从上传缓冲区解析，结果按页产出"""
+    # 多个文件、大PDF的多个页码范围同时在多个进程中解析
+    tasks = parser.add_file(file.name, file.getbuffer(), only_file=only_file)
+    
+    def load_pages() -> Iterator[Document]:
+        yield from parser.iter_documents(tasks)
+    
+    return DocumentSource(name=file.name, content_hash=content_hash, load_pages=load_pages)
+
+def _open_vectorstore(store_path: str, embedding_model) -> Optional[FAISS]:
+    """从磁盘加载一份可修改的向量存储副本（共享实例只读，不能直接修改）"""
+    if not os.path.exists(os.path.join(store_path, "index.faiss")):
+        return None
+    return FAISS.load_local(
+        store_path,
+        embedding_model,
+        allow_dangerous_deserialization=True
+    )
+
+def _apply_changes(
+    sources: List[DocumentSource],
+    deleted_docs: List[str],
+    registry: Dict[str, Dict],
+    embedding_model,
+    store_path: str
+) -> bool:
+    """
+    把文档级别的增删改应用到一个提供商的向量存储
+    
+    Args:
+        sources: 新增或内容变化的文档
+        deleted_docs: 要删除的文档名列表
+        registry: 当前的文档登记表，会被原地更新
+        embedding_model: 构建该索引的嵌入模型
+        store_path: 索引目录
+        
+    Returns:
+        bool: 索引是否发生了变化
+    """
+    ids_to_delete = set()
+    for doc_name in deleted_docs:
+        entry = registry.pop(doc_name, None)
+        if entry:
+            ids_to_delete.update(entry.get("chunk_ids", []))
+    
+    vectorstore = _open_vectorstore(store_path, embedding_model)
+    index_config = load_index_config(store_path) if vectorstore is not None else None
+    manifest = load_manifest(store_path) if vectorstore is not None else None
+    
+    # 流式导入新增和变化的文档，只嵌入索引中还没有的片段
+    vectorstore, added, stale_ids = run_ingestion(sources, registry, embedding_model, vectorstore)
+    ids_to_delete.update(stale_ids)
+    
+    if ids_to_delete and vectorstore is not None:
+        existing_ids = set(vectorstore.index_to_docstore_id.values())
+        removable = [chunk_id for chunk_id in ids_to_delete if chunk_id in existing_ids]
+        if removable:
+            remove_vectors(vectorstore, removable, index_config)
+            logger.info(f"已从索引中删除 {len(removable)} 个片段")
     
-    documents = []
-    temp_files = []
+    if vectorstore is None:
+        return False
     
+    if not added and not ids_to_delete:
+        # 内容哈希变了但片段没有变化，只需要更新登记表
+        _save_registry(registry, store_path)
+        logger.info("知识库没有变化，跳过索引更新")
+        return False
+    
+    # 按配置的索引类型重建或训练索引（向量数不足以训练时暂时使用精确索引）
+    index_config = configure_index(vectorstore, index_config)
+    manifest = build_manifest(embedding_model, vectorstore.index, manifest)
+    # 关键词索引只为新片段分词，并删除已不存在的片段
+    lexical_index = load_lexical_index(store_path) or BM25Index()
+    lexical_index.sync(vectorstore)
+    save_vectorstore(vectorstore, store_path, index_config, manifest, lexical_index)
+    _save_registry(registry, store_path)
+    # 立即切换到新索引，正在检索的请求继续使用旧实例
+    get_vector_store_manager(embedding_model.provider).reload()
+    # 已生成的回答基于旧的知识库，知识库变化后不再复用
+    semantic_answers.clear()
+    return True
+
+def load_knowledge_base(files):
+    """增量加载知识库文件到当前嵌入提供商的索引：只嵌入新增或变化的片段，并删除已过时的片段"""
     try:
-        for file in files:
-            # 保存上传文件到临时目录
-            file_path = os.path.join(TEMP_DIR, file.name)
-            with open(file_path, "wb") as f:
-                f.write(file.getbuffer())
-            temp_files.append(file_path)
+        with _ingest_lock:
+            migrate_legacy_index()
+            embedding_model = get_embedding_model(resolve_embedding_provider())
+            store_path = get_index_path(embedding_model.provider)
+            check_index_compatible(store_path, embedding_model)
+            ensure_dir_exists(store_path)
+            logger.info(f"使用 {embedding_model.provider}/{embedding_model.model} 构建索引")
             
-            logger.info(f"处理文件: {file.name}")
+            registry = _load_registry(store_path)
+            changed = []
+            for file in files:
+                content_hash = _content_hash(file.getbuffer())
+                if registry.get(file.name, {}).get("hash") == content_hash:
+                    logger.info(f"文件 {file.name} 未变化，跳过")
+                    continue
+                changed.append((file, content_hash))
             
-            # 根据文件类型选择合适的加载器
-            if file.name.lower().endswith(".pdf"):
-                loader = PyPDFLoader(file_path)
-                logger.info(f"使用 PyPDFLoader 加载 {file.name}")
-            elif file.name.lower().endswith(".md"):
-                loader = UnstructuredMarkdownLoader(file_path)
-                logger.info(f"使用 UnstructuredMarkdownLoader 加载 {file.name}")
-            else:
-                # 尝试多种编码加载文本文件
-                try:
-                    # 首先尝试 UTF-8 编码
-                    loader = TextLoader(file_path, encoding="utf-8")
-                    logger.info(f"使用 TextLoader 加载 {file.name}，编码：utf-8")
-                except Exception as e:
-                    logger.warning(f"UTF-8 编码加载失败: {str(e)}，尝试其他编码")
-                    try:
-                        # 尝试 GBK 编码
-                        loader = TextLoader(file_path, encoding="gbk")
-                        logger.info(f"使用 TextLoader 加载 {file.name}，编码：gbk")
-                    except Exception as e:
-                        logger.warning(f"GBK 编码加载失败: {str(e)}，尝试 latin-1 编码")
-                        # 最后尝试 latin-1 编码，它可以加载任何字节序列
-                        loader = TextLoader(file_path, encoding="latin-1")
-                        logger.info(f"使用 TextLoader 加载 {file.name}，编码：latin-1")
-                
-            documents.extend(loader.load())
-        
-        if not documents:
-            logger.warning("没有加载到任何文档")
-            return False
+            if not changed:
+                logger.info("没有新增或变化的文档")
+                return True
             
-        logger.info(f"成功加载 {len(documents)} 个文档")
-        
-        # 文本分割
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000, 
-            chunk_overlap=200,
-            separators=["\n\n", "\n", "。", "！", "？", ".", " ", ""]
-        )
-        splits = text_splitter.split_documents(documents)
-        logger.info(f"文档分割为 {len(splits)} 个片段")
-        
-        # 根据配置选择嵌入模型
-        try:
-            # 首先尝试使用智谱AI嵌入模型
-            if os.environ.get("ZHIPU_API_KEY") and len(os.environ.get("ZHIPU_API_KEY")) > 10:
-                logger.info("使用智谱AI嵌入模型")
-                embedding_model = ZhipuEmbeddings()
-            # 然后尝试使用OpenAI嵌入模型
-            elif MODEL_CONFIG.get("api_key") and MODEL_CONFIG["api_key"].startswith("sk-") and len(MODEL_CONFIG["api_key"]) > 20:
-                logger.info("使用OpenAI嵌入模型")
-                embedding_model = OpenAIEmbeddings(api_key=MODEL_CONFIG["api_key"])
-            # 如果没有OpenAI API密钥，尝试使用阿里云嵌入模型
-            elif os.environ.get("DASHSCOPE_API_KEY") and len(os.environ.get("DASHSCOPE_API_KEY")) > 10:
-                logger.info("使用阿里云嵌入模型")
-                embedding_model = AliTextEmbeddings()
-            else:
-                logger.warning("未找到有效的API密钥，使用FakeEmbeddings作为后备方案")
-                embedding_model = FakeEmbeddings(size=1536)  # 使用1536维向量，与OpenAI兼容
+            # 解析进程池在多次导入之间复用
+            parser = get_parallel_parser()
+            try:
+                sources = []
+                for file, content_hash in changed:
+                    logger.info(f"处理文件: {file.name}")
+                    sources.append(_file_source(file, content_hash, parser, only_file=len(changed) == 1))
                 
-            # 创建向量库
-            vectorstore = FAISS.from_documents(
-                documents=splits, 
-                embedding=embedding_model
-            )
-        except Exception as e:
-            logger.error(f"创建嵌入模型时出错: {str(e)}")
-            raise
-        vectorstore.save_local(VECTOR_STORE_PATH)
-        logger.info(f"向量库已保存到 {VECTOR_STORE_PATH}")
-        
-        return True
+                logger.info(f"共有 {len(sources)} 个新增或变化的文档")
+                _apply_changes(sources, [], registry, embedding_model, store_path)
+            finally:
+                parser.release()
+            
+            return True
         
     except Exception as e:
         logger.error(f"加载知识库时出错: {str(e)}")
         raise
+
+def delete_documents(doc_names: List[str]) -> bool:
+    """
+    从所有提供商的索引中删除文档及其全部向量
+    
+    Args:
+        doc_names: 要删除的文档名列表
         
-    finally:
-        # 清理临时文件
-        for file_path in temp_files:
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    logger.info(f"已删除临时文件: {file_path}")
-            except Exception as e:
-                logger.warning(f"删除临时文件 {file_path} 时出错: {str(e)}")
+    Returns:
+        bool: 是否有索引发生了变化
+    """
+    changed = False
+    with _ingest_lock:
+        for provider, manifest in list_indexes().items():
+            store_path = get_index_path(provider)
+            registry = _load_registry(store_path)
+            names = [name for name in doc_names if name in registry]
+            if not names:
+                continue
+            logger.info(f"从 {provider} 索引中删除文档: {', '.join(names)}")
+            embedding_model = get_embedding_model(provider, manifest)
+            changed = _apply_changes([], names, registry, embedding_model, store_path) or changed
+    return changed
+
+def list_documents() -> List[str]:
+    """列出所有索引中已登记的文档"""
+    doc_names = set()
+    for provider in list_indexes():
+        doc_names.update(_load_registry(get_index_path(provider)))
+    return sorted(doc_names)
 
 def get_default_knowledge_base():
-    """检查是否存在默认知识库，如果不存在则创建一个简单的默认知识库"""
-    if not os.path.exists(os.path.join(VECTOR_STORE_PATH, "index.faiss")):
-        logger.info("未找到现有知识库，创建默认知识库")
-        
-        # 创建一个简单的默认文档
-        ensure_dir_exists(TEMP_DIR)
-        default_doc_path = os.path.join(TEMP_DIR, "default_knowledge.txt")
-        
-        with open(default_doc_path, "w", encoding="utf-8") as f:
-            f.write("""
-            知乎是中国知名的问答社区，用户可以在平台上提问、回答问题，分享知识和经验。
-            回答知乎问题时，应当注重逻辑性和专业性，提供有价值的信息和见解。
-            好的知乎回答通常包含个人经验、专业知识和数据支持，能够全面解答提问者的疑惑。
-            在知乎上，清晰的结构、适当的例证和真诚的态度往往能获得更多的认可。
-            """)
-            
-        # 加载默认文档
-        loader = TextLoader(default_doc_path)
-        documents = loader.load()
-        
-        # 文本分割
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000, 
-            chunk_overlap=200
-        )
-        splits = text_splitter.split_documents(documents)
-        
-        # 根据配置选择嵌入模型
-        try:
-            # 首先尝试使用智谱AI嵌入模型
-            if os.environ.get("ZHIPU_API_KEY") and len(os.environ.get("ZHIPU_API_KEY")) > 10:
-                logger.info("使用智谱AI嵌入模型")
-                embedding_model = ZhipuEmbeddings()
-            # 然后尝试使用OpenAI嵌入模型
-            elif MODEL_CONFIG.get("api_key") and MODEL_CONFIG["api_key"].startswith("sk-") and len(MODEL_CONFIG["api_key"]) > 20:
-                logger.info("使用OpenAI嵌入模型")
-                embedding_model = OpenAIEmbeddings(api_key=MODEL_CONFIG["api_key"])
-            # 如果没有OpenAI API密钥，尝试使用阿里云嵌入模型
-            elif os.environ.get("DASHSCOPE_API_KEY") and len(os.environ.get("DASHSCOPE_API_KEY")) > 10:
-                logger.info("使用阿里云嵌入模型")
-                embedding_model = AliTextEmbeddings()
-            else:
-                logger.warning("未找到有效的API密钥，使用FakeEmbeddings作为后备方案")
-                embedding_model = FakeEmbeddings(size=1536)  # 使用1536维向量，与OpenAI兼容
-                
-            # 创建向量库
-            vectorstore = FAISS.from_documents(
-                documents=splits, 
-                embedding=embedding_model
-            )
-        except Exception as e:
-            logger.error(f"创建默认知识库时出错: {str(e)}")
-            raise
-        vectorstore.save_local(VECTOR_STORE_PATH)
-        logger.info("默认知识库已创建")
-        
-        # 清理临时文件
-        os.remove(default_doc_path)
-        
-    return True
\ No newline at end of file
+    """
+    检查是否存在可用的知识库，如果不存在则为当前嵌入提供商创建一个简单的默认知识库
+    
+    Returns:
+        bool: 是否有可用的知识库；当前提供商已有其他嵌入模型构建的索引时为False，不会覆盖它
+    """
+    # 旧版本的索引直接存放在根目录，没有清单，先迁移到当前提供商的子目录
+    with _ingest_lock:
+        migrate_legacy_index()
+    
+    try:
+        get_index_selection(MODEL_CONFIG.get("provider", "auto"))
+        return True
+    except FileNotFoundError:
+        pass
+    
+    logger.info("未找到现有知识库，创建默认知识库")
+    
+    # 创建一个简单的默认文档（直接在内存中构建，不写临时文件）
+    default_text = """
+        知乎是中国知名的问答社区，用户可以在平台上提问、回答问题，分享知识和经验。
+        回答知乎问题时，应当注重逻辑性和专业性，提供有价值的信息和见解。
+        好的知乎回答通常包含个人经验、专业知识和数据支持，能够全面解答提问者的疑惑。
+        在知乎上，清晰的结构、适当的例证和真诚的态度往往能获得更多的认可。
+        """
+    source = DocumentSource(
+        name="default_knowledge.txt",
+        content_hash=_content_hash(default_text.encode("utf-8")),
+        load_pages=lambda: iter([Document(page_content=default_text, metadata={"source": "default_knowledge.txt"})])
+    )
+    
+    try:
+        with _ingest_lock:
+            embedding_model = get_embedding_model(resolve_embedding_provider())
+            store_path = get_index_path(embedding_model.provider)
+            error = incompatible_index_error(store_path, embedding_model)
+            if error:
+                # 不为默认知识库覆盖用户的已有索引，检索暂时不可用
+                logger.error(error)
+                return False
+            ensure_dir_exists(store_path)
+            registry = _load_registry(store_path)
+            _apply_changes([source], [], registry, embedding_model, store_path)
+    except Exception as e:
+        logger.error(f"创建默认知识库时出错: {str(e)}")
+        raise
+    logger.info("默认知识库已创建")
+    
+    return True
@@ -0,0 +1,245 @@
+import os
+import re
+import pickle
+import logging
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from .config import RETRIEVAL_CONFIG
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 关键词索引文件名，与index.faiss保存在同一目录
+LEXICAL_INDEX_FILE_NAME = "bm25.pkl"
+
+# 连续的汉字按字二元组切分，字母和数字按词切分
+_TOKEN_PATTERN = re.compile("([\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+)|([0-9a-z]+)")
+
+# 已删除文档超过该比例时压缩倒排表
+_COMPACT_RATIO = 0.25
+
+
+def tokenize(text: str) -> Iterator[str]:
+    """
+    中文友好的分词：汉字串切成相邻字的二元组（单个汉字保留为一元），字母数字串按小写单词切分
+
+    不依赖分词词典，对专有名词和新词同样有效。
+    """
+    for match in _TOKEN_PATTERN.finditer(text.lower()):
+        cjk, word = match.groups()
+        if word:
+            yield word
+        elif len(cjk) == 1:
+            yield cjk
+        else:
+            for i in range(len(cjk) - 1):
+                yield cjk[i:i + 2]
+
+
+class BM25Index:
+    """
+    基于BM25打分的本地倒排索引
+
+    倒排表以 (词项, 文档, 词频) 三元组的数组保存，检索前一次性按词项排序成CSR结构，
+    并预先算好每个倒排项的BM25权重，查询时只需对命中的倒排项做向量化累加。
+    文档可以增量增删，删除的文档先做标记，积累到一定比例后再压缩。
+    """
+
+    def __init__(self, k1: float = RETRIEVAL_CONFIG["bm25_k1"], b: float = RETRIEVAL_CONFIG["bm25_b"]):
+        """
+        Args:
+            k1: 词频饱和参数
+            b: 文档长度归一化参数
+        """
+        self.k1 = k1
+        self.b = b
+        self.terms: Dict[str, int] = {}
+        self.doc_ids: List[str] = []
+        self.doc_positions: Dict[str, int] = {}
+        self.doc_lengths = np.zeros(0, dtype=np.float32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.post_terms = np.zeros(0, dtype=np.int32)
+        self.post_docs = np.zeros(0, dtype=np.int32)
+        self.post_tfs = np.zeros(0, dtype=np.float32)
+        self._csr = None
+
+    def __getstate__(self):
+        # 检索结构可以由倒排三元组重新计算，不需要保存
+        state = self.__dict__.copy()
+        state["_csr"] = None
+        return state
+
+    def __len__(self) -> int:
+        return len(self.doc_positions)
+
+    def add(self, documents: Iterable[Tuple[str, str]]):
+        """
+        添加文档
+
+        Args:
+            documents: (文档ID, 文本) 序列，已存在的ID会被忽略
+        """
+        post_terms: List[int] = []
+        post_docs: List[int] = []
+        post_tfs: List[int] = []
+        lengths: List[int] = []
+        next_position = len(self.doc_ids)
+
+        for doc_id, text in documents:
+            if doc_id in self.doc_positions:
+                continue
+            counts = Counter(tokenize(text))
+            position = next_position + len(lengths)
+            for term, tf in counts.items():
+                post_terms.append(self.terms.setdefault(term, len(self.terms)))
+                post_docs.append(position)
+                post_tfs.append(tf)
+            lengths.append(sum(counts.values()))
+            self.doc_ids.append(doc_id)
+            self.doc_positions[doc_id] = position
+
+        if not lengths:
+            return
+        self.doc_lengths = np.concatenate([self.doc_lengths, np.asarray(lengths, dtype=np.float32)])
+        self.alive = np.concatenate([self.alive, np.ones(len(lengths), dtype=bool)])
+        self.post_terms = np.concatenate([self.post_terms, np.asarray(post_terms, dtype=np.int32)])
+        self.post_docs = np.concatenate([self.post_docs, np.asarray(post_docs, dtype=np.int32)])
+        self.post_tfs = np.concatenate([self.post_tfs, np.asarray(post_tfs, dtype=np.float32)])
+        self._csr = None
+
+    def remove(self, doc_ids: Iterable[str]):
+        """删除文档"""
+        for doc_id in doc_ids:
+            position = self.doc_positions.pop(doc_id, None)
+            if position is not None:
+                self.alive[position] = False
+                self._csr = None
+        if len(self.doc_ids) and 1 - len(self.doc_positions) / len(self.doc_ids) > _COMPACT_RATIO:
+            self._compact()
+
+    def _compact(self):
+        """移除已删除文档的倒排项并重新编号"""
+        new_positions = np.cumsum(self.alive) - 1
+        keep = self.alive[self.post_docs]
+        self.post_terms = self.post_terms[keep]
+        self.post_docs = new_positions[self.post_docs[keep]].astype(np.int32)
+        self.post_tfs = self.post_tfs[keep]
+        self.doc_lengths = self.doc_lengths[self.alive]
+        self.doc_ids = [doc_id for doc_id, alive in zip(self.doc_ids, self.alive) if alive]
+        self.doc_positions = {doc_id: position for position, doc_id in enumerate(self.doc_ids)}
+        self.alive = np.ones(len(self.doc_ids), dtype=bool)
+        self._csr = None
+
+    def sync(self, vectorstore):
+        """让索引与向量存储的文档库保持一致：只为新片段分词，并删除已不存在的片段"""
+        current_ids = set(vectorstore.index_to_docstore_id.values())
+        removed = [doc_id for doc_id in self.doc_positions if doc_id not in current_ids]
+        self.remove(removed)
+        added = [doc_id for doc_id in current_ids if doc_id not in self.doc_positions]
+        self.add(
+            (doc_id, vectorstore.docstore.search(doc_id).page_content)
+            for doc_id in added
+        )
+        logger.info(f"关键词索引已更新：新增 {len(added)} 个片段，删除 {len(removed)} 个，共 {len(self)} 个")
+
+    def _build_csr(self):
+        """按词项排序倒排项并计算BM25权重"""
+        keep = self.alive[self.post_docs]
+        terms = self.post_terms[keep]
+        docs = self.post_docs[keep]
+        tfs = self.post_tfs[keep]
+
+        order = np.argsort(terms, kind="stable")
+        terms, docs, tfs = terms[order], docs[order], tfs[order]
+        indptr = np.zeros(len(self.terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(self.terms)), out=indptr[1:])
+
+        num_docs = max(len(self.doc_positions), 1)
+        avg_length = float(self.doc_lengths[self.alive].mean()) if len(self.doc_positions) else 1.0
+        doc_freq = np.diff(indptr).astype(np.float32)
+        idf = np.log1p((num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+        norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[docs] / max(avg_length, 1e-6))
+        weights = idf[terms] * tfs * (self.k1 + 1) / (tfs + norm)
+
+        self._csr = (indptr, docs, weights.astype(np.float32))
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """
+        检索与查询最相关的文档
+
+        Args:
+            query: 查询文本
+            k: 返回的文档数
+
+        Returns:
+            List[Tuple[str, float]]: 按得分从高到低排列的 (文档ID, BM25得分)
+        """
+        if not self.doc_positions:
+            return []
+        if self._csr is None:
+            self._build_csr()
+        indptr, docs, weights = self._csr
+
+        term_ids = {self.terms[term] for term in tokenize(query) if term in self.terms}
+        if not term_ids:
+            return []
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = indptr[term_id], indptr[term_id + 1]
+            # 同一词项的倒排项中文档互不重复，可以直接按下标累加
+            scores[docs[start:end]] += weights[start:end]
+
+        matched = int(np.count_nonzero(scores))
+        k = min(k, matched)
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.doc_ids[position], float(scores[position])) for position in top]
+
+
+def load_lexical_index(store_path: str) -> Optional[BM25Index]:
+    """读取与索引一起保存的关键词索引，不存在时返回None"""
+    path = os.path.join(store_path, LEXICAL_INDEX_FILE_NAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except Exception as e:
+        logger.warning(f"读取关键词索引时出错: {str(e)}")
+        return None
+
+
+def write_lexical_index(lexical_index: BM25Index, store_path: str):
+    """把关键词索引写入目录"""
+    with open(os.path.join(store_path, LEXICAL_INDEX_FILE_NAME), "wb") as f:
+        pickle.dump(lexical_index, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def build_lexical_index(vectorstore) -> BM25Index:
+    """为向量存储中的全部片段构建关键词索引"""
+    lexical_index = BM25Index()
+    lexical_index.sync(vectorstore)
+    return lexical_index
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[str]], rrf_k: int = RETRIEVAL_CONFIG["rrf_k"]) -> List[Tuple[str, float]]:
+    """
+    倒数排名融合：每个排序列表中排第r位的文档得 1/(rrf_k + r) 分，累加后重新排序
+
+    只使用名次，不需要把BM25得分和向量距离换算到同一尺度。
+
+    Args:
+        rankings: 多个按相关度排好序的文档ID列表
+        rrf_k: 平滑常数，越大排名靠后的文档权重越高
+
+    Returns:
+        List[Tuple[str, float]]: 按融合得分从高到低排列的 (文档ID, 得分)
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -1,6 +1,12 @@
+import os
 import logging
-from typing import Optional, Dict, Type
+from typing import Optional, Dict, List, Type
+from .config import HEDGING_CONFIG, RESPONSE_CACHE_CONFIG, SUPPORTED_PROVIDERS
 from .model_strategies import ModelStrategy
+from .hedging import HedgedStrategy
+from .circuit_breaker import FailoverStrategy, circuit_breakers
+from .provider_stats import rank_providers
+from .response_cache import CachedStrategy
 from .zhipu_strategy import ZhipuStrategy
 from .deepseek_strategy import DeepSeekStrategy
 from .qwen_strategy import QwenStrategy
@@ -29,32 +35,69 @@ class ModelFactory:
         # 默认策略
         self._default_strategy_name = "zhipu"
     
-    def get_strategy(self, strategy_name: Optional[str] = None) -> ModelStrategy:
+    def get_strategy(self, strategy_name: Optional[str] = None, operation: str = "generate") -> ModelStrategy:
         """
         获取指定名称的模型策略
         
         Args:
             strategy_name: 策略名称，如果为None则自动选择可用的策略
-            
+            operation: 自动选择时按哪个操作（analyze、generate、embed）的实测性能排序
         Returns:
             ModelStrategy: 模型策略实例
             
         Raises:
             ValueError: 如果没有可用的策略
         """
-        # 如果指定了策略名称，尝试获取该策略
-        if strategy_name:
-            return self._get_specific_strategy(strategy_name)
+        # 如果指定了策略名称，优先使用该策略，否则按实测的耗时和错误率选择未熔断的策略
+        if strategy_name and strategy_name != "auto":
+            primary = self._get_specific_strategy(strategy_name)
+            candidates = [primary] + self._available_strategies(exclude=strategy_name)
+        else:
+            candidates = self._available_strategies()
+            if not candidates:
+                raise ValueError("没有可用的模型策略，请检查API密钥配置")
+            by_name = {strategy.provider: strategy for strategy in candidates}
+            ranked = rank_providers(
+                list(by_name),
+                operation,
+                is_healthy=lambda provider: not circuit_breakers.is_open(provider, "embedding" if operation == "embed" else "chat")
+            )
+            candidates = [by_name[provider] for provider in ranked]
+        
+        # 请求失败或熔断时自动切换到后面的策略
+        if HEDGING_CONFIG["enabled"] and len(candidates) > 1:
+            # 主策略只请求第一个提供商，失败或过慢时交给其余提供商，两边不会重复请求同一个提供商
+            strategy = HedgedStrategy(FailoverStrategy(candidates[:1]), FailoverStrategy(candidates[1:]))
+        else:
+            strategy = FailoverStrategy(candidates)
         
-        # 否则，自动选择可用的策略
-        return self._get_available_strategy()
+        # 回复缓存在最外层，命中时不经过对冲和熔断，也不计入耗时统计
+        if RESPONSE_CACHE_CONFIG["enabled"]:
+            strategy = CachedStrategy(strategy)
+        return strategy
+    
+    def _available_strategies(self, exclude: Optional[str] = None) -> List[ModelStrategy]:
+        """按默认策略优先、其余按注册顺序，列出所有可用的策略"""
+        names = [self._default_strategy_name] + [name for name in self._strategies if name != self._default_strategy_name]
+        strategies = []
+        for strategy_name in names:
+            # 没有设置API密钥的提供商直接跳过，避免每次都创建不可用的策略实例
+            if strategy_name == exclude or not self._has_api_key(strategy_name):
+                continue
+            try:
+                strategies.append(self._get_specific_strategy(strategy_name))
+            except ValueError:
+                continue
+        return strategies
+    
+    @staticmethod
+    def _has_api_key(strategy_name: str) -> bool:
+        """环境变量中是否设置了提供商的API密钥"""
+        env_var = SUPPORTED_PROVIDERS.get(strategy_name, {}).get("env_var")
+        return not env_var or len(os.environ.get(env_var) or "") >= 10
     
     def _get_specific_strategy(self, strategy_name: str) -> ModelStrategy:
         """获取指定名称的策略"""
-        # 如果是auto策略，则自动选择可用的策略
-        if strategy_name == "auto":
-            return self._get_available_strategy()
-            
         # 检查策略名称是否有效
         if strategy_name not in self._strategies:
             raise ValueError(f"未知的模型策略: {strategy_name}")
@@ -77,23 +120,17 @@ class ModelFactory:
         self._strategy_instances[strategy_name] = strategy
         return strategy
     
-    def _get_available_strategy(self) -> ModelStrategy:
-        """自动选择可用的策略"""
-        # 首先尝试默认策略
-        try:
-            return self._get_specific_strategy(self._default_strategy_name)
-        except ValueError:
-            pass
-        
-        # 尝试所有注册的策略
-        for strategy_name in self._strategies:
-            try:
-                return self._get_specific_strategy(strategy_name)
-            except ValueError:
-                continue
+    def provider_health(self) -> Dict[str, str]:
+        """
+        列出已使用过的提供商对话接口的熔断器状态
         
-        # 如果没有可用的策略，抛出异常
-        raise ValueError("没有可用的模型策略，请检查API密钥配置")
+        Returns:
+            Dict[str, str]: 策略名称到 closed、open 或 half_open 的映射
+        """
+        return {
+            strategy_name: circuit_breakers.get(strategy_name).state
+            for strategy_name in self._strategy_instances
+        }
     
     def list_available_strategies(self) -> Dict[str, bool]:
         """
@@ -125,14 +162,15 @@ class ModelFactory:
 # 创建全局模型工厂实例
 model_factory = ModelFactory()
 
-def get_model_strategy(strategy_name: Optional[str] = None) -> ModelStrategy:
+def get_model_strategy(strategy_name: Optional[str] = None, operation: str = "generate") -> ModelStrategy:
     """
     获取模型策略的便捷函数
     
     Args:
         strategy_name: 策略名称，如果为None则自动选择可用的策略
+        operation: 自动选择时按哪个操作（analyze、generate、embed）的实测性能排序
         
     Returns:
         ModelStrategy: 模型策略实例
     """
-    return model_factory.get_strategy(strategy_name)
\ No newline at end of file
+    return model_factory.get_strategy(strategy_name, operation)
\ No newline at end of file
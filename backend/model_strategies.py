@@ -1,16 +1,170 @@
 import os
+import asyncio
 import logging
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, AsyncIterator, Optional, List, Tuple
 from abc import ABC, abstractmethod
 import json
+import httpx
+from .config import CONTEXT_PACKING_CONFIG, LENGTH_GUIDE, MAX_TOKENS_CONFIG
+from .http_clients import (
+    achat_completion, astream_chat_completion, chat_completion, create_client, get_async_client, warm_up
+)
+from .context_packer import count_tokens, pack_context, select_context_tier, context_window
+from .prompt_templates import build_analysis_messages, build_answer_messages, render_messages
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def max_output_tokens(role: str, length: str) -> int:
+    """
+    按回答长度确定某个环节的最大输出token数
+
+    Args:
+        role: analysis 或 generation
+        length: 简短/中等/详细，也可以是LENGTH_GUIDE中对应的字数范围；无法识别时按中等处理
+    """
+    limits = MAX_TOKENS_CONFIG[role]
+    if length not in limits:
+        length = next((label for label, words in LENGTH_GUIDE.items() if words == length), "中等")
+    return limits[length]
+
 class ModelStrategy(ABC):
     """模型策略抽象基类"""
     
+    provider: str = ""
+    """提供商名称，与模型工厂中注册的名称一致"""
+    
+    embedding_model: str = ""
+    """get_embeddings使用的嵌入模型名称，记录在向量索引的清单中"""
+    
+    chat_model: str = ""
+    """生成回答使用的对话模型"""
+    
+    analysis_model: str = ""
+    """分析问题使用的对话模型，未设置时与chat_model相同"""
+    
+    base_url: str = ""
+    """OpenAI兼容接口的根地址"""
+    
+    label: str = ""
+    """提供商的显示名称，用于日志和错误信息"""
+    
+    api_key: Optional[str] = None
+    
+    http_client: Optional[httpx.Client] = None
+    
+    def _open_http_client(self) -> httpx.Client:
+        """创建长期复用的HTTP客户端，并在后台预先建立同步和异步连接"""
+        client = create_client(self.provider, self.base_url, self.api_key)
+        warm_up(self.provider, self.base_url, self.api_key, client)
+        return client
+    
+    def _async_client(self) -> httpx.AsyncClient:
+        """当前事件循环中本提供商的异步HTTP客户端"""
+        return get_async_client(self.provider, self.base_url, self.api_key)
+    
+    def _analysis_request(self, question: str, tone: str, length: str) -> Tuple[str, List[Dict[str, str]], int]:
+        """
+        问题分析使用的模型、对话消息和最大输出token数
+        
+        Returns:
+            Tuple[str, List[Dict[str, str]], int]: 模型名称、分析问题的对话消息和最大输出token数
+        """
+        model = self.analysis_model or self.chat_model
+        return model, build_analysis_messages(question, tone, length), max_output_tokens("analysis", length)
+    
+    def _answer_request(self, question: str, context: List[str], tone: str, word_count: str) -> Tuple[str, List[Dict[str, str]], int]:
+        """
+        按token预算压缩参考知识，按回答长度确定最大输出token数，并选择上下文窗口足够的模型档位
+        
+        Returns:
+            Tuple[str, List[Dict[str, str]], int]: 模型名称、生成回答的对话消息和最大输出token数
+        """
+        max_tokens = max_output_tokens("generation", word_count)
+        context = pack_context(question, context, CONTEXT_PACKING_CONFIG["max_context_tokens"], self.provider, self.chat_model)
+        messages = build_answer_messages(question, context, tone, word_count)
+        prompt_tokens = count_tokens(render_messages(messages), self.provider, self.chat_model)
+        model, fits = select_context_tier(self.provider, self.chat_model, prompt_tokens + max_tokens)
+        if not fits:
+            # 最大的档位也放不下时，把参考知识压缩到该档位剩余的窗口内
+            overhead = count_tokens(render_messages(build_answer_messages(question, [], tone, word_count)), self.provider, model)
+            budget = max(0, context_window(model) - max_tokens - overhead)
+            logger.warning(f"提示词约 {prompt_tokens} tokens，超出 {model} 的上下文窗口，参考知识压缩到 {budget} tokens")
+            messages = build_answer_messages(question, pack_context(question, context, budget, self.provider, model), tone, word_count)
+        return model, messages, max_tokens
+    
+    def _complete(self, model: str, messages: List[Dict[str, str]], max_tokens: int) -> str:
+        """同步调用对话补全接口，默认通过本策略的连接池调用OpenAI兼容接口"""
+        return chat_completion(self.http_client, self.label, model=model, messages=messages, max_tokens=max_tokens)
+    
+    def _chat(self, action: str, model: str, messages: List[Dict[str, str]], max_tokens: int) -> str:
+        """
+        发出一次同步的对话补全请求，记录使用的模型和结果，出错时记录日志后重新抛出
+        
+        Args:
+            action: 请求的用途，如“分析问题”“生成回答”，用于日志
+            model, messages, max_tokens: _analysis_request或_answer_request的返回值
+        """
+        if not self.is_available():
+            raise ValueError(f"{self.label} API不可用")
+        
+        try:
+            logger.info(f"使用{self.label}的{model}模型{action}")
+            logger.debug(f"提示词: {messages[-1]['content'][:100]}...")
+            result = self._complete(model, messages, max_tokens)
+            logger.info(f"{self.label}的{model}模型{action}完成")
+            return result
+        except Exception as e:
+            logger.error(f"使用{self.label}的{model}模型{action}时出错: {str(e)}")
+            raise
+    
+    async def _achat(self, action: str, model: str, messages: List[Dict[str, str]], max_tokens: int) -> str:
+        """_chat的异步版本，使用当前事件循环中的异步HTTP客户端"""
+        if not self.is_available():
+            raise ValueError(f"{self.label} API不可用")
+        
+        try:
+            result = await achat_completion(
+                self._async_client(),
+                self.label,
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens
+            )
+            logger.info(f"{self.label}的{model}模型{action}完成")
+            return result
+        except Exception as e:
+            logger.error(f"使用{self.label}的{model}模型{action}时出错: {str(e)}")
+            raise
+    
+    async def _astream(self, action: str, model: str, messages: List[Dict[str, str]], max_tokens: int) -> AsyncIterator[str]:
+        """以流式方式发出对话补全请求，逐段产出模型输出"""
+        if not self.is_available():
+            raise ValueError(f"{self.label} API不可用")
+        
+        logger.info(f"使用{self.label}的{model}模型流式{action}")
+        try:
+            async for chunk in astream_chat_completion(
+                self._async_client(),
+                self.label,
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens
+            ):
+                yield chunk
+        except Exception as e:
+            logger.error(f"使用{self.label}的{model}模型流式{action}时出错: {str(e)}")
+            raise
+    
+    def served_by(self) -> "ModelStrategy":
+        """
+        最近一次问题分析或回答生成实际使用的策略
+        
+        包装多个策略的类（熔断切换、对冲请求）返回实际给出结果的那个，用于标注回答的提供商。
+        """
+        return self
+    
     @abstractmethod
     def analyze_question(self, question: str, tone: str, length: str) -> str:
         """分析问题"""
@@ -30,10 +184,32 @@ class ModelStrategy(ABC):
     def is_available(self) -> bool:
         """检查模型是否可用"""
         pass
+    
+    # 异步接口：默认在线程池中调用同步方法，具体策略用原生异步HTTP请求覆盖，
+    # 多个问题可以在同一个事件循环中并发处理，不必每个问题占用一个线程
+    
+    async def aanalyze_question(self, question: str, tone: str, length: str) -> str:
+        """异步分析问题"""
+        return await asyncio.to_thread(self.analyze_question, question, tone, length)
+    
+    async def agenerate_answer(self, question: str, context: List[str], tone: str, word_count: str) -> str:
+        """异步生成回答"""
+        return await asyncio.to_thread(self.generate_answer, question, context, tone, word_count)
+    
+    async def astream_answer(self, question: str, context: List[str], tone: str, word_count: str) -> AsyncIterator[str]:
+        """流式生成回答，逐段产出模型输出；默认一次产出完整回答"""
+        yield await self.agenerate_answer(question, context, tone, word_count)
+    
+    async def aget_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """异步获取文本嵌入向量"""
+        return await asyncio.to_thread(self.get_embeddings, texts)
 
 class FakeStrategy(ModelStrategy):
     """假模型策略（当所有模型都不可用时使用）"""
     
+    provider = "fake"
+    embedding_model = "zeros-1536"
+    
     def analyze_question(self, question: str, tone: str, length: str) -> str:
         """分析问题"""
         return f"这是一个关于'{question}'的问题分析。请使用{tone}的语气，{length}的长度回答。"
@@ -57,6 +233,18 @@ class FakeStrategy(ModelStrategy):
         # 返回1536维的全零向量
         return [[0.0] * 1536 for _ in texts]
     
+    async def aanalyze_question(self, question: str, tone: str, length: str) -> str:
+        """异步分析问题"""
+        return self.analyze_question(question, tone, length)
+    
+    async def agenerate_answer(self, question: str, context: List[str], tone: str, word_count: str) -> str:
+        """异步生成回答"""
+        return self.generate_answer(question, context, tone, word_count)
+    
+    async def aget_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """异步获取文本嵌入向量"""
+        return self.get_embeddings(texts)
+    
     def is_available(self) -> bool:
         """检查模型是否可用"""
         return True  # 假模型始终可用
\ No newline at end of file
@@ -1,7 +1,13 @@
 import os
+import threading
 import logging
-from typing import List
+from typing import AsyncIterator, Dict, List
+from .config import MODEL_ROLES
 from .model_strategies import ModelStrategy
+from .provider_stats import prompt_cache_stats
+from .http_clients import aembed_batch
+from .embedding_cache import embedding_cache
+from .embedding_batching import embed_in_batches, aembed_in_batches
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -9,9 +15,28 @@ logger = logging.getLogger(__name__)
 class OpenAIStrategy(ModelStrategy):
     """OpenAI模型策略"""
     
+    provider = "openai"
+    embedding_model = "text-embedding-3-small"
+    base_url = "https://api.openai.com/v1"
+    label = "OpenAI"
+    
+    @property
+    def chat_model(self) -> str:
+        """生成回答的模型，可以在界面中修改"""
+        return MODEL_ROLES["openai"]["generation"]
+    
+    @property
+    def analysis_model(self) -> str:
+        """分析问题的模型，可以在界面中修改"""
+        return MODEL_ROLES["openai"]["analysis"]
+    
     def __init__(self):
         self.api_key = os.environ.get("OPENAI_API_KEY")
         self.available = self._check_availability()
+        # 长期复用的连接池，创建时在后台预先建立连接；SDK客户端在首次使用时创建，之后一直复用
+        self.http_client = self._open_http_client() if self.available else None
+        self._client = None
+        self._client_lock = threading.Lock()
     
     def _check_availability(self) -> bool:
         """检查OpenAI API是否可用"""
@@ -20,121 +45,92 @@ class OpenAIStrategy(ModelStrategy):
             return False
         return True
     
+    def _get_client(self):
+        """获取长期复用的OpenAI客户端，底层使用本策略的连接池"""
+        with self._client_lock:
+            if self._client is None:
+                from openai import OpenAI
+                self._client = OpenAI(api_key=self.api_key, http_client=self.http_client)
+            return self._client
+    
+    def _complete(self, model: str, messages: List[Dict[str, str]], max_tokens: int) -> str:
+        """通过OpenAI客户端调用对话补全接口"""
+        response = self._get_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=max_tokens
+        )
+        prompt_cache_stats.record(model, getattr(response, "usage", None))
+        return response.choices[0].message.content
+    
     def analyze_question(self, question: str, tone: str, length: str) -> str:
         """使用OpenAI模型分析问题"""
-        if not self.is_available():
-            raise ValueError("OpenAI API不可用")
-        
-        try:
-            from openai import OpenAI
-            
-            logger.info("使用OpenAI模型分析问题")
-            client = OpenAI(api_key=self.api_key)
-            
-            # 构建提示词
-            prompt_text = f"""请分析以下问题，并思考如何回答：
-            
-            问题：{question}
-            
-            要求：
-            - 语气：{tone}
-            - 回答长度：{length}
-            
-            请提供你的分析思路（不是回答本身）："""
-            
-            # 调用OpenAI模型
-            response = client.chat.completions.create(
-                model="gpt-4-turbo",
-                messages=[
-                    {"role": "system", "content": "你是一位专业的知乎回答分析专家，擅长分析问题并提供思路。"},
-                    {"role": "user", "content": prompt_text}
-                ],
-                temperature=0.7,
-                max_tokens=1024
-            )
-            
-            analysis = response.choices[0].message.content
-            logger.info("OpenAI问题分析完成")
-            return analysis
-            
-        except Exception as e:
-            logger.error(f"使用OpenAI模型分析问题时出错: {str(e)}")
-            raise
+        return self._chat("分析问题", *self._analysis_request(question, tone, length))
     
     def generate_answer(self, question: str, context: List[str], tone: str, word_count: str) -> str:
         """使用OpenAI模型生成回答"""
+        return self._chat("生成回答", *self._answer_request(question, context, tone, word_count))
+    
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """获取文本嵌入向量"""
         if not self.is_available():
             raise ValueError("OpenAI API不可用")
         
         try:
-            from openai import OpenAI
-            
-            logger.info("使用OpenAI模型生成回答")
-            client = OpenAI(api_key=self.api_key)
-            
-            # 构建提示词
-            prompt_text = f"""你是一位专业的知乎回答者，请根据以下信息生成一篇高质量的知乎回答：
-            
-            问题：{question}
-            
-            参考知识：
-            {"\n\n".join(context)}
-            
-            要求：
-            1. 语气风格：{tone}
-            2. 回答长度：{word_count}
-            3. 结构清晰，有逻辑性，包含适当的小标题
-            4. 内容真实可靠，避免虚构信息
-            5. 如果知识库中没有相关信息，可以使用你的通用知识
-            6. 适当引用数据或案例增加可信度
-            7. 回答应当有个人见解，不要过于平淡
-            8. 使用markdown格式美化回答
-            
-            你的回答："""
-            
-            # 调用OpenAI模型
-            response = client.chat.completions.create(
-                model="gpt-4-turbo",
-                messages=[
-                    {"role": "system", "content": "你是一位专业的知乎回答者，擅长生成高质量、有深度的回答。"},
-                    {"role": "user", "content": prompt_text}
-                ],
-                temperature=0.7,
-                max_tokens=2048
-            )
-            
-            answer = response.choices[0].message.content
-            logger.info("OpenAI回答生成完成")
-            return answer
-            
+            return embedding_cache.get_or_compute(self.provider, self.embedding_model, texts, self._request_embeddings)
         except Exception as e:
-            logger.error(f"使用OpenAI模型生成回答时出错: {str(e)}")
+            logger.error(f"使用OpenAI获取嵌入向量时出错: {str(e)}")
             raise
     
-    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """获取文本嵌入向量"""
+    def _request_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """按OpenAI接口的批量上限分批获取文本嵌入向量"""
+        client = self._get_client()
+        
+        def embed_batch(batch_texts: List[str]) -> List[List[float]]:
+            # input传入列表即为批量嵌入
+            response = client.embeddings.create(
+                model=self.embedding_model,
+                input=batch_texts
+            )
+            # 按返回的index还原输入顺序
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        
+        return embed_in_batches("openai", texts, embed_batch)
+    
+    async def aanalyze_question(self, question: str, tone: str, length: str) -> str:
+        """异步调用OpenAI模型分析问题"""
+        return await self._achat("分析问题", *self._analysis_request(question, tone, length))
+    
+    async def agenerate_answer(self, question: str, context: List[str], tone: str, word_count: str) -> str:
+        """异步调用OpenAI模型生成回答"""
+        return await self._achat("生成回答", *self._answer_request(question, context, tone, word_count))
+    
+    async def astream_answer(self, question: str, context: List[str], tone: str, word_count: str) -> AsyncIterator[str]:
+        """流式调用OpenAI模型生成回答，逐段产出模型输出"""
+        async for chunk in self._astream("生成回答", *self._answer_request(question, context, tone, word_count)):
+            yield chunk
+    
+    async def aget_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """异步获取文本嵌入向量，与同步接口共用嵌入缓存"""
         if not self.is_available():
             raise ValueError("OpenAI API不可用")
         
         try:
-            from openai import OpenAI
-            
-            client = OpenAI(api_key=self.api_key)
-            embeddings = []
-            
-            for text in texts:
-                response = client.embeddings.create(
-                    model="text-embedding-3-small",
-                    input=text
-                )
-                embedding = response.data[0].embedding
-                embeddings.append(embedding)
-            
-            return embeddings
+            return await embedding_cache.aget_or_compute(self.provider, self.embedding_model, texts, self._arequest_embeddings)
         except Exception as e:
             logger.error(f"使用OpenAI获取嵌入向量时出错: {str(e)}")
             raise
     
+    async def _arequest_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """按接口的批量上限分批，在事件循环中并发获取文本嵌入向量"""
+        client = self._async_client()
+        return await aembed_in_batches(
+            self.provider,
+            texts,
+            lambda batch: aembed_batch(client, "OpenAI", self.embedding_model, batch)
+        )
+    
     def is_available(self) -> bool:
         """检查模型是否可用"""
         return self.available
\ No newline at end of file
@@ -0,0 +1,326 @@
+import io
+import atexit
+import threading
+import multiprocessing
+import logging
+from multiprocessing import shared_memory
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+from langchain_core.documents import Document
+from .config import PARSE_WORKERS, PARSE_TIMEOUT, PDF_PAGES_PER_TASK
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class DocumentParseError(Exception):
+    """文档解析失败或超时"""
+
+
+class _ParseTask:
+    """一个解析任务：整个文件或PDF的一段页码范围"""
+
+    def __init__(self, name: str, page_range: Optional[Tuple[int, int]], shm_name: Optional[str] = None,
+                 size: int = 0, buffer: Optional[memoryview] = None):
+        self.name = name
+        self.page_range = page_range
+        # 在进程池中解析时通过共享内存读取文件内容；在当前进程解析时直接使用内存视图
+        self.shm_name = shm_name
+        self.size = size
+        self.buffer = buffer
+        self.result = None
+
+
+def _decode_text(buffer) -> str:
+    """依次尝试 UTF-8、GBK 编码，最后用可以解码任何字节序列的 latin-1"""
+    for encoding in ("utf-8", "gbk"):
+        try:
+            return str(buffer, encoding)
+        except UnicodeDecodeError:
+            logger.warning(f"{encoding} 编码解码失败，尝试其他编码")
+    return str(buffer, "latin-1")
+
+
+def parse_buffer(name: str, buffer, page_range: Optional[Tuple[int, int]] = None) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    直接从内存中解析文档，不经过临时文件
+
+    Args:
+        name: 文件名，用于判断类型和填写元数据
+        buffer: 文件内容（bytes或memoryview）
+        page_range: PDF的页码范围 [start, end)，为None时解析整个文件
+
+    Returns:
+        List[Tuple[str, Dict[str, Any]]]: 每页（或整个文件）的文本和元数据
+    """
+    lower_name = name.lower()
+
+    if lower_name.endswith(".pdf"):
+        from pypdf import PdfReader
+
+        reader = PdfReader(io.BytesIO(buffer))
+        start, end = page_range or (0, len(reader.pages))
+        # 元数据与PyPDFLoader保持一致
+        return [
+            (reader.pages[page].extract_text() or "", {"source": name, "page": page})
+            for page in range(start, end)
+        ]
+
+    if lower_name.endswith(".md"):
+        from unstructured.partition.md import partition_md
+
+        # 与UnstructuredMarkdownLoader的single模式一致，把所有元素合并为一个文档
+        elements = partition_md(text=_decode_text(buffer))
+        return [("\n\n".join(str(element) for element in elements), {"source": name})]
+
+    return [(_decode_text(buffer), {"source": name})]
+
+
+def _attach_shared_memory(shm_name: str) -> shared_memory.SharedMemory:
+    """在解析进程中附加到父进程创建的共享内存，不让子进程的资源跟踪器接管它"""
+    try:
+        return shared_memory.SharedMemory(name=shm_name, track=False)
+    except TypeError:
+        # Python 3.13 之前没有track参数，附加后手动取消跟踪
+        shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return shm
+
+
+def _parse_task(shm_name: str, size: int, name: str, page_range: Optional[Tuple[int, int]]) -> List[Tuple[str, Dict[str, Any]]]:
+    """在解析进程中执行的任务：从共享内存读取文件内容并解析"""
+    shm = _attach_shared_memory(shm_name)
+    try:
+        return parse_buffer(name, shm.buf[:size], page_range)
+    finally:
+        shm.close()
+
+
+def _pdf_page_count(buffer) -> int:
+    """读取PDF页数（只解析交叉引用表，开销很小）"""
+    try:
+        from pypdf import PdfReader
+        return len(PdfReader(io.BytesIO(buffer)).pages)
+    except Exception as e:
+        logger.warning(f"读取PDF页数失败: {str(e)}，将整体解析")
+        return 0
+
+
+class ParallelParser:
+    """
+    基于进程池的并行文档解析器
+
+    多个文件以及按页码范围拆分后的大PDF分散到多个进程中解析。
+    文件内容直接从上传缓冲区解析，不再写入临时目录：纯文本在当前进程中解析内存视图，
+    PDF和Markdown复制一次到共享内存，各解析进程按名字附加读取，避免每个任务都序列化整份文件。
+    提交的任务数有上限，结果按文档顺序逐个取回；每个任务都有超时，
+    超时的任务会被放弃，这批解析结束时终止整个进程池以回收卡住的进程。
+    没有任务超时时进程池在多次解析之间保留，用 get_parallel_parser 获取进程内共享的解析器。
+    """
+
+    def __init__(
+        self,
+        max_workers: int = PARSE_WORKERS,
+        timeout: float = PARSE_TIMEOUT,
+        pages_per_task: int = PDF_PAGES_PER_TASK
+    ):
+        """
+        Args:
+            max_workers: 解析进程数
+            timeout: 单个解析任务的超时时间（秒）
+            pages_per_task: 大PDF每个解析任务的页数
+        """
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self.pages_per_task = pages_per_task
+        # 同时在进程池中的任务上限，限制已解析但尚未消费的结果占用的内存
+        self.max_in_flight = self.max_workers * 2
+        self._pool = None
+        self._pending: Deque[_ParseTask] = deque()
+        self._in_flight = 0
+        self._timed_out = False
+        self._shared_memories: Dict[str, shared_memory.SharedMemory] = {}
+
+    def _get_pool(self):
+        """首次使用时创建进程池"""
+        if self._pool is None:
+            # Streamlit进程中有多个线程，使用spawn避免fork带来的锁状态问题
+            context = multiprocessing.get_context("spawn")
+            self._pool = context.Pool(processes=self.max_workers)
+            logger.info(f"已创建 {self.max_workers} 个文档解析进程")
+        return self._pool
+
+    def _pump(self):
+        """在上限内向进程池提交等待中的任务"""
+        while self._pending and self._in_flight < self.max_in_flight:
+            self._submit(self._pending.popleft())
+
+    def _submit(self, task: _ParseTask):
+        """把任务提交到进程池"""
+        task.result = self._get_pool().apply_async(_parse_task, (task.shm_name, task.size, task.name, task.page_range))
+        self._in_flight += 1
+
+    def add_file(self, name: str, buffer: memoryview, only_file: bool = False) -> List[_ParseTask]:
+        """
+        登记一个待解析的文件，大PDF按页码范围拆分成多个任务
+
+        Args:
+            name: 文件名
+            buffer: 文件内容的内存视图（如Streamlit上传文件的getbuffer()）
+            only_file: 是否是本批唯一要解析的文件；只有一个解析任务时直接在当前进程中解析，不使用进程池
+
+        Returns:
+            List[_ParseTask]: 该文件的解析任务，交给 iter_documents 按顺序取回结果
+        """
+        lower_name = name.lower()
+        if not lower_name.endswith((".pdf", ".md")):
+            # 纯文本解码很快，直接在当前进程中解析内存视图
+            return [_ParseTask(name, None, buffer=buffer)]
+
+        page_ranges: List[Optional[Tuple[int, int]]] = [None]
+        if lower_name.endswith(".pdf"):
+            page_count = _pdf_page_count(buffer)
+            if page_count > self.pages_per_task:
+                page_ranges = [
+                    (start, min(start + self.pages_per_task, page_count))
+                    for start in range(0, page_count, self.pages_per_task)
+                ]
+
+        if only_file and len(page_ranges) == 1:
+            # 没有其他任务可以并行，省去共享内存复制和进程间传递结果
+            return [_ParseTask(name, None, buffer=buffer)]
+
+        # 文件内容只复制一次到共享内存，所有页码范围任务共用
+        size = len(buffer)
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        shm.buf[:size] = buffer
+        self._shared_memories[shm.name] = shm
+
+        tasks = [_ParseTask(name, page_range, shm_name=shm.name, size=size) for page_range in page_ranges]
+        self._pending.extend(tasks)
+        self._pump()
+        logger.info(f"已登记解析任务: {name}，共 {len(tasks)} 个任务")
+        return tasks
+
+    def _release_shared_memory(self, shm_name: Optional[str]):
+        """释放文件的共享内存"""
+        shm = self._shared_memories.pop(shm_name, None) if shm_name else None
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    def _abandon(self, tasks: List[_ParseTask]) -> bool:
+        """
+        放弃尚未取回结果的任务：移出等待队列，已提交的等它结束后归还名额
+
+        已有任务超时时进程池会在release时终止，不再等待。
+
+        Returns:
+            bool: 是否已没有任务在读取这些任务的共享内存
+        """
+        abandoned = set(tasks)
+        self._pending = deque(task for task in self._pending if task not in abandoned)
+        for task in tasks:
+            task.buffer = None
+            if task.result is None:
+                continue
+            if not self._timed_out:
+                task.result.wait(self.timeout)
+                if not task.result.ready():
+                    self._timed_out = True
+            self._in_flight -= 1
+            task.result = None
+        self._pump()
+        return not self._timed_out
+
+    def iter_documents(self, tasks: List[_ParseTask]) -> Iterator[Document]:
+        """
+        按顺序取回一个文件的解析结果
+
+        Raises:
+            DocumentParseError: 任一任务解析失败或超时
+        """
+        try:
+            for task in tasks:
+                if task.buffer is not None:
+                    try:
+                        pages = parse_buffer(task.name, task.buffer)
+                    except Exception as e:
+                        raise DocumentParseError(f"解析 {task.name} 时出错: {str(e)}")
+                    finally:
+                        task.buffer = None
+                else:
+                    if task.result is None:
+                        # 任务还在等待队列中，先把它提交出去
+                        self._pending = deque(pending for pending in self._pending if pending is not task)
+                        self._submit(task)
+
+                    try:
+                        pages = task.result.get(timeout=self.timeout)
+                    except multiprocessing.TimeoutError:
+                        self._timed_out = True
+                        raise DocumentParseError(f"解析 {task.name} {task.page_range or ''} 超过 {self.timeout} 秒")
+                    except Exception as e:
+                        raise DocumentParseError(f"解析 {task.name} 时出错: {str(e)}")
+                    finally:
+                        self._in_flight -= 1
+                        task.result = None
+                        self._pump()
+
+                for page_content, metadata in pages:
+                    yield Document(page_content=page_content, metadata=metadata)
+        finally:
+            # 出错或提前结束时，同一文件的其余任务可能仍在读取共享内存，等它们结束后再释放；
+            # 超时的任务无法等待，等进程池终止后再统一释放
+            if self._abandon(tasks) and tasks:
+                self._release_shared_memory(tasks[0].shm_name)
+
+    def release(self):
+        """
+        结束一批解析并释放共享内存，进程池保留给下一批使用
+
+        有任务超时或尚未取回结果时终止进程池，回收卡住的进程，下次使用时重新创建。
+        """
+        if self._pool is not None and (self._timed_out or self._pending or self._in_flight):
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        self._timed_out = False
+        self._pending.clear()
+        self._in_flight = 0
+        for shm_name in list(self._shared_memories):
+            self._release_shared_memory(shm_name)
+
+    def close(self):
+        """释放共享内存并关闭进程池"""
+        self.release()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+# 进程内共享的解析器，避免每次导入都重新启动解析进程
+_parser: Optional[ParallelParser] = None
+_parser_lock = threading.Lock()
+
+def get_parallel_parser() -> ParallelParser:
+    """
+    获取进程内共享的并行解析器，首次使用时创建，进程退出时关闭进程池
+
+    解析器不是线程安全的，调用方需保证同一时间只有一批解析（知识库导入持有导入锁），
+    每批解析结束后调用 release。
+
+    Returns:
+        ParallelParser: 并行解析器
+    """
+    global _parser
+    with _parser_lock:
+        if _parser is None:
+            _parser = ParallelParser()
+            atexit.register(_parser.close)
+        return _parser
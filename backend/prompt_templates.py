@@ -0,0 +1,53 @@
+from typing import Dict, List
+
+# 所有提供商共用同一套提示词布局：不变的系统提示和写作要求在前，语气、长度、参考知识和问题在最后。
+# DeepSeek、Kimi、通义千问和OpenAI会自动缓存请求中相同的前缀，前缀越长、越稳定，命中的token越多。
+# Kimi的Context Caching和通义千问的显式缓存需要单独创建缓存或前缀至少1024个token，这里的固定前缀只有几百个token，
+# 依靠自动前缀缓存即可。修改下面的文本会让已有的前缀缓存和回复缓存失效。
+
+# 参考片段之间的分隔符
+CONTEXT_SEPARATOR = "\n\n"
+
+ANALYSIS_SYSTEM_PROMPT = """你是一位专业的知乎回答分析专家，擅长分析问题并提供思路。
+请分析用户给出的问题，思考如何回答：
+1. 问题真正想问的是什么，有哪些隐含的前提
+2. 回答应当覆盖哪些要点，按什么顺序展开
+3. 需要哪些数据、案例或参考知识来支撑观点
+4. 如何让回答符合要求的语气和长度
+只提供你的分析思路，不要直接写出回答。"""
+
+ANSWER_SYSTEM_PROMPT = """你是一位专业的知乎回答者，擅长生成高质量、有深度的回答。
+请根据用户给出的问题和参考知识生成一篇知乎回答，要求：
+1. 使用用户要求的语气风格和回答长度
+2. 结构清晰，有逻辑性，包含适当的小标题
+3. 内容真实可靠，避免虚构信息
+4. 如果参考知识中没有相关信息，可以使用你的通用知识
+5. 适当引用数据或案例增加可信度
+6. 回答应当有个人见解，不要过于平淡
+7. 使用markdown格式美化回答
+直接输出回答正文。"""
+
+
+def build_analysis_messages(question: str, tone: str, length: str) -> List[Dict[str, str]]:
+    """构建问题分析的对话消息，所有策略的同步和异步接口共用"""
+    return [
+        {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+        {"role": "user", "content": f"语气：{tone}\n回答长度：{length}\n\n问题：{question}"}
+    ]
+
+
+def build_answer_messages(question: str, context: List[str], tone: str, word_count: str) -> List[Dict[str, str]]:
+    """构建生成回答的对话消息，所有策略的同步和异步接口共用"""
+    knowledge = CONTEXT_SEPARATOR.join(context) or "（无）"
+    return [
+        {"role": "system", "content": ANSWER_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": f"语气风格：{tone}\n回答长度：{word_count}\n\n参考知识：\n{knowledge}\n\n问题：{question}"
+        }
+    ]
+
+
+def render_messages(messages: List[Dict[str, str]]) -> str:
+    """把对话消息拼成一段文本，用于估算token数和生成缓存键"""
+    return "\n\n".join(f"{message['role']}: {message['content']}" for message in messages)
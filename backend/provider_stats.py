@@ -0,0 +1,219 @@
+import random
+import threading
+import logging
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+import numpy as np
+from .config import HEDGING_CONFIG, ROUTING_CONFIG
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracker:
+    """按 (提供商, 操作) 记录最近一段时间成功请求的耗时，用于估计耗时分位数"""
+
+    def __init__(self, window: int = HEDGING_CONFIG["window"]):
+        """
+        Args:
+            window: 每个提供商每种操作保留的最近样本数
+        """
+        self.window = window
+        self._samples: Dict[Tuple[str, str], Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, operation: str, latency: float):
+        """记录一次成功请求的耗时（秒）"""
+        with self._lock:
+            samples = self._samples.get((provider, operation))
+            if samples is None:
+                samples = self._samples[(provider, operation)] = deque(maxlen=self.window)
+            samples.append(latency)
+
+    def count(self, provider: str, operation: str) -> int:
+        """已记录的样本数"""
+        with self._lock:
+            return len(self._samples.get((provider, operation), ()))
+
+    def percentile(self, provider: str, operation: str, q: float, min_samples: int = 1) -> Optional[float]:
+        """
+        耗时的q分位数
+
+        Returns:
+            Optional[float]: 分位数（秒），样本数少于min_samples时为None
+        """
+        with self._lock:
+            samples = list(self._samples.get((provider, operation), ()))
+        if len(samples) < max(1, min_samples):
+            return None
+        return float(np.percentile(samples, q))
+
+
+# 创建全局耗时统计实例
+latency_tracker = LatencyTracker()
+
+
+class ProviderPerformance:
+    """按 (提供商, 操作) 记录耗时和错误率的指数移动平均，用于自动选择提供商"""
+
+    def __init__(self, alpha: float = ROUTING_CONFIG["ewma_alpha"], error_penalty: float = ROUTING_CONFIG["error_penalty"]):
+        """
+        Args:
+            alpha: 移动平均中最新一次请求的权重
+            error_penalty: 错误率的惩罚系数
+        """
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self._stats: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, operation: str, latency: float, success: bool = True):
+        """
+        记录一次请求
+
+        Args:
+            provider: 提供商名称
+            operation: 操作名称：analyze、generate 或 embed
+            latency: 耗时（秒），失败的请求同样计入
+            success: 请求是否成功
+        """
+        error = 0.0 if success else 1.0
+        with self._lock:
+            stats = self._stats.get((provider, operation))
+            if stats is None:
+                self._stats[(provider, operation)] = {"latency": latency, "error_rate": error, "samples": 1}
+                return
+            stats["latency"] += self.alpha * (latency - stats["latency"])
+            stats["error_rate"] += self.alpha * (error - stats["error_rate"])
+            stats["samples"] += 1
+
+    def score(self, provider: str, operation: str) -> Optional[float]:
+        """
+        提供商某个操作的得分，越低越好
+
+        Returns:
+            Optional[float]: 平均耗时乘以错误率惩罚，没有样本时为None
+        """
+        with self._lock:
+            stats = self._stats.get((provider, operation))
+            if stats is None:
+                return None
+            return stats["latency"] * (1 + self.error_penalty * stats["error_rate"])
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """
+        所有统计
+
+        Returns:
+            Dict[str, Dict[str, Dict[str, float]]]: 提供商到各操作的平均耗时、错误率和样本数的映射
+        """
+        with self._lock:
+            result: Dict[str, Dict[str, Dict[str, float]]] = {}
+            for (provider, operation), stats in self._stats.items():
+                result.setdefault(provider, {})[operation] = dict(stats)
+            return result
+
+
+# 创建全局提供商性能统计实例
+provider_performance = ProviderPerformance()
+
+
+def rank_providers(
+    providers: List[str],
+    operation: str,
+    is_healthy: Callable[[str], bool],
+    exploration: float = ROUTING_CONFIG["exploration"],
+    rng: random.Random = random
+) -> List[str]:
+    """
+    按实测性能排列提供商：健康的在前，其中有统计的按得分从低到高，没有统计的保持原有顺序排在后面；
+    按exploration的比例随机把一个其他健康提供商提到最前，使其统计保持更新
+
+    Args:
+        providers: 按默认优先顺序排列的提供商
+        operation: 操作名称
+        is_healthy: 判断提供商是否健康（未熔断）的函数
+        exploration: 随机探索的比例
+        rng: 随机数生成器
+
+    Returns:
+        List[str]: 排序后的提供商，第一个承担本次请求，其余依次作为失败时的后备
+    """
+    healthy = [provider for provider in providers if is_healthy(provider)]
+    unhealthy = [provider for provider in providers if provider not in healthy]
+    measured = sorted(
+        (provider for provider in healthy if provider_performance.score(provider, operation) is not None),
+        key=lambda provider: provider_performance.score(provider, operation)
+    )
+    ranked = measured + [provider for provider in healthy if provider not in measured]
+    if len(ranked) > 1 and rng.random() < exploration:
+        explored = rng.choice(ranked[1:])
+        logger.debug(f"{operation} 探索提供商 {explored}")
+        ranked.remove(explored)
+        ranked.insert(0, explored)
+    return ranked + unhealthy
+
+
+def cached_prompt_tokens(usage: Dict[str, Any]) -> int:
+    """
+    从对话接口返回的usage中取出命中提供商前缀缓存的token数
+
+    DeepSeek返回 prompt_cache_hit_tokens，Kimi返回 cached_tokens，
+    OpenAI、通义千问和智谱AI返回 prompt_tokens_details.cached_tokens。
+    """
+    if "prompt_cache_hit_tokens" in usage:
+        return int(usage["prompt_cache_hit_tokens"] or 0)
+    if "cached_tokens" in usage:
+        return int(usage["cached_tokens"] or 0)
+    details = usage.get("prompt_tokens_details") or {}
+    return int(details.get("cached_tokens") or 0)
+
+
+class PromptCacheStats:
+    """按模型累计提示词token数和命中提供商前缀缓存的token数"""
+
+    def __init__(self):
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, usage: Any):
+        """
+        记录一次对话请求的usage
+
+        Args:
+            model: 模型名称
+            usage: 接口返回的usage字典，或SDK返回的usage对象；为空时不记录
+        """
+        if usage is None:
+            return
+        if not isinstance(usage, dict):
+            usage = usage.model_dump() if hasattr(usage, "model_dump") else dict(vars(usage))
+        prompt_tokens = int(usage.get("prompt_tokens") or 0)
+        cached_tokens = cached_prompt_tokens(usage)
+        with self._lock:
+            counts = self._counts.setdefault(model, {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0})
+            counts["requests"] += 1
+            counts["prompt_tokens"] += prompt_tokens
+            counts["cached_tokens"] += cached_tokens
+        if cached_tokens:
+            logger.debug(f"{model} 命中前缀缓存 {cached_tokens}/{prompt_tokens} tokens")
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        各模型的统计
+
+        Returns:
+            Dict[str, Dict[str, Any]]: 模型名称到 requests、prompt_tokens、cached_tokens、hit_rate 的映射
+        """
+        with self._lock:
+            return {
+                model: {
+                    **counts,
+                    "hit_rate": counts["cached_tokens"] / counts["prompt_tokens"] if counts["prompt_tokens"] else 0.0
+                }
+                for model, counts in self._counts.items()
+            }
+
+
+# 创建全局前缀缓存统计实例
+prompt_cache_stats = PromptCacheStats()
@@ -1,7 +1,11 @@
 import os
 import logging
-from typing import List
+from typing import AsyncIterator, List
+from .config import MODEL_ROLES
 from .model_strategies import ModelStrategy
+from .http_clients import embed_batch, aembed_batch
+from .embedding_cache import embedding_cache
+from .embedding_batching import embed_in_batches, aembed_in_batches
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -9,9 +13,19 @@ logger = logging.getLogger(__name__)
 class QwenStrategy(ModelStrategy):
     """阿里云通义千问模型策略"""
     
+    provider = "qwen"
+    embedding_model = "text-embedding-v2"
+    chat_model = MODEL_ROLES["qwen"]["generation"]
+    analysis_model = MODEL_ROLES["qwen"]["analysis"]
+    base_url = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+    label = "阿里云通义千问"
+    
     def __init__(self):
         self.api_key = os.environ.get("DASHSCOPE_API_KEY")
         self.available = self._check_availability()
+        # 长期复用的连接池，创建时在后台预先建立连接
+        # 使用DashScope的OpenAI兼容接口，dashscope SDK每次调用都会新建连接
+        self.http_client = self._open_http_client() if self.available else None
     
     def _check_availability(self) -> bool:
         """检查阿里云API是否可用"""
@@ -22,123 +36,64 @@ class QwenStrategy(ModelStrategy):
     
     def analyze_question(self, question: str, tone: str, length: str) -> str:
         """使用阿里云通义千问模型分析问题"""
-        if not self.is_available():
-            raise ValueError("阿里云API不可用")
-        
-        try:
-            from http import HTTPStatus
-            import dashscope
-            
-            logger.info("使用阿里云通义千问模型分析问题")
-            dashscope.api_key = self.api_key
-            
-            # 构建提示词
-            prompt_text = f"""请分析以下问题，并思考如何回答：
-            
-            问题：{question}
-            
-            要求：
-            - 语气：{tone}
-            - 回答长度：{length}
-            
-            请提供你的分析思路（不是回答本身）："""
-            
-            # 调用阿里云通义千问模型
-            from dashscope import Generation
-            
-            response = Generation.call(
-                model='qwen-max',
-                prompt=prompt_text,
-                temperature=0.7,
-                max_tokens=1024
-            )
-            
-            if response.status_code == HTTPStatus.OK:
-                analysis = response.output.text
-                logger.info("阿里云通义千问问题分析完成")
-                return analysis
-            else:
-                logger.error(f"阿里云通义千问API响应异常: {response.message}")
-                raise ValueError(f"阿里云通义千问API响应异常: {response.message}")
-            
-        except Exception as e:
-            logger.error(f"使用阿里云通义千问模型分析问题时出错: {str(e)}")
-            raise
+        return self._chat("分析问题", *self._analysis_request(question, tone, length))
     
     def generate_answer(self, question: str, context: List[str], tone: str, word_count: str) -> str:
         """使用阿里云通义千问模型生成回答"""
+        return self._chat("生成回答", *self._answer_request(question, context, tone, word_count))
+    
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """获取文本嵌入向量"""
         if not self.is_available():
             raise ValueError("阿里云API不可用")
         
         try:
-            from http import HTTPStatus
-            import dashscope
-            
-            logger.info("使用阿里云通义千问模型生成回答")
-            dashscope.api_key = self.api_key
-            
-            # 构建提示词
-            prompt_text = f"""你是一位专业的知乎回答者，请根据以下信息生成一篇高质量的知乎回答：
-            
-            问题：{question}
-            
-            参考知识：
-            {"\n\n".join(context)}
-            
-            要求：
-            1. 语气风格：{tone}
-            2. 回答长度：{word_count}
-            3. 结构清晰，有逻辑性，包含适当的小标题
-            4. 内容真实可靠，避免虚构信息
-            5. 如果知识库中没有相关信息，可以使用你的通用知识
-            6. 适当引用数据或案例增加可信度
-            7. 回答应当有个人见解，不要过于平淡
-            8. 使用markdown格式美化回答
-            
-            你的回答："""
-            
-            # 调用阿里云通义千问模型
-            from dashscope import Generation
-            
-            response = Generation.call(
-                model='qwen-max',
-                prompt=prompt_text,
-                temperature=0.7,
-                max_tokens=2048
-            )
-            
-            if response.status_code == HTTPStatus.OK:
-                answer = response.output.text
-                logger.info("阿里云通义千问回答生成完成")
-                return answer
-            else:
-                logger.error(f"阿里云通义千问API响应异常: {response.message}")
-                raise ValueError(f"阿里云通义千问API响应异常: {response.message}")
-            
+            return embedding_cache.get_or_compute(self.provider, self.embedding_model, texts, self._request_embeddings)
         except Exception as e:
-            logger.error(f"使用阿里云通义千问模型生成回答时出错: {str(e)}")
+            logger.error(f"使用阿里云获取嵌入向量时出错: {str(e)}")
             raise
     
-    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """获取文本嵌入向量"""
+    def _request_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """按阿里云接口的批量上限分批获取文本嵌入向量，所有批次共用连接池"""
+        return embed_in_batches(
+            self.provider,
+            texts,
+            lambda batch: embed_batch(self.http_client, "阿里云通义千问", self.embedding_model, batch)
+        )
+    
+    async def aanalyze_question(self, question: str, tone: str, length: str) -> str:
+        """异步调用阿里云通义千问模型分析问题"""
+        return await self._achat("分析问题", *self._analysis_request(question, tone, length))
+    
+    async def agenerate_answer(self, question: str, context: List[str], tone: str, word_count: str) -> str:
+        """异步调用阿里云通义千问模型生成回答"""
+        return await self._achat("生成回答", *self._answer_request(question, context, tone, word_count))
+    
+    async def astream_answer(self, question: str, context: List[str], tone: str, word_count: str) -> AsyncIterator[str]:
+        """流式调用阿里云通义千问模型生成回答，逐段产出模型输出"""
+        async for chunk in self._astream("生成回答", *self._answer_request(question, context, tone, word_count)):
+            yield chunk
+    
+    async def aget_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """异步获取文本嵌入向量，与同步接口共用嵌入缓存"""
         if not self.is_available():
             raise ValueError("阿里云API不可用")
         
         try:
-            from .ali_embeddings import AliTextEmbeddings
-            
-            embedding_model = AliTextEmbeddings()
-            embeddings = []
-            
-            for text in texts:
-                embedding = embedding_model.embed_query(text)
-                embeddings.append(embedding)
-            
-            return embeddings
+            return await embedding_cache.aget_or_compute(self.provider, self.embedding_model, texts, self._arequest_embeddings)
         except Exception as e:
             logger.error(f"使用阿里云获取嵌入向量时出错: {str(e)}")
             raise
     
+    async def _arequest_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """按接口的批量上限分批，在事件循环中并发获取文本嵌入向量"""
+        client = self._async_client()
+        return await aembed_in_batches(
+            self.provider,
+            texts,
+            lambda batch: aembed_batch(client, "阿里云通义千问", self.embedding_model, batch)
+        )
+    
     def is_available(self) -> bool:
         """检查模型是否可用"""
         return self.available
\ No newline at end of file
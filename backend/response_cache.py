@@ -0,0 +1,381 @@
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+import logging
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+from .config import RESPONSE_CACHE_CONFIG, ensure_dir_exists
+from .model_strategies import ModelStrategy
+from .prompt_templates import render_messages
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 模型名称、对话消息和最大输出token数，与 ModelStrategy._answer_request 的返回值一致
+RequestSpec = Tuple[str, List[Dict[str, str]], int]
+
+
+class ResponseCache:
+    """
+    模型回复的精确匹配缓存
+
+    以 (提供商, 模型, 规范化提示词的哈希) 为键。进程内LRU缓存在前，SQLite持久化存储在后，
+    条目超过有效期后失效，超过长度上限的回复不缓存，并分别统计内存命中、磁盘命中和未命中次数。
+    SQLite自带文件锁，多个进程可以共享同一个缓存文件。
+    """
+
+    def __init__(
+        self,
+        db_path: str = RESPONSE_CACHE_CONFIG["path"],
+        ttl: float = RESPONSE_CACHE_CONFIG["ttl"],
+        max_entries: int = RESPONSE_CACHE_CONFIG["max_entries"],
+        memory_entries: int = RESPONSE_CACHE_CONFIG["memory_entries"],
+        max_entry_chars: int = RESPONSE_CACHE_CONFIG["max_entry_chars"]
+    ):
+        """
+        Args:
+            db_path: 缓存数据库文件路径
+            ttl: 缓存的有效期（秒）
+            max_entries: 数据库中最多保存的条目数
+            memory_entries: 进程内LRU缓存的条目数
+            max_entry_chars: 单条回复的长度上限
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.max_entry_chars = max_entry_chars
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._memory_lock = threading.Lock()
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    @staticmethod
+    def make_key(provider: str, model: str, prompt: str) -> str:
+        """
+        根据提供商、模型和提示词生成缓存键
+
+        提示词先做Unicode规范化并去掉每行首尾的空白，只有缩进或换行不同的提示词得到相同的键。
+        """
+        canonical = "\n".join(line.strip() for line in unicodedata.normalize("NFC", prompt).strip().splitlines())
+        digest = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+        return f"{provider}:{model}:{digest}"
+
+    def _connect(self) -> sqlite3.Connection:
+        """获取当前线程的数据库连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            ensure_dir_exists(directory)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+
+        with self._init_lock:
+            if not self._initialized:
+                conn.execute(
+                    """CREATE TABLE IF NOT EXISTS responses (
+                        key TEXT PRIMARY KEY,
+                        response TEXT NOT NULL,
+                        expires_at REAL NOT NULL,
+                        last_access REAL NOT NULL
+                    )"""
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+                conn.commit()
+                self._initialized = True
+
+        self._local.conn = conn
+        return conn
+
+    def _record(self, counter: str):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get_memory(self, key: str) -> Optional[str]:
+        """只查询进程内缓存，命中时计入统计；未命中不计入，由get_disk统计"""
+        now = time.time()
+        with self._memory_lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            response, expires_at = entry
+            if expires_at <= now:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+        self._record("memory_hits")
+        return response
+
+    def get_disk(self, key: str) -> Optional[str]:
+        """查询持久化缓存，命中时放入进程内缓存"""
+        now = time.time()
+        row = None
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT response, expires_at FROM responses WHERE key = ? AND expires_at > ?",
+                (key, now)
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"读取回复缓存时出错: {str(e)}")
+
+        if row is None:
+            self._record("misses")
+            return None
+        self._record("disk_hits")
+        self._remember(key, row[0], row[1])
+        return row[0]
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        查询缓存
+
+        Returns:
+            Optional[str]: 未过期的缓存回复，未命中时为None
+        """
+        response = self.get_memory(key)
+        if response is not None:
+            return response
+        return self.get_disk(key)
+
+    def _remember(self, key: str, response: str, expires_at: float):
+        """放入进程内缓存，超过容量时淘汰最久未使用的条目"""
+        with self._memory_lock:
+            self._memory[key] = (response, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def put(self, key: str, response: str):
+        """写入缓存，空回复和超过长度上限的回复不缓存"""
+        if not response or len(response) > self.max_entry_chars:
+            return
+        now = time.time()
+        expires_at = now + self.ttl
+        self._remember(key, response, expires_at)
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, expires_at, now)
+            )
+            conn.commit()
+            self._evict(conn, now)
+        except sqlite3.Error as e:
+            logger.warning(f"写入回复缓存时出错: {str(e)}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        """删除过期条目，超过容量上限时淘汰最久未访问的条目"""
+        conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        count = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                (overflow,)
+            )
+            logger.info(f"回复缓存超过上限，已淘汰 {overflow} 条最久未使用的回复")
+        conn.commit()
+
+    def hit_rate(self) -> float:
+        """累计命中率（内存和磁盘命中合计）"""
+        with self._stats_lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        """
+        获取缓存统计信息
+
+        Returns:
+            Dict[str, float]: 内存命中、磁盘命中、未命中次数、命中率和当前条目数
+        """
+        try:
+            entries = self._connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        except sqlite3.Error:
+            entries = -1
+        with self._stats_lock:
+            memory_hits, disk_hits, misses = self.memory_hits, self.disk_hits, self.misses
+        total = memory_hits + disk_hits + misses
+        return {
+            "memory_hits": memory_hits,
+            "disk_hits": disk_hits,
+            "misses": misses,
+            "hit_rate": (memory_hits + disk_hits) / total if total else 0.0,
+            "entries": entries
+        }
+
+    def clear(self):
+        """清空缓存和统计信息"""
+        with self._memory_lock:
+            self._memory.clear()
+        conn = self._connect()
+        conn.execute("DELETE FROM responses")
+        conn.commit()
+        with self._stats_lock:
+            self.memory_hits = 0
+            self.disk_hits = 0
+            self.misses = 0
+
+
+# 创建全局回复缓存实例
+response_cache = ResponseCache()
+
+
+class CachedStrategy(ModelStrategy):
+    """
+    为任意模型策略加上回复缓存：问题分析和回答生成先查询缓存，未命中时才请求模型
+
+    嵌入向量由嵌入缓存负责，直接交给被包装的策略。
+    """
+
+    def __init__(self, strategy: ModelStrategy, cache: Optional[ResponseCache] = None):
+        """
+        Args:
+            strategy: 被包装的策略
+            cache: 回复缓存，默认为全局实例
+        """
+        self.strategy = strategy
+        self.cache = cache or response_cache
+        self.provider = strategy.provider
+        self.embedding_model = strategy.embedding_model
+        self.chat_model = strategy.chat_model
+        self.analysis_model = strategy.analysis_model
+        self.base_url = strategy.base_url
+        self.api_key = strategy.api_key
+        self._served: Optional[ModelStrategy] = None
+
+    def served_by(self) -> ModelStrategy:
+        """最近一次给出结果的策略；命中缓存时为本策略，缓存中只保存主提供商自己生成的回复"""
+        return self._served or self.strategy.served_by()
+
+    def is_available(self) -> bool:
+        """检查模型是否可用"""
+        return self.strategy.is_available()
+
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """获取文本嵌入向量"""
+        return self.strategy.get_embeddings(texts)
+
+    async def aget_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """异步获取文本嵌入向量"""
+        return await self.strategy.aget_embeddings(texts)
+
+    def _analysis_key(self, question: str, tone: str, length: str) -> str:
+        model, messages, _ = self._analysis_request(question, tone, length)
+        return self.cache.make_key(self.provider, model, render_messages(messages))
+
+    def _answer_key(self, question: str, context: List[str], tone: str, word_count: str) -> str:
+        # 与被包装的策略一样压缩参考知识并选择模型档位，相同的提示词才会命中
+        model, messages, _ = self._answer_request(question, context, tone, word_count)
+        return self.cache.make_key(self.provider, model, render_messages(messages))
+
+    def _served_key(self, key: str, request: Callable[[ModelStrategy], RequestSpec]) -> str:
+        """
+        新回复的缓存键：熔断切换或对冲胜出时回复来自备用提供商，按其提供商、模型和提示词重新生成，
+        避免备用提供商的回复保存在主提供商的键下
+
+        Args:
+            key: 按主提供商生成的缓存键
+            request: 用给定策略生成请求的模型、对话消息和最大输出token数的函数
+        """
+        served = self.strategy.served_by()
+        self._served = served
+        if served.provider == self.provider:
+            return key
+        model, messages, _ = request(served)
+        return self.cache.make_key(served.provider, model, render_messages(messages))
+
+    def _on_hit(self, operation: str):
+        self._served = self
+        logger.info(f"{operation} 命中回复缓存（累计命中率 {self.cache.hit_rate():.1%}）")
+
+    def _cached(self, key: str, operation: str, request: Callable[[ModelStrategy], RequestSpec], call: Callable[[], str]) -> str:
+        response = self.cache.get(key)
+        if response is not None:
+            self._on_hit(operation)
+            return response
+        response = call()
+        self.cache.put(self._served_key(key, request), response)
+        return response
+
+    async def _aget(self, key: str) -> Optional[str]:
+        """先查进程内缓存，未命中时在线程池中查询数据库，不阻塞事件循环"""
+        response = self.cache.get_memory(key)
+        if response is None:
+            response = await asyncio.to_thread(self.cache.get_disk, key)
+        return response
+
+    def analyze_question(self, question: str, tone: str, length: str) -> str:
+        """分析问题"""
+        return self._cached(
+            self._analysis_key(question, tone, length),
+            "问题分析",
+            lambda strategy: strategy._analysis_request(question, tone, length),
+            lambda: self.strategy.analyze_question(question, tone, length)
+        )
+
+    def generate_answer(self, question: str, context: List[str], tone: str, word_count: str) -> str:
+        """生成回答"""
+        return self._cached(
+            self._answer_key(question, context, tone, word_count),
+            "回答生成",
+            lambda strategy: strategy._answer_request(question, context, tone, word_count),
+            lambda: self.strategy.generate_answer(question, context, tone, word_count)
+        )
+
+    async def aanalyze_question(self, question: str, tone: str, length: str) -> str:
+        """异步分析问题"""
+        key = self._analysis_key(question, tone, length)
+        response = await self._aget(key)
+        if response is not None:
+            self._on_hit("问题分析")
+            return response
+        response = await self.strategy.aanalyze_question(question, tone, length)
+        key = self._served_key(key, lambda strategy: strategy._analysis_request(question, tone, length))
+        await asyncio.to_thread(self.cache.put, key, response)
+        return response
+
+    async def agenerate_answer(self, question: str, context: List[str], tone: str, word_count: str) -> str:
+        """异步生成回答"""
+        key = self._answer_key(question, context, tone, word_count)
+        response = await self._aget(key)
+        if response is not None:
+            self._on_hit("回答生成")
+            return response
+        response = await self.strategy.agenerate_answer(question, context, tone, word_count)
+        key = self._served_key(key, lambda strategy: strategy._answer_request(question, context, tone, word_count))
+        await asyncio.to_thread(self.cache.put, key, response)
+        return response
+
+    async def astream_answer(self, question: str, context: List[str], tone: str, word_count: str) -> AsyncIterator[str]:
+        """流式生成回答：命中时一次产出缓存的回答，未命中时边产出边收集，完整结束后写入缓存"""
+        key = self._answer_key(question, context, tone, word_count)
+        response = await self._aget(key)
+        if response is not None:
+            self._on_hit("回答生成")
+            yield response
+            return
+        chunks = []
+        async for chunk in self.strategy.astream_answer(question, context, tone, word_count):
+            chunks.append(chunk)
+            yield chunk
+        key = self._served_key(key, lambda strategy: strategy._answer_request(question, context, tone, word_count))
+        await asyncio.to_thread(self.cache.put, key, "".join(chunks))
@@ -0,0 +1,271 @@
+import time
+import asyncio
+import weakref
+import threading
+import logging
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from .config import RETRIEVAL_CONFIG
+from .circuit_breaker import circuit_breakers
+from .provider_stats import provider_performance
+from .lexical_index import BM25Index, reciprocal_rank_fusion
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 每个已加载的向量存储对应一份片段ID到索引位置的反向映射
+_positions_cache: "weakref.WeakKeyDictionary[FAISS, Dict[str, int]]" = weakref.WeakKeyDictionary()
+_positions_lock = threading.Lock()
+
+
+class RetrievalResult(NamedTuple):
+    """一次检索的结果"""
+    documents: List[Document]
+    """按相关度排列的片段"""
+    mode: str
+    """实际使用的检索方式：hybrid、vector、lexical 或 none"""
+    latency: float
+    """检索耗时（秒）"""
+    rerank_latency: float
+    """MMR重排序耗时（秒）"""
+
+
+def vector_search(vectorstore: FAISS, query_embedding: List[float], k: int) -> List[str]:
+    """
+    直接在FAISS索引上检索，返回片段ID
+
+    Returns:
+        List[str]: 按距离从近到远排列的片段ID
+    """
+    query = np.asarray([query_embedding], dtype=np.float32)
+    _, positions = vectorstore.index.search(query, k)
+    return [
+        vectorstore.index_to_docstore_id[position]
+        for position in positions[0]
+        if position != -1
+    ]
+
+
+def _docstore_positions(vectorstore: FAISS) -> Dict[str, int]:
+    """获取片段ID到索引位置的反向映射，每个向量存储实例只构建一次"""
+    with _positions_lock:
+        positions = _positions_cache.get(vectorstore)
+        if positions is None:
+            positions = {doc_id: position for position, doc_id in vectorstore.index_to_docstore_id.items()}
+            _positions_cache[vectorstore] = positions
+        return positions
+
+
+def mmr_select(relevance: np.ndarray, vectors: np.ndarray, k: int, lambda_mult: float) -> List[int]:
+    """
+    最大边际相关（MMR）选择
+
+    每一步选出 lambda*相关度 - (1-lambda)*与已选片段的最大相似度 最高的候选。
+    候选之间的余弦相似度一次矩阵乘法算完，之后每一步只需更新一个向量。
+
+    Args:
+        relevance: 每个候选的相关度，形状为 (n,)
+        vectors: 每个候选的向量，形状为 (n, d)
+        k: 选出的片段数
+        lambda_mult: 相关度的权重
+
+    Returns:
+        List[int]: 按选择顺序排列的候选下标
+    """
+    count = len(relevance)
+    if count == 0:
+        return []
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = vectors / np.where(norms == 0, 1.0, norms)
+    similarity = unit @ unit.T
+
+    selected = [int(np.argmax(relevance))]
+    max_similarity = similarity[selected[0]].copy()
+    chosen = np.zeros(count, dtype=bool)
+    chosen[selected[0]] = True
+    while len(selected) < min(k, count):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[chosen] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        chosen[best] = True
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return selected
+
+
+def mmr_rerank(
+    vectorstore: FAISS,
+    ranked: Sequence[Tuple[str, float]],
+    query_embedding: Optional[List[float]],
+    k: int,
+    lambda_mult: float
+) -> List[str]:
+    """
+    用候选片段在索引中保存的向量做MMR重排序，去掉相互重叠的片段
+
+    有查询向量时以余弦相似度作为相关度；只有关键词检索结果时以融合得分（归一化到0-1）作为相关度。
+
+    Args:
+        vectorstore: 向量存储
+        ranked: 按相关度排列的 (片段ID, 融合得分)
+        query_embedding: 查询向量，没有时为None
+        k: 选出的片段数
+        lambda_mult: 相关度的权重
+
+    Returns:
+        List[str]: 重排序后的片段ID
+    """
+    positions_by_id = _docstore_positions(vectorstore)
+    candidates = [(doc_id, score) for doc_id, score in ranked if doc_id in positions_by_id]
+    if len(candidates) <= 1:
+        return [doc_id for doc_id, _ in candidates]
+
+    positions = np.asarray([positions_by_id[doc_id] for doc_id, _ in candidates], dtype=np.int64)
+    vectors = vectorstore.index.reconstruct_batch(positions)
+
+    if query_embedding is not None:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1) * max(float(np.linalg.norm(query)), 1e-12)
+        relevance = (vectors @ query) / np.where(norms == 0, 1.0, norms)
+    else:
+        scores = np.asarray([score for _, score in candidates], dtype=np.float32)
+        relevance = scores / max(float(scores.max()), 1e-12)
+
+    order = mmr_select(relevance, vectors, k, lambda_mult)
+    return [candidates[i][0] for i in order]
+
+
+def _check_embedding(embedding: List[float], dim: int) -> Optional[List[float]]:
+    """维度与索引不符时丢弃查询向量"""
+    if len(embedding) != dim:
+        logger.error(f"查询向量维度 {len(embedding)} 与索引维度 {dim} 不一致，跳过向量检索")
+        return None
+    return embedding
+
+
+def _record_embedding(provider: str, start_time: float, success: bool):
+    """把查询嵌入的结果记录到熔断器和提供商性能统计"""
+    breaker = circuit_breakers.get(provider, "embedding")
+    if success:
+        breaker.record_success()
+    else:
+        breaker.record_failure()
+    provider_performance.record(provider, "embed", time.perf_counter() - start_time, success)
+
+
+async def _await_embedding(provider: str, task: "asyncio.Task", timeout: float, dim: int, start_time: float) -> Optional[List[float]]:
+    """
+    在超时时间内取回查询向量，失败、超时或维度不符时返回None，结果记录到嵌入熔断器和性能统计
+
+    超时后不再等待，请求仍在事件循环中完成。
+    """
+    try:
+        embedding = await asyncio.wait_for(asyncio.shield(task), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"{provider} 查询嵌入超时，本次只使用关键词检索")
+        _record_embedding(provider, start_time, False)
+        # 取回后台完成的结果或异常，避免"异常未被获取"的警告
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return None
+    except Exception as e:
+        logger.warning(f"{provider} 查询嵌入失败: {str(e)}，本次只使用关键词检索")
+        _record_embedding(provider, start_time, False)
+        return None
+    _record_embedding(provider, start_time, True)
+    return _check_embedding(embedding, dim)
+
+
+def _fuse_and_rerank(
+    vectorstore: FAISS,
+    vector_ids: List[str],
+    lexical_ids: List[str],
+    embedding: Optional[List[float]],
+    config: Dict,
+    start_time: float
+) -> RetrievalResult:
+    """融合两路候选、MMR重排序并取回片段"""
+    k = config["k"]
+    if vector_ids and lexical_ids:
+        mode = "hybrid"
+        ranked = reciprocal_rank_fusion([vector_ids, lexical_ids], config["rrf_k"])
+    elif vector_ids or lexical_ids:
+        mode = "vector" if vector_ids else "lexical"
+        ranked = reciprocal_rank_fusion([vector_ids or lexical_ids], config["rrf_k"])
+    else:
+        mode, ranked = "none", []
+
+    # 多取一些候选，用MMR去掉相互重叠的片段（分割时有重叠，相邻片段经常同时命中）
+    rerank_start = time.perf_counter()
+    candidates = ranked[:config["mmr_candidates"]]
+    try:
+        ranked_ids = mmr_rerank(vectorstore, candidates, embedding, k, config["mmr_lambda"])
+    except Exception as e:
+        logger.warning(f"MMR重排序失败: {str(e)}，使用融合排序")
+        ranked_ids = [doc_id for doc_id, _ in candidates]
+    rerank_latency = time.perf_counter() - rerank_start
+
+    documents = []
+    for doc_id in ranked_ids:
+        doc = vectorstore.docstore.search(doc_id)
+        # 关键词索引与向量存储在重新加载的瞬间可能不一致，跳过找不到的片段
+        if isinstance(doc, Document):
+            documents.append(doc)
+        if len(documents) >= k:
+            break
+
+    latency = time.perf_counter() - start_time
+    logger.info(
+        f"检索完成：方式 {mode}，向量候选 {len(vector_ids)} 个，关键词候选 {len(lexical_ids)} 个，"
+        f"返回 {len(documents)} 个，耗时 {latency * 1000:.2f}ms（其中MMR重排序 {rerank_latency * 1000:.2f}ms）"
+    )
+    return RetrievalResult(documents, mode, latency, rerank_latency)
+
+
+async def ahybrid_search(
+    vectorstore: FAISS,
+    lexical_index: Optional[BM25Index],
+    question: str,
+    provider: str,
+    aembed_query: Callable[[str], Awaitable[List[float]]],
+    dim: int,
+    config: Dict = RETRIEVAL_CONFIG
+) -> RetrievalResult:
+    """
+    混合检索：向量检索和BM25关键词检索的结果用倒数排名融合合并，再用MMR重排序
+
+    查询嵌入作为事件循环中的任务发出，等待期间完成关键词检索；嵌入失败、超时或处于熔断状态时
+    只返回关键词检索的结果，不再需要远程调用。
+
+    Args:
+        vectorstore: 向量存储
+        lexical_index: 同一批片段的关键词索引，为None时只做向量检索
+        question: 问题
+        provider: 索引的嵌入提供商
+        aembed_query: 获取查询向量的协程函数，必须与构建索引的嵌入模型一致
+        dim: 索引的向量维度
+        config: 检索配置
+
+    Returns:
+        RetrievalResult: 检索结果
+    """
+    start_time = time.perf_counter()
+    fetch_k = config["fetch_k"]
+
+    embedding_task = None
+    if not circuit_breakers.get(provider, "embedding").allow_request():
+        logger.debug(f"{provider} 查询嵌入处于熔断状态，跳过向量检索")
+    else:
+        # 先发出嵌入请求，等待期间完成关键词检索（本地计算，耗时在毫秒以内）
+        embedding_task = asyncio.ensure_future(aembed_query(question))
+
+    lexical_ids = [doc_id for doc_id, _ in lexical_index.search(question, fetch_k)] if lexical_index else []
+
+    embedding = None
+    if embedding_task is not None:
+        remaining = max(0.0, config["embedding_timeout"] - (time.perf_counter() - start_time))
+        embedding = await _await_embedding(provider, embedding_task, remaining, dim, start_time)
+    vector_ids = vector_search(vectorstore, embedding, fetch_k) if embedding is not None else []
+
+    return _fuse_and_rerank(vectorstore, vector_ids, lexical_ids, embedding, config, start_time)
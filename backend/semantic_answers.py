@@ -0,0 +1,253 @@
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+import logging
+from array import array
+from collections import Counter
+from typing import Awaitable, Callable, List, NamedTuple, Optional, Sequence
+import numpy as np
+from .config import SEMANTIC_REUSE_CONFIG, ensure_dir_exists
+from .lexical_index import tokenize
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+_SIMHASH_BITS = 64
+
+
+def simhash(text: str) -> int:
+    """
+    计算文本的64位SimHash签名
+
+    特征与关键词检索的分词一致（汉字二元组和小写单词），按出现次数加权；
+    措辞相近的问题签名之间的汉明距离较小。
+    """
+    weights = [0] * _SIMHASH_BITS
+    for feature, count in Counter(tokenize(text)).items():
+        value = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(_SIMHASH_BITS):
+            weights[bit] += count if value >> bit & 1 else -count
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """两个签名之间不同的位数"""
+    return bin(a ^ b).count("1")
+
+
+def _to_signed(value: int) -> int:
+    """SQLite的INTEGER是有符号64位整数"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+class AnswerMatch(NamedTuple):
+    """与新问题最相近的已回答问题"""
+    question: str
+    answer: str
+    provider: str
+    similarity: float
+
+
+class SemanticAnswerIndex:
+    """
+    已生成回答的语义索引
+
+    每条回答与问题的嵌入向量和SimHash签名一起存入SQLite。查找时先按回答风格、长度、嵌入模型、
+    有效期和签名的汉明距离筛选候选，只有存在候选时才需要问题的嵌入向量，再按余弦相似度取最接近的一条。
+    SQLite自带文件锁，多个进程可以共享同一个索引文件。
+    """
+
+    def __init__(
+        self,
+        db_path: str = SEMANTIC_REUSE_CONFIG["path"],
+        threshold: float = SEMANTIC_REUSE_CONFIG["threshold"],
+        max_distance: int = SEMANTIC_REUSE_CONFIG["simhash_max_distance"],
+        ttl: float = SEMANTIC_REUSE_CONFIG["ttl"],
+        max_entries: int = SEMANTIC_REUSE_CONFIG["max_entries"]
+    ):
+        """
+        Args:
+            db_path: 索引数据库文件路径
+            threshold: 复用回答所需的最低余弦相似度
+            max_distance: SimHash预筛选允许的最大汉明距离
+            ttl: 回答的有效期（秒）
+            max_entries: 最多保存的回答数，超过后删除最早的回答
+        """
+        self.db_path = db_path
+        self.threshold = threshold
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """获取当前线程的数据库连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            ensure_dir_exists(directory)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+
+        with self._init_lock:
+            if not self._initialized:
+                conn.execute(
+                    """CREATE TABLE IF NOT EXISTS answers (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        question TEXT NOT NULL,
+                        tone TEXT NOT NULL,
+                        length TEXT NOT NULL,
+                        model TEXT NOT NULL,
+                        simhash INTEGER NOT NULL,
+                        embedding BLOB NOT NULL,
+                        answer TEXT NOT NULL,
+                        provider TEXT,
+                        created_at REAL NOT NULL
+                    )"""
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_lookup ON answers(tone, length, model, created_at)")
+                conn.commit()
+                self._initialized = True
+
+        self._local.conn = conn
+        return conn
+
+    def add(
+        self,
+        question: str,
+        tone: str,
+        length: str,
+        model: str,
+        embedding: Sequence[float],
+        answer: str,
+        provider: Optional[str] = None
+    ):
+        """
+        保存一条生成的回答
+
+        Args:
+            question: 问题
+            tone: 回答风格
+            length: 回答长度
+            model: 计算嵌入向量的模型，只与同一模型的向量比较
+            embedding: 问题的嵌入向量，全零向量（嵌入不可用时的后备结果）不保存
+            answer: 回答
+            provider: 生成回答的模型提供商
+        """
+        if not answer or not any(embedding):
+            return
+        now = time.time()
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT INTO answers (question, tone, length, model, simhash, embedding, answer, provider, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (question, tone, length, model, _to_signed(simhash(question)),
+                 array("f", embedding).tobytes(), answer, provider, now)
+            )
+            conn.execute("DELETE FROM answers WHERE created_at <= ?", (now - self.ttl,))
+            conn.execute(
+                "DELETE FROM answers WHERE id NOT IN (SELECT id FROM answers ORDER BY created_at DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"保存回答到语义索引时出错: {str(e)}")
+
+    def candidates(self, question: str, tone: str, length: str, model: str) -> List[tuple]:
+        """
+        用SimHash预筛选候选回答
+
+        Returns:
+            List[tuple]: (问题, 嵌入向量, 回答, 提供商) 列表
+        """
+        signature = simhash(question)
+        try:
+            rows = self._connect().execute(
+                "SELECT question, simhash, embedding, answer, provider FROM answers "
+                "WHERE tone = ? AND length = ? AND model = ? AND created_at > ?",
+                (tone, length, model, time.time() - self.ttl)
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"读取语义索引时出错: {str(e)}")
+            return []
+        return [
+            (row_question, embedding, answer, provider)
+            for row_question, row_simhash, embedding, answer, provider in rows
+            if hamming_distance(signature, _to_unsigned(row_simhash)) <= self.max_distance
+        ]
+
+    def best_match(self, candidates: List[tuple], embedding: Sequence[float]) -> Optional[AnswerMatch]:
+        """在候选中按余弦相似度找出最接近的回答，低于阈值时返回None"""
+        query = np.asarray(embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        if not candidates or query_norm == 0:
+            return None
+        vectors = np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob, _, _ in candidates])
+        if vectors.shape[1] != query.shape[0]:
+            return None
+        norms = np.linalg.norm(vectors, axis=1) * query_norm
+        similarities = vectors @ query / np.where(norms == 0, 1, norms)
+        best = int(np.argmax(similarities))
+        similarity = float(similarities[best])
+        if similarity < self.threshold:
+            logger.debug(f"最相近的已回答问题相似度 {similarity:.3f}，低于阈值 {self.threshold}")
+            return None
+        question, _, answer, provider = candidates[best]
+        return AnswerMatch(question, answer, provider, similarity)
+
+    async def afind(
+        self,
+        question: str,
+        tone: str,
+        length: str,
+        model: str,
+        aembed_query: Callable[[str], Awaitable[List[float]]]
+    ) -> Optional[AnswerMatch]:
+        """
+        查找可以复用的回答
+
+        Args:
+            question: 新问题
+            tone: 回答风格
+            length: 回答长度
+            model: 嵌入模型名称
+            aembed_query: 获取问题嵌入向量的协程函数，只在SimHash预筛选有候选时调用
+
+        Returns:
+            Optional[AnswerMatch]: 相似度达到阈值的回答，没有时为None
+        """
+        candidates = await asyncio.to_thread(self.candidates, question, tone, length, model)
+        if not candidates:
+            return None
+        embedding = await aembed_query(question)
+        return self.best_match(candidates, embedding)
+
+    def clear(self):
+        """清空索引（知识库变化后调用，索引文件还不存在时不创建）"""
+        if not os.path.exists(self.db_path):
+            return
+        try:
+            conn = self._connect()
+            conn.execute("DELETE FROM answers")
+            conn.commit()
+            logger.info("已清空语义回答索引")
+        except sqlite3.Error as e:
+            logger.warning(f"清空语义索引时出错: {str(e)}")
+
+
+# 创建全局语义回答索引
+semantic_answers = SemanticAnswerIndex()
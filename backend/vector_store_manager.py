@@ -0,0 +1,300 @@
+import os
+import time
+import shutil
+import threading
+import logging
+from typing import Any, Dict, Optional, Tuple
+from langchain_community.vectorstores import FAISS
+from langchain_community.embeddings import FakeEmbeddings
+from .config import VECTOR_STORE_PATH, ensure_dir_exists
+from .circuit_breaker import circuit_breakers
+from .index_factory import (
+    INDEX_CONFIG_FILE_NAME, apply_search_params, enable_reconstruct, load_index_config, write_index_config
+)
+from .index_registry import MANIFEST_FILE_NAME, get_index_path, load_manifest, select_index, write_manifest
+from .lexical_index import (
+    LEXICAL_INDEX_FILE_NAME, BM25Index, build_lexical_index, load_lexical_index, write_lexical_index
+)
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 版本戳文件名，每次保存新索引后写入
+VERSION_FILE_NAME = "VERSION"
+INDEX_FILE_NAMES = ("index.faiss", "index.pkl")
+
+
+def _index_version(store_path: str) -> Optional[str]:
+    """读取索引的版本戳，没有版本戳文件时退回到索引文件的修改时间"""
+    version_path = os.path.join(store_path, VERSION_FILE_NAME)
+    try:
+        with open(version_path, "r", encoding="utf-8") as f:
+            version = f.read().strip()
+            if version:
+                return version
+    except FileNotFoundError:
+        pass
+
+    try:
+        mtimes = [str(os.stat(os.path.join(store_path, name)).st_mtime_ns) for name in INDEX_FILE_NAMES]
+    except FileNotFoundError:
+        return None
+    return "mtime-" + "-".join(mtimes)
+
+
+def save_vectorstore(
+    vectorstore: FAISS,
+    store_path: str,
+    index_config: Optional[Dict[str, Any]] = None,
+    manifest: Optional[Dict[str, Any]] = None,
+    lexical_index: Optional[BM25Index] = None
+) -> str:
+    """
+    保存向量存储并写入新的版本戳
+
+    先写入临时目录再逐个替换正式文件，最后写版本戳，
+    这样其他进程只会在索引文件全部就位后才看到新版本。
+
+    Args:
+        vectorstore: 要保存的向量存储
+        store_path: 保存路径
+        index_config: 索引构建配置（索引类型、构建参数和检索参数），与索引一起保存
+        manifest: 索引清单（嵌入提供商、模型、维度、度量和构建时间），与索引一起保存
+        lexical_index: 同一批片段的BM25关键词索引，与索引一起保存
+
+    Returns:
+        str: 新的版本戳
+    """
+    ensure_dir_exists(store_path)
+    staging_path = os.path.join(store_path, ".staging")
+    if os.path.exists(staging_path):
+        shutil.rmtree(staging_path)
+
+    vectorstore.save_local(staging_path)
+    file_names = INDEX_FILE_NAMES
+    if index_config is not None:
+        write_index_config(index_config, staging_path)
+        file_names += (INDEX_CONFIG_FILE_NAME,)
+    if manifest is not None:
+        write_manifest(manifest, staging_path)
+        file_names += (MANIFEST_FILE_NAME,)
+    if lexical_index is not None:
+        write_lexical_index(lexical_index, staging_path)
+        file_names += (LEXICAL_INDEX_FILE_NAME,)
+    for name in file_names:
+        os.replace(os.path.join(staging_path, name), os.path.join(store_path, name))
+    shutil.rmtree(staging_path, ignore_errors=True)
+
+    version = str(time.time_ns())
+    version_tmp = os.path.join(store_path, VERSION_FILE_NAME + ".tmp")
+    with open(version_tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(version_tmp, os.path.join(store_path, VERSION_FILE_NAME))
+
+    logger.info(f"向量库已保存到 {store_path}，版本: {version}")
+    return version
+
+
+class VectorStoreManager:
+    """
+    向量存储管理器
+
+    在进程生命周期内常驻加载FAISS知识库，所有检索调用共享同一个实例。
+    通过版本戳（或索引文件修改时间）发现新保存的索引，并在后台加载后原子替换，
+    正在使用旧实例的检索请求不会被阻塞。
+    """
+
+    def __init__(self, store_path: str, check_interval: float = 1.0):
+        """
+        Args:
+            store_path: 向量存储路径
+            check_interval: 两次检查版本戳之间的最小间隔（秒）
+        """
+        self.store_path = store_path
+        self.check_interval = check_interval
+        self._vectorstore: Optional[FAISS] = None
+        self._lexical_index: Optional[BM25Index] = None
+        self._version: Optional[str] = None
+        self._last_check = 0.0
+        self._reload_lock = threading.Lock()
+
+    def _load(self) -> Optional[FAISS]:
+        """从磁盘加载索引并替换当前实例（调用方需持有重载锁）"""
+        for _ in range(3):
+            version = _index_version(self.store_path)
+            if version is None:
+                logger.warning(f"未找到向量存储: {self.store_path}")
+                return self._vectorstore
+            if version == self._version and self._vectorstore is not None:
+                return self._vectorstore
+
+            logger.debug(f"开始加载向量存储，路径: {self.store_path}，版本: {version}")
+            start_time = time.perf_counter()
+            # FAISS.load_local需要一个嵌入模型，检索时我们直接传入自己生成的查询向量
+            manifest = load_manifest(self.store_path) or {}
+            vectorstore = FAISS.load_local(
+                self.store_path,
+                FakeEmbeddings(size=manifest.get("dim", 1536)),
+                allow_dangerous_deserialization=True
+            )
+            # 按保存的配置设置nprobe、efSearch等检索参数
+            apply_search_params(vectorstore.index, load_index_config(self.store_path))
+            # 重排序阶段需要按位置取回候选片段的向量
+            enable_reconstruct(vectorstore.index)
+            # 旧版本的索引没有关键词索引，按文档库现场构建
+            lexical_index = load_lexical_index(self.store_path) or build_lexical_index(vectorstore)
+
+            # 加载期间索引又被更新，重新加载以免拿到新旧混合的文件
+            if _index_version(self.store_path) != version:
+                logger.debug("加载期间向量存储发生变化，重新加载")
+                continue
+
+            self._lexical_index = lexical_index
+            self._vectorstore = vectorstore
+            self._version = version
+            logger.info(f"向量存储加载成功，版本: {version}，耗时 {time.perf_counter() - start_time:.3f}s")
+            return vectorstore
+
+        logger.warning("向量存储持续变化，暂时保留当前已加载的版本")
+        return self._vectorstore
+
+    def _reload_in_background(self):
+        """在后台线程中加载新版本，加载完成前读者继续使用旧实例"""
+        if not self._reload_lock.acquire(blocking=False):
+            return  # 已有线程在加载
+
+        def worker():
+            try:
+                self._load()
+            except Exception as e:
+                logger.error(f"后台加载向量存储时出错: {str(e)}")
+            finally:
+                self._reload_lock.release()
+
+        threading.Thread(target=worker, name="vector-store-reload", daemon=True).start()
+
+    def get_vectorstore(self) -> FAISS:
+        """
+        获取当前的向量存储实例
+
+        Returns:
+            FAISS: 向量存储实例
+
+        Raises:
+            FileNotFoundError: 如果向量存储不存在
+        """
+        vectorstore = self._vectorstore
+        now = time.monotonic()
+        if vectorstore is not None and now - self._last_check < self.check_interval:
+            return vectorstore
+        self._last_check = now
+
+        if vectorstore is not None:
+            if _index_version(self.store_path) != self._version:
+                logger.info("检测到向量存储已更新，在后台重新加载")
+                self._reload_in_background()
+            return vectorstore
+
+        # 首次加载，只能等待加载完成
+        with self._reload_lock:
+            vectorstore = self._load()
+        if vectorstore is None:
+            raise FileNotFoundError(f"向量存储不存在: {self.store_path}")
+        return vectorstore
+
+    def reload(self) -> Optional[FAISS]:
+        """立即加载磁盘上的最新版本（用于本进程刚保存完新索引时）"""
+        with self._reload_lock:
+            return self._load()
+
+    @property
+    def lexical_index(self) -> Optional[BM25Index]:
+        """与当前向量存储一起加载的关键词索引"""
+        return self._lexical_index
+
+    @property
+    def version(self) -> Optional[str]:
+        """当前已加载索引的版本戳"""
+        return self._version
+
+
+# 每个嵌入提供商的索引各有一个管理器
+_managers: Dict[str, VectorStoreManager] = {}
+_managers_lock = threading.Lock()
+
+def get_vector_store_manager(provider: str) -> VectorStoreManager:
+    """
+    获取某个嵌入提供商的索引管理器，首次使用时创建
+
+    Args:
+        provider: 嵌入提供商名称
+
+    Returns:
+        VectorStoreManager: 向量存储管理器
+    """
+    with _managers_lock:
+        if provider not in _managers:
+            _managers[provider] = VectorStoreManager(get_index_path(provider))
+        return _managers[provider]
+
+def get_vectorstore(provider: str) -> FAISS:
+    """
+    获取某个嵌入提供商的共享向量存储的便捷函数
+
+    Args:
+        provider: 嵌入提供商名称
+
+    Returns:
+        FAISS: 向量存储实例
+    """
+    return get_vector_store_manager(provider).get_vectorstore()
+
+
+# 索引选择结果按首选提供商缓存，与向量存储使用同样的版本戳判断是否需要重新选择
+_selections: Dict[Optional[str], Tuple[float, Tuple, Tuple[str, Dict[str, Any]]]] = {}
+_selections_lock = threading.Lock()
+
+def _selection_stamp() -> Tuple:
+    """所有索引的版本戳和查询嵌入处于熔断状态的提供商，任何一项变化都可能改变选择结果"""
+    if not os.path.isdir(VECTOR_STORE_PATH):
+        return ()
+    versions = tuple(
+        (name, _index_version(os.path.join(VECTOR_STORE_PATH, name)))
+        for name in sorted(os.listdir(VECTOR_STORE_PATH))
+        if os.path.isdir(os.path.join(VECTOR_STORE_PATH, name))
+    )
+    open_circuits = tuple(name for name, _ in versions if circuit_breakers.is_open(name, "embedding"))
+    return versions, open_circuits
+
+def get_index_selection(preferred: Optional[str] = None, check_interval: float = 1.0) -> Tuple[str, Dict[str, Any]]:
+    """
+    为检索选择索引（见select_index），并缓存选择结果
+
+    同一个问题的相似问题查找、检索和批量准备都要选择索引，每次选择都会读取所有索引的清单。
+    缓存的结果在check_interval秒内直接使用，之后只在索引的版本戳或熔断状态变化时重新选择。
+
+    Args:
+        preferred: 首选提供商，通常是当前模型策略的提供商
+        check_interval: 两次检查版本戳之间的最小间隔（秒）
+
+    Returns:
+        Tuple[str, Dict[str, Any]]: 提供商名称和索引清单
+
+    Raises:
+        FileNotFoundError: 没有可以用当前可用提供商查询的索引
+    """
+    cached = _selections.get(preferred)
+    now = time.monotonic()
+    if cached is not None and now - cached[0] < check_interval:
+        return cached[2]
+
+    stamp = _selection_stamp()
+    if cached is not None and cached[1] == stamp:
+        with _selections_lock:
+            _selections[preferred] = (now, stamp, cached[2])
+        return cached[2]
+
+    selection = select_index(preferred)
+    with _selections_lock:
+        _selections[preferred] = (now, stamp, selection)
+    return selection
@@ -3,6 +3,8 @@ import logging
 import os
 from langchain_core.embeddings import Embeddings
 from pydantic import BaseModel, model_validator
+from .embedding_cache import embedding_cache
+from .embedding_batching import embed_in_batches
 
 # 尝试导入zhipuai
 try:
@@ -26,6 +28,9 @@ class ZhipuEmbeddings(BaseModel, Embeddings):
     model: str = "embedding-2"
     """使用的嵌入模型名称，默认为embedding-2"""
     
+    client: Any = None
+    """复用的ZhipuAI客户端，为None时每次嵌入新建一个"""
+    
     @model_validator(mode='before')
     @classmethod
     def validate_environment(cls, data: Dict) -> Dict:
@@ -45,7 +50,7 @@ class ZhipuEmbeddings(BaseModel, Embeddings):
         return data
     
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """生成多个文本的嵌入向量。
+        """生成多个文本的嵌入向量，已嵌入过的文本直接从缓存读取。
         
         Args:
             texts: 要嵌入的文本列表
@@ -53,46 +58,35 @@ class ZhipuEmbeddings(BaseModel, Embeddings):
         Returns:
             嵌入向量列表
         """
+        return embedding_cache.get_or_compute("zhipu", self.model, texts, self._embed_documents_uncached)
+    
+    def _embed_documents_uncached(self, texts: List[str]) -> List[List[float]]:
+        """调用智谱AI嵌入API生成多个文本的嵌入向量。
+        
+        失败时直接抛出异常，不用零向量代替：导入时文档不会被登记为已导入，下次重新嵌入；
+        查询时由检索改用关键词检索。
+        """
+        # 初始化智谱AI客户端，所有批次共用
+        client = self.client or zhipuai.ZhipuAI(api_key=self.api_key)
+        
+        # 按智谱AI接口的条数和token上限分批，每批一次请求
+        return embed_in_batches("zhipu", texts, lambda batch_texts: self._embed_batch(client, batch_texts))
+    
+    def _embed_batch(self, client: Any, batch_texts: List[str]) -> List[List[float]]:
+        """一次请求嵌入一个批次的文本。"""
         try:
-            # 初始化智谱AI客户端
-            zhipuai.api_key = self.api_key
-            
-            # 批量处理文本，避免超出API限制
-            embeddings = []
-            batch_size = 16  # 每批处理的文本数量
-            
-            for i in range(0, len(texts), batch_size):
-                batch_texts = texts[i:i+batch_size]
-                
-                try:
-                    # 调用智谱AI嵌入API
-                    response = zhipuai.model_api.invoke(
-                        model=self.model,
-                        prompt=batch_texts,
-                        task_type="embeddings"
-                    )
-                    
-                    if response.get("code") == 200:
-                        # 提取嵌入向量
-                        batch_embeddings = [item["embedding"] for item in response["data"]]
-                        embeddings.extend(batch_embeddings)
-                    else:
-                        logger.error(f"嵌入API调用失败: {response.get('code')}, {response.get('msg')}")
-                        # 返回零向量作为后备
-                        for _ in batch_texts:
-                            embeddings.append([0.0] * 1536)  # 假设向量维度为1536
-                except Exception as e:
-                    logger.error(f"处理批次 {i} 时出错: {str(e)}")
-                    # 返回零向量作为后备
-                    for _ in batch_texts:
-                        embeddings.append([0.0] * 1536)  # 假设向量维度为1536
-            
-            return embeddings
-            
+            # 调用智谱AI嵌入API，input传入列表即为批量嵌入
+            response = client.embeddings.create(
+                model=self.model,
+                input=batch_texts
+            )
         except Exception as e:
-            logger.error(f"生成嵌入向量时出错: {str(e)}")
-            # 返回零向量作为后备
-            return [[0.0] * 1536 for _ in texts]  # 假设向量维度为1536
+            logger.error(f"处理嵌入批次时出错: {str(e)}")
+            raise
+        
+        # 按返回的index还原输入顺序
+        data = sorted(response.data, key=lambda item: item.index)
+        return [item.embedding for item in data]
     
     def embed_query(self, text: str) -> List[float]:
         """生成单个查询文本的嵌入向量。
@@ -103,5 +97,4 @@ class ZhipuEmbeddings(BaseModel, Embeddings):
         Returns:
             嵌入向量
         """
-        embeddings = self.embed_documents([text])
-        return embeddings[0] if embeddings else [0.0] * 1536  # 假设向量维度为1536
+        return self.embed_documents([text])[0]
@@ -1,7 +1,13 @@
 import os
+import threading
 import logging
-from typing import List
+from typing import AsyncIterator, Dict, List
+from .config import MODEL_ROLES
 from .model_strategies import ModelStrategy
+from .provider_stats import prompt_cache_stats
+from .embedding_cache import embedding_cache
+from .embedding_batching import aembed_in_batches
+from .http_clients import aembed_batch
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -9,9 +15,21 @@ logger = logging.getLogger(__name__)
 class ZhipuStrategy(ModelStrategy):
     """智谱AI模型策略"""
     
+    provider = "zhipu"
+    embedding_model = "embedding-2"
+    chat_model = MODEL_ROLES["zhipu"]["generation"]
+    analysis_model = MODEL_ROLES["zhipu"]["analysis"]
+    base_url = "https://open.bigmodel.cn/api/paas/v4"
+    label = "智谱AI"
+    
     def __init__(self):
         self.api_key = os.environ.get("ZHIPU_API_KEY")
         self.available = self._check_availability()
+        # 长期复用的连接池，创建时在后台预先建立连接；SDK客户端和嵌入模型在首次使用时创建，之后一直复用
+        self.http_client = self._open_http_client() if self.available else None
+        self._client = None
+        self._embeddings = None
+        self._client_lock = threading.Lock()
     
     def _check_availability(self) -> bool:
         """检查智谱AI API是否可用"""
@@ -20,139 +38,91 @@ class ZhipuStrategy(ModelStrategy):
             return False
         return True
     
-    def analyze_question(self, question: str, tone: str, length: str) -> str:
-        """使用智谱AI的GLM-4模型分析问题"""
-        if not self.is_available():
-            raise ValueError("智谱AI API不可用")
+    def _get_client(self):
+        """获取长期复用的ZhipuAI客户端，底层使用本策略的连接池"""
+        with self._client_lock:
+            if self._client is None:
+                import zhipuai
+                self._client = zhipuai.ZhipuAI(api_key=self.api_key, http_client=self.http_client)
+                logger.debug("已创建ZhipuAI客户端")
+            return self._client
+    
+    def _complete(self, model: str, messages: List[Dict[str, str]], max_tokens: int) -> str:
+        """通过ZhipuAI客户端调用对话补全接口"""
+        response = self._get_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=max_tokens
+        )
+        prompt_cache_stats.record(model, getattr(response, "usage", None))
         
-        try:
-            import zhipuai
-            
-            logger.info("使用智谱AI的GLM-4模型分析问题")
-            
-            # 构建提示词
-            prompt_text = f"""请分析以下问题，并思考如何回答：
-            
-            问题：{question}
-            
-            要求：
-            - 语气：{tone}
-            - 回答长度：{length}
-            
-            请提供你的分析思路（不是回答本身）："""
-            
-            # 调用智谱AI的GLM-4模型
-            logger.debug(f"开始调用智谱AI的GLM-4模型进行问题分析")
-            logger.debug(f"API密钥前5位: {self.api_key[:5] if self.api_key else '未设置'}")
-            logger.debug(f"提示词: {prompt_text[:100]}...")
-            
-            client = zhipuai.ZhipuAI(api_key=self.api_key)
-            logger.debug("已创建ZhipuAI客户端")
-            
-            response = client.chat.completions.create(
-                model="glm-4",  # 使用GLM-4模型
-                messages=[
-                    {"role": "user", "content": prompt_text}
-                ],
-                temperature=0.7,
-                max_tokens=1024
-            )
-            
-            # 处理响应
-            if response and hasattr(response, 'choices') and len(response.choices) > 0:
-                if hasattr(response.choices[0], 'message') and hasattr(response.choices[0].message, 'content'):
-                    analysis = response.choices[0].message.content
-                    logger.info("智谱AI问题分析完成")
-                    return analysis
-            
-            logger.error("智谱AI响应格式异常")
-            raise ValueError("智谱AI响应格式异常")
-            
-        except Exception as e:
-            logger.error(f"使用智谱AI模型分析问题时出错: {str(e)}")
-            raise
+        # 处理响应
+        if response and hasattr(response, 'choices') and len(response.choices) > 0:
+            if hasattr(response.choices[0], 'message') and hasattr(response.choices[0].message, 'content'):
+                return response.choices[0].message.content
+        
+        logger.error("智谱AI响应格式异常")
+        raise ValueError("智谱AI响应格式异常")
+    
+    def analyze_question(self, question: str, tone: str, length: str) -> str:
+        """使用智谱AI模型分析问题"""
+        return self._chat("分析问题", *self._analysis_request(question, tone, length))
     
     def generate_answer(self, question: str, context: List[str], tone: str, word_count: str) -> str:
-        """使用智谱AI的GLM-4模型生成回答"""
+        """使用智谱AI模型生成回答"""
+        return self._chat("生成回答", *self._answer_request(question, context, tone, word_count))
+    
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """获取文本嵌入向量"""
         if not self.is_available():
             raise ValueError("智谱AI API不可用")
         
         try:
-            import zhipuai
-            
-            logger.info("使用智谱AI的GLM-4模型生成回答")
-            
-            # 构建提示词
-            prompt_text = f"""你是一位专业的知乎回答者，请根据以下信息生成一篇高质量的知乎回答：
-            
-            问题：{question}
-            
-            参考知识：
-            {"\n\n".join(context)}
-            
-            要求：
-            1. 语气风格：{tone}
-            2. 回答长度：{word_count}
-            3. 结构清晰，有逻辑性，包含适当的小标题
-            4. 内容真实可靠，避免虚构信息
-            5. 如果知识库中没有相关信息，可以使用你的通用知识
-            6. 适当引用数据或案例增加可信度
-            7. 回答应当有个人见解，不要过于平淡
-            8. 使用markdown格式美化回答
-            
-            你的回答："""
-            
-            # 调用智谱AI的GLM-4模型
-            logger.debug(f"开始调用智谱AI的GLM-4模型生成回答")
-            logger.debug(f"API密钥前5位: {self.api_key[:5] if self.api_key else '未设置'}")
-            logger.debug(f"提示词: {prompt_text[:100]}...")
-            
-            client = zhipuai.ZhipuAI(api_key=self.api_key)
-            logger.debug("已创建ZhipuAI客户端")
-            
-            response = client.chat.completions.create(
-                model="glm-4",  # 使用GLM-4模型
-                messages=[
-                    {"role": "user", "content": prompt_text}
-                ],
-                temperature=0.7,
-                max_tokens=2048
-            )
-            
-            # 处理响应
-            if response and hasattr(response, 'choices') and len(response.choices) > 0:
-                if hasattr(response.choices[0], 'message') and hasattr(response.choices[0].message, 'content'):
-                    answer = response.choices[0].message.content
-                    logger.info("智谱AI回答生成完成")
-                    return answer
-            
-            logger.error("智谱AI响应格式异常")
-            raise ValueError("智谱AI响应格式异常")
+            from .zhipu_embeddings import ZhipuEmbeddings
             
+            if self._embeddings is None:
+                self._embeddings = ZhipuEmbeddings(model=self.embedding_model, client=self._get_client())
+            embeddings = self._embeddings
+            # 嵌入模型内部按接口上限分批，每批一次请求
+            return embeddings.embed_documents(texts)
         except Exception as e:
-            logger.error(f"使用智谱AI模型生成回答时出错: {str(e)}")
+            logger.error(f"使用智谱AI获取嵌入向量时出错: {str(e)}")
             raise
     
-    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """获取文本嵌入向量"""
+    async def aanalyze_question(self, question: str, tone: str, length: str) -> str:
+        """异步调用智谱AI模型分析问题"""
+        return await self._achat("分析问题", *self._analysis_request(question, tone, length))
+    
+    async def agenerate_answer(self, question: str, context: List[str], tone: str, word_count: str) -> str:
+        """异步调用智谱AI模型生成回答"""
+        return await self._achat("生成回答", *self._answer_request(question, context, tone, word_count))
+    
+    async def astream_answer(self, question: str, context: List[str], tone: str, word_count: str) -> AsyncIterator[str]:
+        """流式调用智谱AI模型生成回答，逐段产出模型输出"""
+        async for chunk in self._astream("生成回答", *self._answer_request(question, context, tone, word_count)):
+            yield chunk
+    
+    async def aget_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """异步获取文本嵌入向量，与同步接口共用嵌入缓存"""
         if not self.is_available():
             raise ValueError("智谱AI API不可用")
         
         try:
-            from .zhipu_embeddings import ZhipuEmbeddings
-            
-            embedding_model = ZhipuEmbeddings()
-            embeddings = []
-            
-            for text in texts:
-                embedding = embedding_model.embed_query(text)
-                embeddings.append(embedding)
-            
-            return embeddings
+            return await embedding_cache.aget_or_compute(self.provider, self.embedding_model, texts, self._arequest_embeddings)
         except Exception as e:
             logger.error(f"使用智谱AI获取嵌入向量时出错: {str(e)}")
             raise
     
+    async def _arequest_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """按接口的批量上限分批，在事件循环中并发获取文本嵌入向量"""
+        client = self._async_client()
+        return await aembed_in_batches(
+            self.provider,
+            texts,
+            lambda batch: aembed_batch(client, "智谱AI", self.embedding_model, batch)
+        )
+    
     def is_available(self) -> bool:
         """检查模型是否可用"""
         return self.available
\ No newline at end of file
@@ -0,0 +1,57 @@
+import sys
+import argparse
+import logging
+from dotenv import load_dotenv
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 加载环境变量
+load_dotenv()
+
+from backend.config import BATCH_CONFIG, SUPPORTED_PROVIDERS, update_model_config
+from backend.batch_runner import arun_batch, load_questions
+from backend.http_clients import run_async
+from backend.zhihu_hot import get_zhihu_hot_questions
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="批量为知乎热榜或问题文件中的问题生成回答")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--hot", type=int, default=10, help="获取知乎热榜的前N个问题（默认10）")
+    source.add_argument("--questions", help="问题文件，每行一个问题")
+    parser.add_argument("--tone", default="专业严谨", help="回答风格（默认专业严谨）")
+    parser.add_argument("--length", default="中等", choices=["简短", "中等", "详细"], help="回答长度（默认中等）")
+    parser.add_argument("--provider", choices=list(SUPPORTED_PROVIDERS), help="模型提供商（默认自动选择）")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONFIG["concurrency"], help="同时处理的问题数")
+    parser.add_argument("--output-dir", default=BATCH_CONFIG["output_dir"], help="回答的保存目录")
+    parser.add_argument("--summary", help="JSONL汇总文件路径，默认保存在回答目录中")
+    return parser.parse_args()
+
+def main():
+    """主函数"""
+    args = parse_args()
+    if args.provider:
+        update_model_config(provider=args.provider)
+
+    questions = load_questions(args.questions) if args.questions else get_zhihu_hot_questions(limit=args.hot)
+    if not questions:
+        print("没有需要回答的问题")
+        return 1
+
+    # 在常驻的事件循环中运行，复用模型策略创建时预热的连接
+    records = run_async(arun_batch(
+        questions,
+        tone=args.tone,
+        length=args.length,
+        concurrency=args.concurrency,
+        output_dir=args.output_dir,
+        summary_path=args.summary
+    ))
+    failed = [record for record in records if record["status"] != "ok"]
+    print(f"完成 {len(records) - len(failed)}/{len(records)} 个问题，回答保存在 {args.output_dir}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
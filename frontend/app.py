@@ -5,9 +5,10 @@ import time
 
 # 添加后端目录到路径
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from backend.knowledge_loader import load_knowledge_base
-from backend.agent_builder import get_agent_executor
+from backend.knowledge_loader import load_knowledge_base, delete_documents, list_documents
+from backend.agent_builder import astream_agent
 from backend.config import update_model_config
+from backend.http_clients import iterate_async
 from backend.zhihu_poster import post_to_zhihu
 from backend.zhihu_hot import get_zhihu_hot_questions
 
@@ -75,9 +76,13 @@ with st.sidebar:
             )
             st.success(f"{SUPPORTED_PROVIDERS[provider]['name']} API设置已保存！")
     
+    # 删除文档后更换上传组件的key以清空已上传的文件，刷新页面时不会把刚删除的文档重新导入，之后可以再次上传同名文件
+    if 'uploader_key' not in st.session_state:
+        st.session_state.uploader_key = 0
     uploaded_files = st.file_uploader("上传知识文档", 
                     type=["txt", "md", "pdf"], 
-                    accept_multiple_files=True)
+                    accept_multiple_files=True,
+                    key=f"uploader_{st.session_state.uploader_key}")
     
     # 风格设置
     tone_options = ["专业严谨", "幽默风趣", "简洁明了", "深度思考"]
@@ -89,8 +94,23 @@ with st.sidebar:
     
     if uploaded_files:
         with st.spinner("构建知识库中..."):
-            load_knowledge_base(uploaded_files)
-            st.success("知识库更新完成！")
+            try:
+                load_knowledge_base(uploaded_files)
+                st.success("知识库更新完成！")
+            except ValueError as e:
+                # 例如嵌入模型已变化，与已有索引不一致
+                st.error(str(e))
+    
+    # 知识库文档管理
+    knowledge_docs = list_documents()
+    if knowledge_docs:
+        with st.expander(f"知识库文档 ({len(knowledge_docs)})"):
+            docs_to_delete = st.multiselect("选择要删除的文档", knowledge_docs)
+            if docs_to_delete and st.button("删除所选文档"):
+                with st.spinner("更新知识库中..."):
+                    delete_documents(docs_to_delete)
+                st.session_state.uploader_key += 1
+                st.rerun()
 
 # 热榜问题选择区
 st.header("知乎热榜问题")
@@ -134,22 +154,47 @@ if custom_q:
     selected_q = custom_q
 
 # 回答生成区
+# 智能体各节点的显示名称
+NODE_LABELS = {
+    "reuse": "查找相似问题",
+    "retrieve": "检索知识",
+    "collect_images": "收集图片",
+    "analyze": "分析问题",
+    "generate": "生成回答"
+}
+
 if st.button("生成回答"):
-    with st.spinner("智能思考中..."):
-        try:
-            agent = get_agent_executor()
-            response = agent.invoke({
-                "question": selected_q,
-                "tone": selected_tone,
-                "length": selected_length
-            })
-            st.markdown("### 生成的回答:")
-            st.markdown(response['answer'])
-            
-            # 保存回答用于后续发布
-            st.session_state.zhihu_answer = response['answer']
-        except Exception as e:
-            st.error(f"生成回答时出错: {str(e)}")
+    status = st.status("智能思考中...", expanded=False)
+    st.markdown("### 生成的回答:")
+    answer_area = st.empty()
+    try:
+        # 在常驻的事件循环中流式执行，节点完成和回答片段到达时立即显示
+        streamed = ""
+        for event in iterate_async(astream_agent({
+            "question": selected_q,
+            "tone": selected_tone,
+            "length": selected_length
+        })):
+            if event["type"] == "node":
+                status.write(f"✅ {NODE_LABELS.get(event['node'], event['node'])}")
+                for thought in event["thoughts"]:
+                    status.caption(thought)
+            elif event["type"] == "token":
+                if not streamed:
+                    status.update(label="正在生成回答...")
+                streamed += event["text"]
+                answer_area.markdown(streamed + "▌")
+            elif event["type"] == "done":
+                answer_area.markdown(event["answer"])
+                status.update(label="回答生成完成", state="complete")
+                ttft = f"{event['ttft']:.1f}秒" if event["ttft"] is not None else "无"
+                st.caption(f"首字耗时 {ttft}，总耗时 {event['latency']:.1f}秒")
+                
+                # 保存回答用于后续发布
+                st.session_state.zhihu_answer = event["answer"]
+    except Exception as e:
+        status.update(label="生成回答失败", state="error")
+        st.error(f"生成回答时出错: {str(e)}")
 
 # 回答发布区
 if 'zhihu_answer' in st.session_state:
@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import asyncio
+import tempfile
+import logging
+import httpx
+from backend import http_clients, deepseek_strategy
+from backend.deepseek_strategy import DeepSeekStrategy
+from backend.embedding_cache import EmbeddingCache
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DELAY = 0.2
+
+async def _handler(request: httpx.Request) -> httpx.Response:
+    """模拟OpenAI兼容接口，每个请求耗时DELAY秒"""
+    await asyncio.sleep(DELAY)
+    body = json.loads(request.content)
+    if request.url.path.endswith("/embeddings"):
+        data = [{"index": i, "embedding": [float(len(text)), 1.0]} for i, text in enumerate(body["input"])]
+        return httpx.Response(200, json={"data": data[::-1]})
+    return httpx.Response(200, json={"choices": [{"message": {"content": f"{body['model']}:{body['max_tokens']}"}}]})
+
+async def _stream_handler(request: httpx.Request) -> httpx.Response:
+    """模拟流式对话接口，按SSE格式逐段返回"""
+    body = json.loads(request.content)
+    assert body["stream"] is True
+    lines = [f"data: {json.dumps({'choices': [{'delta': {'content': piece}}]}, ensure_ascii=False)}" for piece in ["知乎", "回答", "完成"]]
+    lines.insert(1, ": keep-alive")
+    lines.append("data: [DONE]")
+    return httpx.Response(200, content="\n\n".join(lines).encode("utf-8"), headers={"Content-Type": "text/event-stream"})
+
+def _make_strategy() -> DeepSeekStrategy:
+    """创建不预热连接的DeepSeek策略"""
+    os.environ.setdefault("DEEPSEEK_API_KEY", "sk-test-0123456789")
+    http_clients.PROVIDER_HTTP_CONFIG["deepseek"] = {"warmup": False}
+    try:
+        return DeepSeekStrategy()
+    finally:
+        http_clients.PROVIDER_HTTP_CONFIG.pop("deepseek")
+
+def test_async_strategy():
+    """测试异步接口在同一个事件循环中并发请求，并与同步接口共用嵌入缓存"""
+    strategy = _make_strategy()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        original_cache = deepseek_strategy.embedding_cache
+        deepseek_strategy.embedding_cache = EmbeddingCache(db_path=os.path.join(temp_dir, "embeddings.sqlite3"))
+        try:
+            async def run():
+                http_clients._async_clients[asyncio.get_running_loop()] = {
+                    (strategy.provider, strategy.base_url, strategy.api_key): httpx.AsyncClient(base_url=strategy.base_url, transport=httpx.MockTransport(_handler))
+                }
+                start = time.perf_counter()
+                analyses = await asyncio.gather(*[
+                    strategy.aanalyze_question(f"问题{i}", "专业", "简短") for i in range(10)
+                ])
+                elapsed = time.perf_counter() - start
+                vectors = await strategy.aget_embeddings(["知乎", "回答问题", "知乎"])
+                cached = await strategy.aget_embeddings(["回答问题"])
+                return analyses, elapsed, vectors, cached
+
+            analyses, elapsed, vectors, cached = http_clients.run_async(run())
+            assert analyses == ["deepseek-chat:384"] * 10
+            # 10个请求并发完成，总耗时接近单个请求
+            assert elapsed < DELAY * 3, elapsed
+            # 按index还原顺序
+            assert vectors == [[2.0, 1.0], [4.0, 1.0], [2.0, 1.0]]
+            assert cached == [[4.0, 1.0]]
+            assert deepseek_strategy.embedding_cache.stats()["hits"] == 1
+            logger.info(f"10个并发分析请求耗时 {elapsed:.2f}s")
+        finally:
+            deepseek_strategy.embedding_cache = original_cache
+
+def test_stream_answer():
+    """测试流式生成逐段产出，并可以在同步代码中逐项取出"""
+    strategy = _make_strategy()
+
+    async def stream():
+        http_clients._async_clients[asyncio.get_running_loop()] = {
+            (strategy.provider, strategy.base_url, strategy.api_key): httpx.AsyncClient(base_url=strategy.base_url, transport=httpx.MockTransport(_stream_handler))
+        }
+        async for chunk in strategy.astream_answer("问题", ["知识"], "专业", "300-500字"):
+            yield chunk
+
+    assert list(http_clients.iterate_async(stream())) == ["知乎", "回答", "完成"]
+
+if __name__ == "__main__":
+    test_async_strategy()
+    test_stream_answer()
+    logger.info("异步模型策略测试通过")
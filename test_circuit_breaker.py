@@ -0,0 +1,80 @@
+import time
+import logging
+from backend.circuit_breaker import CircuitBreaker, FailoverStrategy, circuit_breakers, CLOSED, OPEN, HALF_OPEN
+from backend.http_clients import run_async, iterate_async
+from backend.model_strategies import FakeStrategy
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class FlakyStrategy(FakeStrategy):
+    """可以切换成失败状态的假策略，记录收到的请求数"""
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self.failing = False
+        self.calls = 0
+
+    def analyze_question(self, question: str, tone: str, length: str) -> str:
+        self.calls += 1
+        if self.failing:
+            raise ValueError(f"{self.provider} 服务不可用")
+        return self.provider
+
+    async def aanalyze_question(self, question: str, tone: str, length: str) -> str:
+        return self.analyze_question(question, tone, length)
+
+    async def astream_answer(self, question, context, tone, word_count):
+        self.analyze_question(question, tone, word_count)
+        yield self.provider
+
+def test_circuit_breaker_states():
+    """测试熔断器在连续失败后打开，超时后半开放行一个试探请求，成功后关闭"""
+    breaker = CircuitBreaker("test", failure_threshold=2, recovery_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN and not breaker.allow_request()
+
+    time.sleep(0.06)
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow_request() and not breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    time.sleep(0.06)
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.allow_request()
+
+def test_failover():
+    """测试主提供商失败后切换到备用提供商，熔断后不再请求主提供商"""
+    primary, backup = FlakyStrategy("flaky-primary"), FlakyStrategy("flaky-backup")
+    strategy = FailoverStrategy([primary, backup])
+    assert strategy.analyze_question("问题", "专业", "简短") == "flaky-primary"
+    assert strategy.served_by() is primary
+
+    primary.failing = True
+    threshold = circuit_breakers.get("flaky-primary").failure_threshold
+    for _ in range(threshold):
+        assert run_async(strategy.aanalyze_question("问题", "专业", "简短")) == "flaky-backup"
+    assert circuit_breakers.is_open("flaky-primary")
+    assert strategy.served_by() is backup
+
+    calls = primary.calls
+    assert list(iterate_async(strategy.astream_answer("问题", [], "专业", "300字"))) == ["flaky-backup"]
+    assert primary.calls == calls
+    logger.info(f"熔断器状态: {circuit_breakers.snapshot()}")
+
+    backup.failing = True
+    try:
+        strategy.analyze_question("问题", "专业", "简短")
+        raise AssertionError("所有提供商失败时应当抛出异常")
+    except ValueError as e:
+        assert "flaky-backup" in str(e)
+
+if __name__ == "__main__":
+    test_circuit_breaker_states()
+    test_failover()
+    logger.info("熔断器测试通过")
@@ -0,0 +1,49 @@
+import logging
+from backend import model_strategies
+from backend.context_packer import count_tokens, pack_context, select_context_tier, split_sentences
+from backend.kimi_strategy import KimiStrategy
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+QUESTION = "Python适合做数据分析吗？"
+CONTEXT = [
+    "今天天气很好。Python拥有pandas和numpy等数据分析库。适合初学者入门。",
+    "机器学习需要大量数据。很多公司用Python做数据分析和可视化！",
+    "咖啡是一种常见的饮品。它起源于埃塞俄比亚。"
+]
+
+def test_pack_context():
+    """测试参考知识超出预算时抽取与问题相关的句子"""
+    assert split_sentences(CONTEXT[1]) == ["机器学习需要大量数据。", "很多公司用Python做数据分析和可视化！"]
+    assert pack_context(QUESTION, CONTEXT, 10000, "kimi") == CONTEXT
+
+    budget = count_tokens("Python拥有pandas和numpy等数据分析库。很多公司用Python做数据分析和可视化！", "kimi") + 2
+    packed = pack_context(QUESTION, CONTEXT, budget, "kimi")
+    logger.info(f"压缩后的参考知识: {packed}")
+    assert packed == ["Python拥有pandas和numpy等数据分析库。", "很多公司用Python做数据分析和可视化！"]
+    assert count_tokens("\n\n".join(packed), "kimi") <= budget
+
+def test_context_tier():
+    """测试提示词超出上下文窗口时切换到更大的档位"""
+    assert select_context_tier("kimi", "moonshot-v1-8k", 6000) == ("moonshot-v1-8k", True)
+    assert select_context_tier("kimi", "moonshot-v1-8k", 20000) == ("moonshot-v1-32k", True)
+    assert select_context_tier("kimi", "moonshot-v1-8k", 200000) == ("moonshot-v1-128k", False)
+    assert select_context_tier("deepseek", "deepseek-chat", 20000) == ("deepseek-chat", True)
+
+    original = dict(model_strategies.CONTEXT_PACKING_CONFIG)
+    model_strategies.CONTEXT_PACKING_CONFIG["max_context_tokens"] = 100000
+    try:
+        # 不需要API密钥，只计算提示词和模型档位
+        strategy = KimiStrategy.__new__(KimiStrategy)
+        model, messages, max_tokens = strategy._answer_request(QUESTION, ["数据分析" * 5000], "专业", "300字")
+        assert model == "moonshot-v1-32k", model
+        assert max_tokens == 2048
+    finally:
+        model_strategies.CONTEXT_PACKING_CONFIG.update(original)
+
+if __name__ == "__main__":
+    test_pack_context()
+    test_context_tier()
+    logger.info("参考知识打包测试通过")
@@ -0,0 +1,44 @@
+import logging
+from types import SimpleNamespace
+from backend.embedding_batching import estimate_tokens, get_batch_limits, iter_batches, truncate_to_tokens
+from backend.zhipu_embeddings import ZhipuEmbeddings
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class FailingClient:
+    """嵌入接口始终报错的假智谱AI客户端"""
+
+    def __init__(self):
+        self.embeddings = SimpleNamespace(create=self.create)
+
+    def create(self, model, input):
+        raise ValueError("智谱AI嵌入接口不可用")
+
+def test_long_items_truncated():
+    """测试超过单条上限的文本截断后再分批，其他文本原样发送"""
+    limit = get_batch_limits("zhipu")["max_item_tokens"]
+    long_text = "知乎" * limit + "answer " * limit
+    batches = list(iter_batches("zhipu", ["短文本", long_text, "another"]))
+    texts = [text for batch in batches for text in batch]
+    assert texts[0] == "短文本" and texts[2] == "another"
+    assert long_text.startswith(texts[1]) and estimate_tokens(texts[1]) == limit
+
+    assert truncate_to_tokens("abcdefgh知乎", 2) == "abcdefgh"
+    assert truncate_to_tokens("abcdefgh知乎", 3) == "abcdefgh知"
+    assert truncate_to_tokens("短", 1) == "短"
+
+def test_failed_batch_raises():
+    """测试嵌入请求失败时抛出异常，而不是返回会被写入索引的零向量"""
+    embeddings = ZhipuEmbeddings(api_key="test-key-0123456789", client=FailingClient())
+    try:
+        embeddings._embed_documents_uncached(["知乎", "回答"])
+        raise AssertionError("嵌入请求失败时应当抛出异常")
+    except ValueError as e:
+        assert "不可用" in str(e)
+
+if __name__ == "__main__":
+    test_long_items_truncated()
+    test_failed_batch_raises()
+    logger.info("嵌入批量请求测试通过")
@@ -0,0 +1,57 @@
+import os
+import tempfile
+import logging
+from backend.embedding_cache import EmbeddingCache
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def test_embedding_cache():
+    """测试嵌入缓存的命中、淘汰和统计"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = EmbeddingCache(db_path=os.path.join(temp_dir, "embeddings.sqlite3"), max_entries=3)
+        calls = []
+
+        def compute(texts):
+            calls.append(list(texts))
+            return [[float(len(text)), 0.5] for text in texts]
+
+        # 首次计算，重复文本只请求一次
+        vectors = cache.get_or_compute("zhipu", "embedding-2", ["知乎", "回答", "知乎"], compute)
+        assert calls == [["知乎", "回答"]]
+        assert vectors[0] == vectors[2] == [2.0, 0.5]
+
+        # 再次查询全部命中
+        cache.get_or_compute("zhipu", "embedding-2", ["知乎", "回答"], compute)
+        assert len(calls) == 1
+
+        # 不同模型的缓存互不影响
+        cache.get_or_compute("zhipu", "embedding-3", ["知乎"], compute)
+        assert calls[-1] == ["知乎"]
+
+        # 全零向量不缓存
+        cache.get_or_compute("qwen", "text-embedding-v2", ["失败"], lambda texts: [[0.0, 0.0] for _ in texts])
+        assert cache.get_many("qwen", "text-embedding-v2", ["失败"]) == [None]
+
+        # 超过容量后淘汰最久未访问的条目
+        cache.get_many("zhipu", "embedding-2", ["回答"])
+        cache.get_or_compute("zhipu", "embedding-2", ["新文本"], compute)
+        assert cache.stats()["entries"] == 3
+        assert cache.get_many("zhipu", "embedding-2", ["知乎"]) == [None]
+
+        # 条目数在内存中估算，没有超过上限的写入不再统计实际条数
+        large = EmbeddingCache(db_path=os.path.join(temp_dir, "large.sqlite3"), max_entries=100)
+        large.get_or_compute("zhipu", "embedding-2", ["第一条"], compute)
+        statements = []
+        large._connect().set_trace_callback(statements.append)
+        large.get_or_compute("zhipu", "embedding-2", [f"文本{i}" for i in range(10)], compute)
+        assert not any("COUNT" in statement for statement in statements), statements
+        assert large._entries == 11
+
+        stats = cache.stats()
+        logger.info(f"嵌入缓存统计: {stats}")
+        assert stats["hits"] > 0 and stats["misses"] > 0
+
+if __name__ == "__main__":
+    test_embedding_cache()
@@ -0,0 +1,119 @@
+import os
+import time
+import asyncio
+import logging
+import tempfile
+from contextlib import contextmanager
+from backend import hedging
+from backend.hedging import HedgedStrategy, get_hedging_stats
+from backend.http_clients import run_async, iterate_async
+from backend.model_strategies import FakeStrategy
+from backend.response_cache import ResponseCache, CachedStrategy
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class SlowStrategy(FakeStrategy):
+    """按给定耗时返回的假策略"""
+
+    def __init__(self, provider: str, delay: float):
+        self.provider = provider
+        self.delay = delay
+        self.cancelled = 0
+
+    async def aanalyze_question(self, question: str, tone: str, length: str) -> str:
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return self.provider
+
+    def analyze_question(self, question: str, tone: str, length: str) -> str:
+        time.sleep(self.delay)
+        return self.provider
+
+    async def astream_answer(self, question, context, tone, word_count):
+        await asyncio.sleep(self.delay)
+        for piece in [self.provider, "完成"]:
+            yield piece
+
+@contextmanager
+def _use_delay(delay: float):
+    """样本不足时直接使用固定的对冲触发时间，结束后恢复原配置"""
+    saved = {key: hedging.HEDGING_CONFIG[key] for key in ("min_samples", "default_delay")}
+    hedging.HEDGING_CONFIG["min_samples"] = 10 ** 6
+    hedging.HEDGING_CONFIG["default_delay"] = {"analyze": delay, "generate": delay, "stream": delay}
+    try:
+        yield
+    finally:
+        hedging.HEDGING_CONFIG.update(saved)
+
+def test_hedged_requests():
+    """测试主提供商超时后发出对冲请求，先返回的结果胜出并取消另一个请求"""
+    fast = HedgedStrategy(SlowStrategy("primary", 0.02), SlowStrategy("backup", 0.02))
+    slow_primary = SlowStrategy("primary", 1.0)
+    slow = HedgedStrategy(slow_primary, SlowStrategy("backup", 0.05))
+
+    with _use_delay(0.1):
+        assert run_async(fast.aanalyze_question("问题", "专业", "简短")) == "primary"
+        assert fast.served_by().provider == "primary"
+        start = time.perf_counter()
+        assert run_async(slow.aanalyze_question("问题", "专业", "简短")) == "backup"
+        assert time.perf_counter() - start < 0.5
+        assert slow_primary.cancelled == 1
+        assert slow.served_by().provider == "backup"
+        assert slow.analyze_question("问题", "专业", "简短") == "backup"
+
+    stats = get_hedging_stats()["analyze"]
+    assert stats["requests"] == 3 and stats["hedged"] == 2 and stats["hedge_wins"] == 2, stats
+    logger.info(f"对冲统计: {stats}")
+
+class FailingStrategy(SlowStrategy):
+    """立即失败的假策略"""
+
+    async def aanalyze_question(self, question: str, tone: str, length: str) -> str:
+        raise ValueError(f"{self.provider} 不可用")
+
+    def analyze_question(self, question: str, tone: str, length: str) -> str:
+        raise ValueError(f"{self.provider} 不可用")
+
+def test_primary_failure():
+    """测试主提供商在对冲之前失败时直接改用备用策略"""
+    strategy = HedgedStrategy(FailingStrategy("primary", 0), SlowStrategy("backup", 0.02))
+    with _use_delay(1.0):
+        start = time.perf_counter()
+        assert run_async(strategy.aanalyze_question("问题", "专业", "简短")) == "backup"
+        assert strategy.analyze_question("问题", "专业", "简短") == "backup"
+        assert time.perf_counter() - start < 0.5
+    assert strategy.served_by().provider == "backup"
+
+def test_hedged_stream():
+    """测试流式生成按第一个片段对冲"""
+    strategy = HedgedStrategy(SlowStrategy("primary", 1.0), SlowStrategy("backup", 0.05))
+    with _use_delay(0.1):
+        assert list(iterate_async(strategy.astream_answer("问题", [], "专业", "300字"))) == ["backup", "完成"]
+    assert strategy.served_by().provider == "backup"
+
+def test_hedged_cache_key():
+    """测试备用提供商胜出时，回复缓存按备用提供商的键保存，不会在主提供商的键下命中"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = ResponseCache(db_path=os.path.join(temp_dir, "responses.sqlite3"))
+        primary = SlowStrategy("primary", 1.0)
+        strategy = CachedStrategy(HedgedStrategy(primary, SlowStrategy("backup", 0.05)), cache)
+        with _use_delay(0.1):
+            assert run_async(strategy.aanalyze_question("问题", "专业", "简短")) == "backup"
+            assert strategy.served_by().provider == "backup"
+            primary.delay = 0.02
+            assert run_async(strategy.aanalyze_question("问题", "专业", "简短")) == "primary"
+            assert run_async(strategy.aanalyze_question("问题", "专业", "简短")) == "primary"
+        assert strategy.served_by() is strategy
+        assert cache.stats()["memory_hits"] == 1
+
+if __name__ == "__main__":
+    test_hedged_requests()
+    test_primary_failure()
+    test_hedged_stream()
+    test_hedged_cache_key()
+    logger.info("对冲请求测试通过")
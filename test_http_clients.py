@@ -0,0 +1,86 @@
+import json
+import threading
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from backend import http_clients
+from backend.http_clients import chat_completion, create_client, run_async, warm_up
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class _Handler(BaseHTTPRequestHandler):
+    """本地的OpenAI兼容接口，记录建立的连接数"""
+    protocol_version = "HTTP/1.1"
+    connections = 0
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with _Handler.lock:
+            _Handler.connections += 1
+
+    def _reply(self, body: bytes):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        assert self.headers["Authorization"] == "Bearer sk-local"
+        self._reply(json.dumps({"choices": [{"message": {"content": payload["model"]}}]}).encode("utf-8"))
+
+    def log_message(self, format, *args):
+        pass
+
+def test_pooled_client():
+    """测试连接池复用连接，预热后的请求不再建立新连接"""
+    _Handler.connections = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    try:
+        client = create_client("local", base_url, "sk-local")
+        for _ in range(5):
+            assert chat_completion(client, "本地", "m", [{"role": "user", "content": "你好"}]) == "m"
+        # 5次请求复用同一个连接
+        assert _Handler.connections == 1
+
+        # 预热同步和异步客户端各建立一个连接，之后的请求直接复用
+        warmed = create_client("local", base_url, "sk-local")
+        thread, future = warm_up("local", base_url, "sk-local", warmed)
+        thread.join(5)
+        future.result(5)
+        assert _Handler.connections == 3
+        chat_completion(warmed, "本地", "m", [{"role": "user", "content": "你好"}])
+
+        async def call_async():
+            client = http_clients.get_async_client("local", base_url, "sk-local")
+            return await http_clients.achat_completion(client, "本地", "m", [{"role": "user", "content": "你好"}])
+
+        assert run_async(call_async()) == "m"
+        assert _Handler.connections == 3
+
+        # 接口根地址不同时不复用其他地址的客户端
+        async def get_clients():
+            return (
+                http_clients.get_async_client("local", base_url, "sk-local"),
+                http_clients.get_async_client("local", base_url + "/other", "sk-local"),
+                http_clients.get_async_client("local", base_url, "sk-other")
+            )
+
+        first, other_url, other_key = run_async(get_clients())
+        assert first is not other_url and first is not other_key and other_url is not other_key
+    finally:
+        server.shutdown()
+
+if __name__ == "__main__":
+    test_pooled_client()
+    logger.info("HTTP连接池测试通过")
@@ -0,0 +1,120 @@
+import time
+import asyncio
+import logging
+from langchain_community.vectorstores import FAISS
+from langchain_community.embeddings import FakeEmbeddings
+from backend.lexical_index import BM25Index, tokenize, reciprocal_rank_fusion
+import numpy as np
+from backend.circuit_breaker import circuit_breakers
+from backend.config import RETRIEVAL_CONFIG
+from backend.retrieval import ahybrid_search, mmr_select
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+TEXTS = [
+    "知乎是中国知名的问答社区，用户可以在平台上提问、回答问题。",
+    "深度学习是机器学习的一个分支，使用多层神经网络。",
+    "Python是一种广泛使用的编程语言，适合数据分析。",
+    "好的知乎回答通常包含个人经验和数据支持。",
+]
+
+def _build_vectorstore():
+    """构建一个用位置编码作为向量的小型向量存储"""
+    vectors = [[1.0 if i == j else 0.0 for j in range(len(TEXTS))] for i in range(len(TEXTS))]
+    return FAISS.from_embeddings(
+        list(zip(TEXTS, vectors)),
+        FakeEmbeddings(size=len(TEXTS)),
+        ids=[f"id{i}" for i in range(len(TEXTS))]
+    )
+
+def test_bm25_index():
+    """测试分词、BM25检索和增量增删"""
+    assert list(tokenize("知乎回答 Python3")) == ["知乎", "乎回", "回答", "python3"]
+
+    vectorstore = _build_vectorstore()
+    index = BM25Index()
+    index.sync(vectorstore)
+    results = index.search("神经网络和深度学习", 2)
+    assert results[0][0] == "id1"
+
+    # 删除后不再返回，压缩后仍然可以检索
+    index.remove(["id1", "id2"])
+    assert all(doc_id != "id1" for doc_id, _ in index.search("深度学习", 4))
+    assert index.search("知乎回答", 1)[0][0] in ("id0", "id3")
+    index.add([("id9", "深度学习框架")])
+    assert index.search("深度学习", 1)[0][0] == "id9"
+
+def test_reciprocal_rank_fusion():
+    """两路都排在前面的文档融合后排第一"""
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d", "a"]])
+    assert [doc_id for doc_id, _ in fused][:2] == ["b", "a"]
+
+def test_hybrid_search_fallback():
+    """嵌入失败时退回关键词检索，熔断期间不再请求嵌入"""
+    vectorstore = _build_vectorstore()
+    lexical_index = BM25Index()
+    lexical_index.sync(vectorstore)
+    calls = []
+
+    async def failing_embed(text):
+        calls.append(text)
+        raise ValueError("嵌入服务不可用")
+
+    result = asyncio.run(ahybrid_search(vectorstore, lexical_index, "Python数据分析", "test-fail", failing_embed, len(TEXTS)))
+    assert result.mode == "lexical"
+    assert result.documents[0].page_content == TEXTS[2]
+    assert circuit_breakers.is_open("test-fail", "embedding")
+
+    start_time = time.perf_counter()
+    result = asyncio.run(ahybrid_search(vectorstore, lexical_index, "Python数据分析", "test-fail", failing_embed, len(TEXTS)))
+    logger.info(f"熔断期间的关键词检索耗时 {(time.perf_counter() - start_time) * 1000:.3f}ms")
+    assert result.mode == "lexical"
+    assert len(calls) == 1
+
+    # 嵌入正常时两路结果融合
+    async def embed(text):
+        return [0.0, 0.0, 0.0, 1.0]
+
+    result = asyncio.run(ahybrid_search(vectorstore, lexical_index, "知乎回答", "test-ok", embed, len(TEXTS)))
+    assert result.mode == "hybrid"
+    assert result.documents[0].page_content == TEXTS[3]
+    assert not circuit_breakers.is_open("test-ok", "embedding")
+
+def test_hybrid_search_timeout():
+    """嵌入超时时不再等待，只返回关键词检索的结果，并计入熔断器"""
+    vectorstore = _build_vectorstore()
+    lexical_index = BM25Index()
+    lexical_index.sync(vectorstore)
+    config = {**RETRIEVAL_CONFIG, "embedding_timeout": 0.05}
+
+    async def slow_embed(text):
+        await asyncio.sleep(1)
+        return [0.0, 0.0, 1.0, 0.0]
+
+    async def search():
+        start_time = time.perf_counter()
+        result = await ahybrid_search(
+            vectorstore, lexical_index, "Python数据分析", "test-slow", slow_embed, len(TEXTS), config
+        )
+        return result, time.perf_counter() - start_time
+
+    result, latency = asyncio.run(search())
+    assert result.mode == "lexical" and latency < 0.5
+    assert result.documents[0].page_content == TEXTS[2]
+    assert circuit_breakers.is_open("test-slow", "embedding")
+
+def test_mmr_select():
+    """重复的候选只保留一个，λ=1时退化为按相关度排序"""
+    vectors = np.array([[1.0, 0.0], [1.0, 0.01], [0.6, 0.8]], dtype=np.float32)
+    relevance = np.array([0.9, 0.89, 0.7], dtype=np.float32)
+    assert mmr_select(relevance, vectors, 2, 0.5) == [0, 2]
+    assert mmr_select(relevance, vectors, 2, 1.0) == [0, 1]
+
+if __name__ == "__main__":
+    test_bm25_index()
+    test_reciprocal_rank_fusion()
+    test_hybrid_search_fallback()
+    test_hybrid_search_timeout()
+    test_mmr_select()
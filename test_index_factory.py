@@ -0,0 +1,55 @@
+import logging
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_community.embeddings import FakeEmbeddings
+from backend.config import VECTOR_INDEX_CONFIG
+from backend.index_factory import configure_index, remove_vectors
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 缩小聚类数和PQ码本，少量向量即可训练IVF和PQ索引
+TEST_INDEX_CONFIG = dict(VECTOR_INDEX_CONFIG, nlist=16, nprobe=16, pq_m=8, pq_nbits=4)
+
+def _build_vectorstore(count, dim):
+    """用随机向量构建一个精确索引"""
+    vectors = np.random.default_rng(0).standard_normal((count, dim), dtype=np.float32).tolist()
+    texts = [f"片段{i}" for i in range(count)]
+    vectorstore = FAISS.from_embeddings(
+        list(zip(texts, vectors)),
+        FakeEmbeddings(size=dim),
+        ids=[f"id{i}" for i in range(count)]
+    )
+    return vectorstore, vectors
+
+def test_index_factory():
+    """测试各类索引的构建、训练、检索和删除"""
+    for index_type in ["flat", "hnsw", "ivf_flat", "ivf_pq", "sq"]:
+        vectorstore, vectors = _build_vectorstore(1500, 32)
+        requested = dict(TEST_INDEX_CONFIG, type=index_type)
+        index_config = configure_index(vectorstore, None, requested)
+        logger.info(f"{index_type}: {index_config['factory']}，检索参数 {index_config['search_params']}")
+        assert index_config["type"] == index_type
+        assert vectorstore.index.ntotal == 1500
+
+        # 自身向量应当是最近邻
+        docs = vectorstore.similarity_search_with_score_by_vector(vectors[42], k=1)
+        assert docs[0][0].page_content == "片段42"
+
+        # 删除后位置映射仍然正确，新增的向量可以检索到
+        remove_vectors(vectorstore, ["id42", "id7"], index_config)
+        assert vectorstore.index.ntotal == 1498
+        docs = vectorstore.similarity_search_with_score_by_vector(vectors[43], k=1)
+        assert docs[0][0].page_content == "片段43"
+        vectorstore.add_embeddings([("新片段", vectors[7])], ids=["new"])
+        docs = vectorstore.similarity_search_with_score_by_vector(vectors[7], k=1)
+        assert docs[0][0].page_content == "新片段"
+
+    # 向量太少时IVF索引先退回精确索引
+    vectorstore, _ = _build_vectorstore(100, 32)
+    index_config = configure_index(vectorstore, None, dict(TEST_INDEX_CONFIG, type="ivf_pq"))
+    assert index_config["type"] == "flat"
+
+if __name__ == "__main__":
+    test_index_factory()
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import logging
+import faiss
+from backend import vector_store_manager
+from backend.index_registry import (
+    check_index_compatible, get_embedding_model, load_manifest, migrate_legacy_index, resolve_embedding_provider,
+    write_manifest
+)
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def test_incompatible_index_kept():
+    """测试嵌入模型变化后拒绝写入，已有的索引文件原样保留"""
+    embedding_model = get_embedding_model("fake")
+    with tempfile.TemporaryDirectory() as store_path:
+        check_index_compatible(store_path, embedding_model)
+        write_manifest({"provider": "fake", "model": "other-model", "dim": 8}, store_path)
+        with open(os.path.join(store_path, "documents.json"), "w", encoding="utf-8") as f:
+            f.write("{}")
+        try:
+            check_index_compatible(store_path, embedding_model)
+            raise AssertionError("嵌入模型不一致时应当拒绝导入")
+        except ValueError as e:
+            assert "other-model" in str(e)
+        assert os.path.exists(os.path.join(store_path, "documents.json"))
+
+def test_legacy_index_migrated():
+    """测试根目录中没有清单的旧版索引迁移到当前提供商的子目录，并按当前配置写入清单"""
+    embedding_model = get_embedding_model(resolve_embedding_provider())
+    with tempfile.TemporaryDirectory() as root:
+        faiss.write_index(faiss.IndexFlatL2(8), os.path.join(root, "index.faiss"))
+        for name in ("index.pkl", "documents.json"):
+            with open(os.path.join(root, name), "w", encoding="utf-8") as f:
+                f.write("{}")
+
+        assert migrate_legacy_index(root) == embedding_model.provider
+        store_path = os.path.join(root, embedding_model.provider)
+        assert sorted(os.listdir(root)) == [embedding_model.provider]
+        for name in ("index.faiss", "index.pkl", "documents.json"):
+            assert os.path.exists(os.path.join(store_path, name))
+        manifest = load_manifest(store_path)
+        assert manifest["provider"] == embedding_model.provider and manifest["model"] == embedding_model.model
+        assert manifest["dim"] == 8
+
+        # 迁移只进行一次
+        assert migrate_legacy_index(root) is None
+
+def test_index_selection_cached():
+    """测试索引选择结果被缓存，只在索引的版本戳变化后重新选择"""
+    calls = []
+    original_select, original_path = vector_store_manager.select_index, vector_store_manager.VECTOR_STORE_PATH
+    with tempfile.TemporaryDirectory() as root:
+        store_path = os.path.join(root, "fake")
+        os.makedirs(store_path)
+        with open(os.path.join(store_path, "VERSION"), "w", encoding="utf-8") as f:
+            f.write("1")
+        vector_store_manager.select_index = lambda preferred: calls.append(preferred) or ("fake", {"version": len(calls)})
+        vector_store_manager.VECTOR_STORE_PATH = root
+        vector_store_manager._selections.clear()
+        try:
+            for _ in range(3):
+                assert vector_store_manager.get_index_selection("zhipu") == ("fake", {"version": 1})
+            # 超过检查间隔但版本戳没有变化，仍然使用缓存
+            assert vector_store_manager.get_index_selection("zhipu", check_interval=0) == ("fake", {"version": 1})
+            assert calls == ["zhipu"]
+
+            with open(os.path.join(store_path, "VERSION"), "w", encoding="utf-8") as f:
+                f.write("2")
+            assert vector_store_manager.get_index_selection("zhipu", check_interval=0) == ("fake", {"version": 2})
+            assert calls == ["zhipu", "zhipu"]
+        finally:
+            vector_store_manager.select_index, vector_store_manager.VECTOR_STORE_PATH = original_select, original_path
+            vector_store_manager._selections.clear()
+
+if __name__ == "__main__":
+    test_incompatible_index_kept()
+    test_legacy_index_migrated()
+    test_index_selection_cached()
+    logger.info("索引清单测试通过")
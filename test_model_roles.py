@@ -0,0 +1,41 @@
+import logging
+from backend.config import MODEL_CONFIG, MODEL_ROLES, update_model_config
+from backend.model_strategies import max_output_tokens
+from backend.qwen_strategy import QwenStrategy
+from backend.openai_strategy import OpenAIStrategy
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def test_max_output_tokens():
+    """测试最大输出token数随回答长度变化"""
+    assert max_output_tokens("analysis", "简短") < max_output_tokens("analysis", "详细")
+    assert max_output_tokens("generation", "简短") == 1024
+    # 生成回答时传入的是字数范围
+    assert max_output_tokens("generation", "1500-2500字") == max_output_tokens("generation", "详细") == 4096
+    assert max_output_tokens("generation", "300字") == max_output_tokens("generation", "中等")
+
+def test_role_models():
+    """测试问题分析和回答生成使用各自的模型"""
+    # 不需要API密钥，只计算请求参数
+    strategy = QwenStrategy.__new__(QwenStrategy)
+    model, messages, max_tokens = strategy._analysis_request("如何学习Python", "专业", "简短")
+    assert model == "qwen-turbo" and "如何学习Python" in messages[-1]["content"] and max_tokens == 384
+    model, _, max_tokens = strategy._answer_request("如何学习Python", ["Python入门"], "专业", "300-500字")
+    assert model == "qwen-max" and max_tokens == 1024
+
+    original_config, original_roles = dict(MODEL_CONFIG), dict(MODEL_ROLES["openai"])
+    try:
+        update_model_config(analysis_model="gpt-4o", generation_model="gpt-4-turbo")
+        strategy = OpenAIStrategy.__new__(OpenAIStrategy)
+        assert strategy._analysis_request("问题", "专业", "中等")[0] == "gpt-4o"
+        assert strategy._answer_request("问题", [], "专业", "800-1200字")[0] == "gpt-4-turbo"
+    finally:
+        MODEL_CONFIG.update(original_config)
+        MODEL_ROLES["openai"].update(original_roles)
+
+if __name__ == "__main__":
+    test_max_output_tokens()
+    test_role_models()
+    logger.info("模型分工测试通过")
@@ -0,0 +1,66 @@
+import io
+import logging
+from pypdf import PdfWriter
+from backend.parallel_parser import ParallelParser
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def _blank_pdf(pages: int) -> memoryview:
+    """生成指定页数的空白PDF"""
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=200, height=200)
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getbuffer()
+
+def test_abandoned_tasks_release_slots():
+    """测试提前结束取回结果时，其余任务归还进程池名额，结束后才释放共享内存"""
+    parser = ParallelParser(max_workers=1, timeout=30, pages_per_task=1)
+    try:
+        tasks = parser.add_file("空白.pdf", _blank_pdf(4))
+        assert len(tasks) == 4 and parser._in_flight == 2
+
+        documents = parser.iter_documents(tasks)
+        assert next(documents).metadata == {"source": "空白.pdf", "page": 0}
+        documents.close()
+        assert parser._in_flight == 0 and not parser._pending
+        assert not parser._shared_memories
+
+        # 名额归还后，下一个文件可以正常解析
+        tasks = parser.add_file("另一个.pdf", _blank_pdf(3))
+        assert [doc.metadata["page"] for doc in parser.iter_documents(tasks)] == [0, 1, 2]
+        assert parser._in_flight == 0
+    finally:
+        parser.close()
+
+def test_pool_kept_between_batches():
+    """测试进程池在多批解析之间保留，唯一的单任务文件不使用进程池"""
+    parser = ParallelParser(max_workers=1, timeout=30, pages_per_task=2)
+    try:
+        tasks = parser.add_file("短文.pdf", _blank_pdf(2), only_file=True)
+        assert len(tasks) == 1 and parser._pool is None and not parser._shared_memories
+        assert [doc.metadata["page"] for doc in parser.iter_documents(tasks)] == [0, 1]
+        parser.release()
+
+        tasks = parser.add_file("长文.pdf", _blank_pdf(3), only_file=True)
+        assert len(tasks) == 2
+        assert [doc.metadata["page"] for doc in parser.iter_documents(tasks)] == [0, 1, 2]
+        pool = parser._pool
+        parser.release()
+        assert parser._pool is pool and not parser._shared_memories
+
+        tasks = parser.add_file("另一个.pdf", _blank_pdf(1))
+        assert [doc.metadata["page"] for doc in parser.iter_documents(tasks)] == [0]
+        parser.release()
+        assert parser._pool is pool
+    finally:
+        parser.close()
+    assert parser._pool is None
+
+if __name__ == "__main__":
+    test_abandoned_tasks_release_slots()
+    test_pool_kept_between_batches()
+    logger.info("并行解析测试通过")
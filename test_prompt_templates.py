@@ -0,0 +1,97 @@
+import json
+import logging
+import httpx
+from backend import http_clients
+from backend.prompt_templates import ANSWER_SYSTEM_PROMPT, build_analysis_messages
+from backend.provider_stats import PromptCacheStats, cached_prompt_tokens
+from backend.deepseek_strategy import DeepSeekStrategy
+from backend.kimi_strategy import KimiStrategy
+from backend.qwen_strategy import QwenStrategy
+from backend.zhipu_strategy import ZhipuStrategy
+from backend.openai_strategy import OpenAIStrategy
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+STRATEGIES = [DeepSeekStrategy, KimiStrategy, QwenStrategy, ZhipuStrategy, OpenAIStrategy]
+
+def test_prompt_layout():
+    """测试所有策略使用相同的提示词布局：固定的系统提示在前，问题在最后"""
+    requests = []
+    for strategy_class in STRATEGIES:
+        # 不需要API密钥，只构建请求
+        strategy = strategy_class.__new__(strategy_class)
+        _, messages, _ = strategy._answer_request("如何学习Python", ["Python入门"], "专业", "300-500字")
+        requests.append(messages)
+    assert all(messages == requests[0] for messages in requests)
+    system, user = requests[0]
+    assert system == {"role": "system", "content": ANSWER_SYSTEM_PROMPT}
+    assert user["content"].index("Python入门") < user["content"].index("如何学习Python")
+    assert user["content"].endswith("问题：如何学习Python")
+
+    # 不同问题的请求共享系统提示这一前缀
+    first, second = build_analysis_messages("问题一", "专业", "简短"), build_analysis_messages("问题二", "幽默", "详细")
+    assert first[0] == second[0]
+
+def test_cached_prompt_tokens():
+    """测试从各提供商的usage中取出命中前缀缓存的token数"""
+    assert cached_prompt_tokens({"prompt_tokens": 100, "prompt_cache_hit_tokens": 64, "prompt_cache_miss_tokens": 36}) == 64
+    assert cached_prompt_tokens({"prompt_tokens": 100, "cached_tokens": 80}) == 80
+    assert cached_prompt_tokens({"prompt_tokens": 100, "prompt_tokens_details": {"cached_tokens": 50}}) == 50
+    assert cached_prompt_tokens({"prompt_tokens": 100}) == 0
+
+    stats = PromptCacheStats()
+    stats.record("deepseek-chat", {"prompt_tokens": 100, "prompt_cache_hit_tokens": 64})
+    stats.record("deepseek-chat", {"prompt_tokens": 100, "prompt_cache_hit_tokens": 0})
+    stats.record("deepseek-chat", None)
+    assert stats.snapshot()["deepseek-chat"] == {"requests": 2, "prompt_tokens": 200, "cached_tokens": 64, "hit_rate": 0.32}
+
+def test_chat_records_usage():
+    """测试对话接口的响应中的缓存命中被记录"""
+    original = http_clients.prompt_cache_stats
+    http_clients.prompt_cache_stats = PromptCacheStats()
+    try:
+        def handler(request: httpx.Request) -> httpx.Response:
+            return httpx.Response(200, json={
+                "choices": [{"message": {"content": "回答"}}],
+                "usage": {"prompt_tokens": 300, "cached_tokens": 256}
+            })
+
+        client = httpx.Client(base_url="https://api.moonshot.cn/v1", transport=httpx.MockTransport(handler))
+        assert http_clients.chat_completion(client, "Kimi", "moonshot-v1-8k", build_analysis_messages("问题", "专业", "简短")) == "回答"
+        assert http_clients.prompt_cache_stats.snapshot()["moonshot-v1-8k"]["cached_tokens"] == 256
+    finally:
+        http_clients.prompt_cache_stats = original
+
+def test_stream_records_usage():
+    """测试流式请求要求返回usage，并记录最后一个片段中的缓存命中"""
+    original = http_clients.prompt_cache_stats
+    http_clients.prompt_cache_stats = PromptCacheStats()
+    try:
+        payloads = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            payloads.append(json.loads(request.content))
+            lines = [
+                {"choices": [{"delta": {"content": "回"}}]},
+                {"choices": [{"delta": {"content": "答"}}]},
+                {"choices": [], "usage": {"prompt_tokens": 300, "prompt_tokens_details": {"cached_tokens": 128}}}
+            ]
+            body = "".join(f"data: {json.dumps(line)}\n\n" for line in lines) + "data: [DONE]\n\n"
+            return httpx.Response(200, text=body, headers={"Content-Type": "text/event-stream"})
+
+        client = httpx.AsyncClient(base_url="https://api.openai.com/v1", transport=httpx.MockTransport(handler))
+        stream = http_clients.astream_chat_completion(client, "OpenAI", "gpt-4o", build_analysis_messages("问题", "专业", "简短"))
+        assert list(http_clients.iterate_async(stream)) == ["回", "答"]
+        assert payloads[0]["stream"] is True and payloads[0]["stream_options"] == {"include_usage": True}
+        assert http_clients.prompt_cache_stats.snapshot()["gpt-4o"]["cached_tokens"] == 128
+    finally:
+        http_clients.prompt_cache_stats = original
+
+if __name__ == "__main__":
+    test_prompt_layout()
+    test_cached_prompt_tokens()
+    test_chat_records_usage()
+    test_stream_records_usage()
+    logger.info("提示词模板测试通过")
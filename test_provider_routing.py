@@ -0,0 +1,50 @@
+import random
+import logging
+from backend.provider_stats import ProviderPerformance, rank_providers
+from backend import provider_stats
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def test_provider_performance():
+    """测试耗时和错误率的指数移动平均"""
+    performance = ProviderPerformance(alpha=0.5, error_penalty=4.0)
+    assert performance.score("zhipu", "analyze") is None
+    performance.record("zhipu", "analyze", 2.0)
+    performance.record("zhipu", "analyze", 4.0, success=False)
+    stats = performance.snapshot()["zhipu"]["analyze"]
+    assert stats == {"latency": 3.0, "error_rate": 0.5, "samples": 2}
+    assert performance.score("zhipu", "analyze") == 3.0 * (1 + 4.0 * 0.5)
+
+def test_rank_providers():
+    """测试大部分请求交给最快的健康提供商，少量请求探索其他提供商"""
+    original = provider_stats.provider_performance
+    provider_stats.provider_performance = ProviderPerformance()
+    try:
+        performance = provider_stats.provider_performance
+        performance.record("zhipu", "generate", 8.0)
+        performance.record("deepseek", "generate", 3.0)
+        performance.record("qwen", "generate", 1.0)
+        providers = ["zhipu", "deepseek", "qwen", "kimi"]
+
+        def healthy(provider):
+            return provider != "qwen"
+
+        assert rank_providers(providers, "generate", healthy, exploration=0.0) == ["deepseek", "zhipu", "kimi", "qwen"]
+        # 没有统计的操作保持默认顺序
+        assert rank_providers(providers, "analyze", healthy, exploration=0.0) == ["zhipu", "deepseek", "kimi", "qwen"]
+
+        rng = random.Random(0)
+        firsts = [rank_providers(providers, "generate", healthy, exploration=0.1, rng=rng)[0] for _ in range(1000)]
+        share = firsts.count("deepseek") / len(firsts)
+        logger.info(f"最快提供商承担 {share:.1%} 的请求")
+        assert 0.85 < share < 0.95
+        assert "qwen" not in firsts and set(firsts) == {"deepseek", "zhipu", "kimi"}
+    finally:
+        provider_stats.provider_performance = original
+
+if __name__ == "__main__":
+    test_provider_performance()
+    test_rank_providers()
+    logger.info("提供商路由测试通过")
@@ -0,0 +1,90 @@
+import os
+import time
+import tempfile
+import logging
+import subprocess
+import sys
+from backend.response_cache import ResponseCache, CachedStrategy
+from backend.http_clients import run_async, iterate_async
+from backend.model_strategies import FakeStrategy
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class CountingStrategy(FakeStrategy):
+    """记录调用次数的假策略"""
+
+    provider = "counting"
+    chat_model = "counting-chat"
+
+    def __init__(self):
+        self.calls = 0
+
+    def analyze_question(self, question: str, tone: str, length: str) -> str:
+        self.calls += 1
+        return f"分析{self.calls}"
+
+    def generate_answer(self, question, context, tone, word_count) -> str:
+        self.calls += 1
+        return f"回答{self.calls}"
+
+    async def aanalyze_question(self, question: str, tone: str, length: str) -> str:
+        return self.analyze_question(question, tone, length)
+
+    async def astream_answer(self, question, context, tone, word_count):
+        self.calls += 1
+        for piece in ["流式", f"回答{self.calls}"]:
+            yield piece
+
+def test_response_cache():
+    """测试内存LRU、磁盘持久化、有效期、长度上限和多进程共享"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, "responses.sqlite3")
+        cache = ResponseCache(db_path=db_path, ttl=0.3, memory_entries=1, max_entry_chars=10)
+        key = cache.make_key("zhipu", "glm-4", "问题：测试\n  要求：简短")
+        assert key == cache.make_key("zhipu", "glm-4", "  问题：测试\n要求：简短  ")
+        assert key != cache.make_key("qwen", "glm-4", "问题：测试\n要求：简短")
+
+        cache.put(key, "回复")
+        cache.put("too-long", "很长" * 10)
+        cache.put("other", "另一条")
+        assert cache.get(key) == "回复"  # 被LRU淘汰，从磁盘读取
+        assert cache.get(key) == "回复"
+        assert cache.get("too-long") is None
+        stats = cache.stats()
+        assert (stats["memory_hits"], stats["disk_hits"], stats["misses"]) == (1, 1, 1), stats
+
+        # 另一个进程写入的条目可以读到
+        script = (
+            "from backend.response_cache import ResponseCache;"
+            f"ResponseCache(db_path={db_path!r}).put('shared', '共享')"
+        )
+        subprocess.run([sys.executable, "-c", script], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        assert cache.get("shared") == "共享"
+
+        time.sleep(0.35)
+        assert cache.get(key) is None
+        logger.info(f"回复缓存统计: {cache.stats()}")
+
+def test_cached_strategy():
+    """测试包装后的策略在提示词相同时直接返回缓存的回复"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        inner = CountingStrategy()
+        strategy = CachedStrategy(inner, ResponseCache(db_path=os.path.join(temp_dir, "responses.sqlite3")))
+
+        assert strategy.analyze_question("问题", "专业", "简短") == "分析1"
+        assert run_async(strategy.aanalyze_question("问题", "专业", "简短")) == "分析1"
+        assert strategy.analyze_question("问题", "幽默", "简短") == "分析2"
+
+        assert list(iterate_async(strategy.astream_answer("问题", ["知识"], "专业", "300字"))) == ["流式", "回答3"]
+        assert list(iterate_async(strategy.astream_answer("问题", ["知识"], "专业", "300字"))) == ["流式回答3"]
+        assert strategy.generate_answer("问题", ["知识"], "专业", "300字") == "流式回答3"
+        assert strategy.generate_answer("问题", ["其他知识"], "专业", "300字") == "回答4"
+        assert inner.calls == 4
+        assert strategy.cache.hit_rate() > 0.4
+
+if __name__ == "__main__":
+    test_response_cache()
+    test_cached_strategy()
+    logger.info("回复缓存测试通过")
@@ -0,0 +1,66 @@
+import os
+import time
+import tempfile
+import logging
+from backend.http_clients import run_async
+from backend.lexical_index import tokenize
+from backend.semantic_answers import SemanticAnswerIndex, simhash, hamming_distance
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def _embed(text):
+    """用词袋向量模拟嵌入模型"""
+    vector = [0.0] * 64
+    for token in tokenize(text):
+        vector[sum(token.encode("utf-8")) % 64] += 1.0
+    return vector
+
+def test_simhash():
+    """测试措辞相近的问题签名距离较小"""
+    near = hamming_distance(simhash("AI会取代程序员吗"), simhash("AI会不会取代程序员？"))
+    far = hamming_distance(simhash("AI会取代程序员吗"), simhash("如何评价今年的高考作文题目"))
+    logger.info(f"相近问题距离 {near}，无关问题距离 {far}")
+    assert near < far
+    assert simhash("AI会取代程序员吗") == simhash("ai会取代程序员吗？")
+
+def test_semantic_answer_index():
+    """测试相似问题复用回答，风格不同、相似度不足或过期时不复用"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        index = SemanticAnswerIndex(db_path=os.path.join(temp_dir, "answers.sqlite3"), threshold=0.7, ttl=0.5)
+        embedded = []
+
+        async def aembed(text):
+            embedded.append(text)
+            return _embed(text)
+
+        def find(question, tone="专业", model="bow"):
+            return run_async(index.afind(question, tone, "简短", model, aembed))
+
+        question = "AI会取代程序员吗"
+        index.add(question, "专业", "简短", "bow", _embed(question), "不会完全取代", "zhipu")
+        index.add("零向量", "专业", "简短", "bow", [0.0] * 64, "不保存", "zhipu")
+
+        match = find("AI会不会取代程序员？")
+        assert match is not None and match.answer == "不会完全取代" and match.provider == "zhipu", match
+        assert find("AI会不会取代程序员？", tone="幽默") is None
+        assert find("AI会不会取代程序员？", model="other") is None
+
+        # SimHash预筛选没有候选时不计算嵌入向量
+        embedded.clear()
+        assert find("如何评价今年的高考作文题目") is None
+        assert embedded == []
+
+        # 知识库变化后清空，不再复用旧回答
+        index.clear()
+        assert find("AI会不会取代程序员？") is None
+        index.add(question, "专业", "简短", "bow", _embed(question), "不会完全取代", "zhipu")
+
+        time.sleep(0.6)
+        assert find(question) is None
+
+if __name__ == "__main__":
+    test_simhash()
+    test_semantic_answer_index()
+    logger.info("相似问题回答复用测试通过")